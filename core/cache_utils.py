@@ -42,7 +42,7 @@ def cache_view_result(timeout=None, key_prefix='view', cloudflare_aware=True):
                 
                 # For authenticated users, use local caching with user-specific cache key
                 # CRITICAL FIX: Include user ID in cache key to prevent cross-user data leakage
-                user_cache_key = f"{key_prefix}:user_{request.user.id}:{view_func.__name__}:{make_cache_key(*args, **kwargs)}"
+                user_cache_key = f"{key_prefix}:user_{request.user.id}:{view_func.__name__}:{make_cache_key(request.GET.urlencode(), *args, **kwargs)}"
                 result = cache.get(user_cache_key)
                 if result is not None:
                     return result
@@ -60,7 +60,7 @@ def cache_view_result(timeout=None, key_prefix='view', cloudflare_aware=True):
                     return view_func(request, *args, **kwargs)
                 
                 # Generate cache key for anonymous users only
-                cache_key = f"{key_prefix}:{view_func.__name__}:{make_cache_key(*args, **kwargs)}"
+                cache_key = f"{key_prefix}:{view_func.__name__}:{make_cache_key(request.GET.urlencode(), *args, **kwargs)}"
                 
                 # Try to get from cache
                 result = cache.get(cache_key)
@@ -0,0 +1,161 @@
+"""
+Idempotency-Key support for POST endpoints.
+
+A client that may retry a request (double clicks, flaky mobile networks)
+sends the same key with every attempt, as an Idempotency-Key header or an
+idempotency_key field of the form or JSON body. The first request claims the
+key and its response is stored in IdempotencyKey, retries get the stored
+response back with a single primary key lookup and the view, its queries and
+its gateway calls never run again.
+
+A retry that arrives while the first request is still running gets a 409,
+a key reused with a different payload a 422. A claim is a lease of
+IDEMPOTENCY_KEY_LEASE_SECONDS: when the request that holds it died without
+storing a response (crashed worker, killed process) a retry takes the key
+over instead of getting 409s until the key expires. Server errors are not
+stored so they can be retried. Keys expire after IDEMPOTENCY_KEY_TTL_HOURS, expired rows
+are reclaimed on reuse and purged by manage.py purge_idempotency_keys.
+"""
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from functools import wraps
+from datetime import timedelta
+from .models import IdempotencyKey
+import hashlib
+import json
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+# form fields that change between attempts of the same request
+_VOLATILE_FIELDS = {IDEMPOTENCY_FIELD, 'csrfmiddlewaretoken'}
+_FORM_CONTENT_TYPES = ('multipart/form-data', 'application/x-www-form-urlencoded')
+
+
+def _client_key(request):
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key:
+        return key
+    if request.content_type in _FORM_CONTENT_TYPES:
+        return request.POST.get(IDEMPOTENCY_FIELD)
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return None
+        if isinstance(data, dict) and isinstance(data.get(IDEMPOTENCY_FIELD), str):
+            return data[IDEMPOTENCY_FIELD]
+    return None
+
+
+def _fingerprint(request):
+    if request.content_type in _FORM_CONTENT_TYPES:
+        # multipart boundaries differ between attempts, compare the fields
+        payload = json.dumps(sorted(
+            (name, values) for name, values in request.POST.lists() if name not in _VOLATILE_FIELDS
+        )).encode('utf-8')
+    else:
+        payload = request.body
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _error(message, status):
+    return JsonResponse({
+        'status': 'error',
+        'success': False,
+        'errors': {'general': message}
+    }, status=status)
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(key, fingerprint):
+    """
+    (record, claimed): the new record of a key nobody holds, a record taken
+    over from a request whose lease ran out, or the live one of a retry
+    """
+    ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    lease = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_LEASE_SECONDS', 60))
+    for _ in range(2):
+        now = timezone.now()
+        record = IdempotencyKey.objects.filter(key=key).first()
+        if record is not None and record.expires_at > now:
+            abandoned = record.status_code is None and record.claimed_at <= now - lease
+            if not abandoned or record.fingerprint != fingerprint:
+                return record, False
+            # the claimed_at guard lets a single retry take it over
+            taken = IdempotencyKey.objects.filter(
+                key=key, status_code__isnull=True, claimed_at=record.claimed_at
+            ).update(claimed_at=now, expires_at=now + ttl)
+            if not taken:
+                continue
+            record.claimed_at, record.expires_at = now, now + ttl
+            return record, True
+        if record is not None:
+            IdempotencyKey.objects.filter(key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    key=key, fingerprint=fingerprint, claimed_at=now, expires_at=now + ttl
+                ), True
+        except IntegrityError:
+            # a concurrent attempt claimed it first, read its record
+            continue
+    return IdempotencyKey.objects.filter(key=key).first(), False
+
+
+def idempotent(view_func):
+    """
+    Replay the stored response to POSTs that repeat an Idempotency-Key
+
+    Requests without a key run as usual. Keys are scoped to the user and the
+    endpoint, apply it under login_required.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        client_key = _client_key(request) if request.method == 'POST' else None
+        if not client_key:
+            return view_func(request, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return _error('Idempotency key is too long', 400)
+
+        key = hashlib.sha256(f'{request.user.pk}:{request.path}:{client_key}'.encode('utf-8')).hexdigest()
+        fingerprint = _fingerprint(request)
+        record, claimed = _claim(key, fingerprint)
+
+        if not claimed:
+            if record is not None and record.fingerprint != fingerprint:
+                return _error('Idempotency key was already used for a different request', 422)
+            if record is None or record.status_code is None:
+                return _error('This request is already being processed', 409)
+            return _replay(record)
+
+        # a request that outlived its lease and was taken over leaves the key alone
+        lease = IdempotencyKey.objects.filter(key=key, claimed_at=record.claimed_at)
+        try:
+            response = view_func(request, *args, **kwargs)
+        except BaseException:
+            lease.delete()
+            raise
+
+        if response.streaming or response.status_code >= 500:
+            lease.delete()
+        else:
+            lease.update(
+                status_code=response.status_code,
+                content_type=response.get('Content-Type', ''),
+                location=response.get('Location', ''),
+                body=response.content,
+            )
+        return response
+    return wrapper
@@ -0,0 +1,104 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+from core.models import Wallet
+from decimal import Decimal
+from threading import Barrier, Lock, Thread
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    """
+    Measure wallet debit throughput, one buyer at a time and with concurrent
+    buyers spending the same wallet.
+
+    Every debit is a conditional UPDATE plus its Transaction row in one
+    transaction (see Wallet.debit). The command works on a throwaway user
+    that is deleted at the end, with its wallet and transactions. On SQLite a
+    debit that finds the database locked by another writer is retried and
+    counted as a conflict.
+    """
+
+    help = 'Benchmark Wallet.debit, sequential and concurrent'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--debits',
+            type=int,
+            default=500,
+            help='Debits per run (default: 500)',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Concurrent buyers in the second run (default: 8)',
+        )
+
+    def handle(self, *args, **options):
+        debits = options['debits']
+        threads = options['threads']
+        if debits <= 0 or threads <= 0:
+            raise CommandError('--debits and --threads must be positive numbers')
+
+        user = User.objects.create_user(username=f'wallet-benchmark-{uuid.uuid4().hex[:8]}')
+        try:
+            self.stdout.write(f"{'threads':>8} {'debits':>8} {'conflicts':>10} {'debits/s':>10}")
+            for workers in sorted({1, threads}):
+                self._run(user.wallet.pk, debits, workers)
+        finally:
+            user.delete()
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark finished, the benchmark user was deleted'))
+
+    def _run(self, wallet_pk, debits, workers):
+        amount = Decimal('1.00')
+        # enough for exactly `debits` debits, the one after them must be refused
+        Wallet.objects.filter(pk=wallet_pk).update(balance=amount * debits)
+        share = [debits // workers + (1 if i < debits % workers else 0) for i in range(workers)]
+        barrier = Barrier(workers + 1)
+        counts = {'done': 0, 'conflicts': 0, 'refused': 0}
+        lock = Lock()
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def buy(number):
+            wallet = Wallet.objects.get(pk=wallet_pk)
+            barrier.wait()
+            try:
+                for _ in range(number):
+                    while True:
+                        try:
+                            wallet.debit(amount)
+                            count('done')
+                            break
+                        except OperationalError as e:
+                            if 'locked' not in str(e):
+                                raise
+                            count('conflicts')
+            finally:
+                connections.close_all()
+
+        pool = [Thread(target=buy, args=(number,)) for number in share]
+        for thread in pool:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            Wallet.objects.get(pk=wallet_pk).debit(amount)
+        except ValueError:
+            counts['refused'] += 1
+
+        balance = Wallet.objects.get(pk=wallet_pk).balance
+        self.stdout.write(
+            f"{workers:>8} {counts['done']:>8} {counts['conflicts']:>10} {counts['done'] / elapsed:>10.0f}"
+        )
+        if balance != 0 or not counts['refused']:
+            self.stdout.write(self.style.ERROR(f'Balance ended at {balance}, the wallet was overspent'))
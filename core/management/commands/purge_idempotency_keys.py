@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """
+    Delete expired idempotency keys.
+
+    Expired keys are already ignored and reclaimed when a client reuses them,
+    this only keeps the table small. Rows are deleted in batches through the
+    expires_at index, run it from cron as often as convenient.
+    """
+
+    help = 'Delete expired idempotency keys in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of keys deleted per query (default: 5000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the expired keys without deleting them',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+
+        expired = IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+            deleted = expired.count()
+        else:
+            deleted = 0
+            while True:
+                keys = list(expired.values_list('pk', flat=True)[:batch_size])
+                if not keys:
+                    break
+                deleted += IdempotencyKey.objects.filter(pk__in=keys).delete()[0]
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Expired keys: {deleted}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\nDeleted {deleted} expired keys'))
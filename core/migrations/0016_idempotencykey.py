@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_alter_transaction_payment_gateway'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField(null=True)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('location', models.CharField(blank=True, max_length=500)),
+                ('body', models.BinaryField(default=b'')),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
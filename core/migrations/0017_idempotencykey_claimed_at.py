@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='claimed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
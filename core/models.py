@@ -1,8 +1,9 @@
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from numerize.numerize import numerize
 
 class Transaction(models.Model):
@@ -64,9 +65,26 @@ class Wallet(models.Model):
     def total_spent(self):
         return Transaction.objects.filter(wallet=self).aggregate(models.Sum('amount'))['amount__sum'] or 0
 
+    def _move_balance(self, delta: Decimal):
+        """
+        Add delta to the balance in one conditional UPDATE
+
+        The balance check and the write are the same statement, so concurrent
+        payments can't both pass the check, and no lock is held between them.
+
+        Raises:
+            ValueError: if the new balance would be less than 0
+        """
+        wallets = Wallet.objects.filter(pk=self.pk)
+        if delta < 0:
+            wallets = wallets.filter(balance__gte=-delta)
+        if not wallets.update(balance=models.F('balance') + delta):
+            raise ValueError("Insufficient funds")
+        self.refresh_from_db(fields=['balance'])
+
     def credit(self, amount: Decimal, transaction=None):
         """
-        credit the wallet
+        credit the wallet, the balance and the transaction are written together
 
         Args:
             amount (Decimal): the amount to credit
@@ -74,24 +92,22 @@ class Wallet(models.Model):
         Raises:
             ValueError: if the new balance is less than 0
         """
-        if self.balance + amount < 0:
-            raise ValueError("Insufficient funds")
-        self.balance += amount
-
-        # check if transaction exists
-        if transaction:
-            transaction.amount = amount
-            transaction.status = 'success'
-            transaction.description = "Credited"
-            transaction.save()
-        else:
-            # create transaction
-            Transaction.objects.create(wallet=self, amount=amount, type='credit', status='success', description="Credited")
-        self.save()
+        with db_transaction.atomic():
+            self._move_balance(amount)
+
+            # check if transaction exists
+            if transaction:
+                transaction.amount = amount
+                transaction.status = 'success'
+                transaction.description = "Credited"
+                transaction.save()
+            else:
+                # create transaction
+                Transaction.objects.create(wallet=self, amount=amount, type='credit', status='success', description="Credited")
 
     def debit(self, amount: Decimal, transaction=None):
         """
-          debit the wallet
+          debit the wallet, the balance and the transaction are written together
 
         Args:
             amount (Decimal): the amount to debit
@@ -99,20 +115,18 @@ class Wallet(models.Model):
         Raises:
             ValueError: if the new balance is less than 0
         """
-        if self.balance - amount < 0:
-            raise ValueError("Insufficient funds")
-        self.balance -= amount
-
-        # check if transaction exists
-        if transaction:
-            transaction.amount = amount
-            transaction.status = 'success'
-            transaction.description = "Debited"
-            transaction.save()
-        else:
-            # create transaction
-            Transaction.objects.create(wallet=self, amount=amount, type='debit', status='success', description="Debited")
-        self.save()
+        with db_transaction.atomic():
+            self._move_balance(-amount)
+
+            # check if transaction exists
+            if transaction:
+                transaction.amount = amount
+                transaction.status = 'success'
+                transaction.description = "Debited"
+                transaction.save()
+            else:
+                # create transaction
+                Transaction.objects.create(wallet=self, amount=amount, type='debit', status='success', description="Debited")
 
     def refund(self, amount: Decimal, transaction_id: str):
         """
@@ -130,11 +144,32 @@ class Wallet(models.Model):
         if transaction.type != 'debit':
             raise ValueError("Transaction is not a debit")
 
-        self.balance += amount
-        # create transaction
-        Transaction.objects.create(wallet=self, amount=amount, type='refund', status='success', description="Refunded")
-        self.save()
+        with db_transaction.atomic():
+            self._move_balance(amount)
+            # create transaction
+            Transaction.objects.create(wallet=self, amount=amount, type='refund', status='success', description="Refunded")
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response of a POST sent with an Idempotency-Key, replayed to retries
+    of that request until expires_at (see core/idempotency.py).
+
+    key is a digest of the user, the endpoint and the client key, fingerprint a
+    digest of the request payload. status_code is null while the request that
+    claimed the key at claimed_at is still running.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    claimed_at = models.DateTimeField(default=timezone.now)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    body = models.BinaryField(default=b'')
+    expires_at = models.DateTimeField(db_index=True)
 
+    def __str__(self):
+        return self.key
 
 
 @receiver(post_save, sender=User)
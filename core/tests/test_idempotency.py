@@ -0,0 +1,139 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.models import IdempotencyKey, Transaction
+from marketplace.checkout import CartError, place_order as real_place_order
+from marketplace.models import SocialMediaAccount, Order, Log
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import json
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.account = SocialMediaAccount.objects.create(title='Test Account', description='Test', price=Decimal('10.00'))
+        Log.objects.bulk_create([Log(account=self.account, log_data=f'user{i}:pass') for i in range(5)])
+        SocialMediaAccount.recount_stock([self.account.pk])
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.user.wallet.balance = Decimal('100.00')
+        self.user.wallet.save()
+        self.client.force_login(self.user)
+
+    def checkout(self, quantity, key='key-1'):
+        return self.client.post(reverse('marketplace:checkout'), {
+            'cart_data': json.dumps([{'id': self.account.pk, 'quantity': quantity}]),
+            'idempotency_key': key,
+        })
+
+    def test_retried_checkout_replays_the_first_response(self):
+        first = self.checkout(2)
+        self.assertEqual(first.status_code, 302)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.checkout(2)
+        self.assertEqual(retry.status_code, 302)
+        self.assertEqual(retry['Location'], first['Location'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        # the view did not run again
+        self.assertFalse([q for q in queries if 'marketplace_' in q['sql']])
+        self.assertEqual(Order.objects.count(), 1)
+
+        # a new key is a new order, the same key with another cart is refused
+        self.assertEqual(self.checkout(1, key='key-2').status_code, 302)
+        self.assertEqual(self.checkout(1).status_code, 422)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_retry_during_the_first_request_is_refused(self):
+        retries = []
+
+        def place_order(*args):
+            # the client retries while the first request is still running
+            retries.append(self.checkout(2))
+            raise CartError('stopped')
+
+        with mock.patch('marketplace.views.place_order', side_effect=place_order):
+            self.checkout(2)
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertFalse(Order.objects.exists())
+
+    def test_abandoned_key_is_taken_over_after_the_lease(self):
+        # a request that claimed the key and died before storing its response
+        retries = []
+
+        def place_order(*args):
+            if retries:
+                return real_place_order(*args)
+            IdempotencyKey.objects.update(claimed_at=timezone.now() - timedelta(minutes=5))
+            retries.append(None)
+            retries[0] = self.checkout(2)
+            raise CartError('stopped')
+
+        with mock.patch('marketplace.views.place_order', side_effect=place_order):
+            self.checkout(2)
+        # the retry ran the view and stored its response, the dead request didn't touch it
+        self.assertEqual(retries[0].status_code, 302)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 302)
+        self.assertEqual(self.checkout(2)['Idempotent-Replayed'], 'true')
+
+    def test_live_lease_is_not_taken_over(self):
+        self.checkout(2)
+        IdempotencyKey.objects.update(status_code=None)
+        self.assertEqual(self.checkout(2).status_code, 409)
+        self.assertEqual(self.checkout(1).status_code, 422)
+
+    def test_retried_confirm_payment_debits_once(self):
+        self.checkout(2)
+        order = Order.objects.get()
+        self.client.get(reverse('marketplace:password_confirm', args=[order.order_number]))
+
+        responses = [
+            self.client.post(
+                reverse('marketplace:confirm_payment'), json.dumps({'order_number': order.order_number}),
+                content_type='application/json', headers={'Idempotency-Key': 'pay-1'}
+            )
+            for _ in range(3)
+        ]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200])
+        self.assertEqual(len({r.content for r in responses}), 1)
+        self.user.wallet.refresh_from_db()
+        self.assertEqual(self.user.wallet.balance, Decimal('80.00'))
+
+    def test_expired_key_runs_again(self):
+        self.checkout(2)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.checkout(2)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_initiate_payment_calls_the_gateway_once(self):
+        gateway = mock.Mock(status_code=200)
+        gateway.json.return_value = {'data': {'checkout_url': 'https://checkout.example/pay'}}
+        with mock.patch('core.views.PAYMENT_GATEWAYS', {'korapay': {'min_amount': 1000, 'max_amount': 100000}}), \
+                mock.patch('core.views.requests.post', return_value=gateway) as post:
+            responses = [
+                self.client.post(
+                    reverse('initiate_payment'), json.dumps({'amount': 5000, 'gateway': 'korapay', 'idempotency_key': 'topup-1'}),
+                    content_type='application/json'
+                )
+                for _ in range(2)
+            ]
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(responses[0].content, responses[1].content)
+        self.assertEqual(Transaction.objects.filter(type='credit').count(), 1)
+
+    def test_purge(self):
+        self.checkout(1, key='old')
+        self.checkout(1, key='new')
+        IdempotencyKey.objects.filter(pk__in=IdempotencyKey.objects.order_by('expires_at').values('pk')[:1]).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.db import connections, OperationalError
+from django.test import TestCase, TransactionTestCase
+from core.models import Wallet, Transaction
+from decimal import Decimal
+from threading import Barrier, Thread
+import random
+import time
+
+
+class WalletTests(TestCase):
+    def setUp(self):
+        self.wallet = User.objects.create_user(username='buyer').wallet
+        self.wallet.balance = Decimal('50.00')
+        self.wallet.save()
+
+    def test_debit_and_credit(self):
+        self.wallet.debit(Decimal('20.00'))
+        self.assertEqual(self.wallet.balance, Decimal('30.00'))
+        self.wallet.credit(Decimal('5.00'))
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('35.00'))
+        self.assertEqual(
+            list(Transaction.objects.order_by('pk').values_list('type', 'amount', 'status')),
+            [('debit', Decimal('20.00'), 'success'), ('credit', Decimal('5.00'), 'success')],
+        )
+
+    def test_overdraft_writes_nothing(self):
+        pending = Transaction.objects.create(wallet=self.wallet, type='debit', amount=Decimal('60.00'), description='Pending')
+        with self.assertRaises(ValueError):
+            self.wallet.debit(Decimal('60.00'), pending)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'pending')
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('50.00'))
+
+    def test_stale_instance_does_not_overspend(self):
+        stale = Wallet.objects.get(pk=self.wallet.pk)
+        self.wallet.debit(Decimal('40.00'))
+        # the copy still believes there are 50.00
+        with self.assertRaises(ValueError):
+            stale.debit(Decimal('20.00'))
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).balance, Decimal('10.00'))
+
+
+class ConcurrentDebitTests(TransactionTestCase):
+    def test_no_overspend(self):
+        wallet = User.objects.create_user(username='buyer').wallet
+        wallet.balance = Decimal('200.00')
+        wallet.save()
+
+        buyers = 40
+        barrier = Barrier(buyers)
+        results, errors = [], []
+
+        def buy():
+            try:
+                own = Wallet.objects.get(pk=wallet.pk)
+                barrier.wait()
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    try:
+                        own.debit(Decimal('10.00'))
+                        results.append(True)
+                        return
+                    except ValueError:
+                        results.append(False)
+                        return
+                    except OperationalError as e:
+                        # SQLite test databases refuse a second writer instead of waiting
+                        if 'locked' not in str(e):
+                            raise
+                        time.sleep(random.uniform(0.005, 0.02))
+                raise AssertionError('database stayed locked')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=buy) for _ in range(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # 40 buyers want 400.00 out of 200.00, exactly 20 debits go through
+        self.assertEqual(results.count(True), 20)
+        self.assertEqual(Wallet.objects.get(pk=wallet.pk).balance, Decimal('0.00'))
+        self.assertEqual(Transaction.objects.filter(wallet=wallet, type='debit').count(), 20)
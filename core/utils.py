@@ -85,7 +85,6 @@ class ProcessKorapayPayment:
             if transaction.status == 'success':
                 return HttpResponse("Charge Success", status=200)
             wallet.credit(transaction.amount, transaction)
-            wallet.save()
             
             return HttpResponse("Charge Success", status=200)
         except Exception as e:
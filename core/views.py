@@ -15,6 +15,7 @@ from .utils import ProcessKorapayPayment, caluate_gateway_fee
 import requests
 from django.views.decorators.csrf import csrf_exempt
 from core.models import Wallet, Transaction
+from core.idempotency import idempotent
 from marketplace.models import Order
 import hmac
 import hashlib
@@ -465,6 +466,7 @@ def add_funds(request):
 
 @login_required
 @require_http_methods(["POST", "GET"])
+@idempotent
 def initiate_payment(request):
 
     if request.method == "GET":
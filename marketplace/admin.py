@@ -1,17 +1,109 @@
-from django.contrib import admin
-from .models import SocialMediaAccount, Order, OrderItem, Log, Category
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import render
+from .models import SocialMediaAccount, Order, OrderItem, Log, Category, SoldLog, StockReservation, FulfillmentJob
+from .search import search_account_ids
+from .importer import import_logs, detect_format, FORMATS
+import io
+
+
+class LogImportForm(forms.Form):
+    file = forms.FileField(help_text='txt: one log per line, CSV: a log_data column, JSONL: {"log_data": ...} per line')
+    format = forms.ChoiceField(
+        choices=[('', 'Guess from the file name')] + [(file_format, file_format) for file_format in FORMATS],
+        required=False,
+    )
+
+
+def render_reorder_page(request, title, groups):
+    """
+    Drag-and-drop page posting the complete new ordering to marketplace:reorder.
+
+    groups is a list of (category or None, items): None orders the categories
+    themselves, a category orders its accounts.
+    """
+    return render(request, 'admin/marketplace/reorder.html', {
+        **admin.site.each_context(request),
+        'title': title,
+        'groups': groups,
+    })
+
 
 class SocialMediaAccountAdmin(admin.ModelAdmin):
-    list_display = ('position', 'title', 'category', 'price', 'is_active')
-    search_fields = ('category', 'title')
+    list_display = ('position', 'title', 'category', 'price', 'stock', 'is_active')
+    search_fields = ('title',)
     list_filter = ('category', 'is_active')
     ordering = ('position',)
+    actions = ('reorder_accounts', 'import_logs_from_file')
+
+    @admin.action(description='Reorder the accounts of the selected categories', permissions=['change'])
+    def reorder_accounts(self, request, queryset):
+        category_ids = set(queryset.exclude(category=None).values_list('category_id', flat=True))
+        accounts = SocialMediaAccount.objects.filter(category_id__in=category_ids).select_related('category')
+        groups = {}
+        for account in accounts:
+            groups.setdefault(account.category, []).append(account)
+        return render_reorder_page(request, 'Reorder accounts', list(groups.items()))
+
+    def has_add_log_permission(self, request):
+        """The import creates logs and moves stock, it needs the permission to add logs"""
+        return request.user.has_perm('marketplace.add_log')
+
+    @admin.action(description='Import logs from a file', permissions=['add_log'])
+    def import_logs_from_file(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, 'Select exactly one account to import logs into', messages.ERROR)
+            return None
+        account = queryset.get()
+
+        form = LogImportForm(request.POST, request.FILES) if 'apply' in request.POST else LogImportForm()
+        if form.is_bound and form.is_valid():
+            upload = form.cleaned_data['file']
+            file_format = form.cleaned_data['format'] or detect_format(upload.name)
+            # parsed in the request process, use manage.py import_logs for very large files
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8', errors='replace', newline='')
+            try:
+                result = import_logs(account, stream, file_format)
+            except ValueError as e:
+                self.message_user(request, str(e), messages.ERROR)
+                return None
+            self.message_user(
+                request,
+                f"Imported {result['created']} logs into {account}, skipped {result['duplicates']} duplicates "
+                f"and {result['invalid']} invalid lines",
+                messages.WARNING if result['invalid'] else messages.SUCCESS,
+            )
+            return None
+
+        return render(request, 'admin/marketplace/import_logs.html', {
+            **admin.site.each_context(request),
+            'title': f'Import logs into {account}',
+            'account': account,
+            'form': form,
+        })
+
+    def get_search_results(self, request, queryset, search_term):
+        # use the full-text index instead of LIKE scans, inactive accounts included
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pk__in=search_account_ids(search_term, limit=1000, active_only=False)[0]), False
+
+class StockReservationInline(admin.TabularInline):
+    model = StockReservation
+    extra = 0
+    readonly_fields = ('account', 'quantity', 'expires_at')
+    fields = ('account', 'quantity', 'expires_at')
+    verbose_name_plural = 'Stock held until payment'
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_number', 'user', 'status', 'total_amount', 'created_at')
     search_fields = ('order_number',)
     list_filter = ('status',)
     ordering = ('-created_at',)
+    inlines = [StockReservationInline]
 
 
 class LogInline(admin.TabularInline):
@@ -21,11 +113,22 @@ class LogInline(admin.TabularInline):
     fields = ('order_item', 'account', 'timestamp', 'is_active')  # Specify the order of fields
     can_delete = False  # Prevent deleting logs
 
+class SoldLogInline(admin.TabularInline):
+    model = SoldLog
+    extra = 0
+    readonly_fields = ('account', 'timestamp', 'archived_at')
+    fields = ('account', 'timestamp', 'archived_at')
+    can_delete = False
+    verbose_name_plural = 'Archived logs'
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('order', 'account', 'quantity', 'price')
     search_fields = ('order__order_number',)
     ordering = ('order',)
-    inlines = [LogInline]
+    inlines = [LogInline, SoldLogInline]
 
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('transaction_id', 'order', 'amount', 'status', 'created_at')
@@ -38,16 +141,37 @@ class LogAdmin(admin.ModelAdmin):
     search_fields = ('account__social_media',)
     ordering = ('-timestamp',)
     
+class SoldLogAdmin(admin.ModelAdmin):
+    list_display = ('account', 'order_item', 'timestamp', 'archived_at')
+    ordering = ('-archived_at',)
+
+    def has_add_permission(self, request):
+        return False
+
+class FulfillmentJobAdmin(admin.ModelAdmin):
+    list_display = ('order', 'attempts', 'next_attempt_at', 'created_at')
+    readonly_fields = ('order', 'attempts', 'last_error', 'created_at')
+    ordering = ('next_attempt_at', 'id')
+
+    def has_add_permission(self, request):
+        return False
+
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('position','name', 'slug')
     search_fields = ('name',)
     ordering = ('position',)
+    actions = ('reorder_categories',)
     # slug automatically generated
     prepopulated_fields = {'slug': ('name',)}
 
+    @admin.action(description='Reorder all categories', permissions=['change'])
+    def reorder_categories(self, request, queryset):
+        return render_reorder_page(request, 'Reorder categories', [(None, list(Category.objects.all()))])
+
 # Register the models with the admin site
 admin.site.register(SocialMediaAccount, SocialMediaAccountAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Log, LogAdmin)
+admin.site.register(SoldLog, SoldLogAdmin)
 admin.site.register(Category, CategoryAdmin)
\ No newline at end of file
@@ -0,0 +1,376 @@
+from itertools import groupby
+from decimal import Decimal
+from functools import partial
+from django.core.cache import cache
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CharField, F, Q, Value, Window, Count, Min, Max
+from django.db.models.functions import Concat, RowNumber
+from django.utils import timezone
+from numerize.numerize import numerize
+from .models import SocialMediaAccount, Category, CatalogSnapshot
+from .events import publish_stock_changes
+from .reservations import with_available_stock
+
+
+# Number of accounts shown per category on the home page
+HOME_ACCOUNTS_PER_CATEGORY = 8
+
+# Bump when the snapshot payload format changes, older snapshots get rebuilt
+SNAPSHOT_VERSION = 3
+HOME_SNAPSHOT_KEY = 'home'
+
+
+def serialize_account(account: SocialMediaAccount):
+    """
+    Build the dict the listing templates render for an account
+
+    The account must come from a with_available_stock() queryset, the stock
+    shown is what can still be bought, stock held by unpaid orders excluded.
+    """
+    available = max(account.available, 0)
+    # format followers count to 1000 to 1k or 5000
+    followers_count = account.followers_count
+    try:
+        formatted_followers = numerize(followers_count, 2)
+    except:
+        formatted_followers = followers_count
+
+    return {
+        'id': account.id,
+        'title': f"{account.social_media} | {formatted_followers} followers" if not account.title else account.title,
+        'description': account.description,
+        'price': account.price,
+        'stock': available,
+        'inStock': available > 0,
+        'verification_status': f"{account.verification_status}".replace('_', ' '),
+        'account_age': account.account_age,
+    }
+
+
+def home_catalog_queryset(per_category=HOME_ACCOUNTS_PER_CATEGORY):
+    """
+    Active accounts for the home page, at most per_category rows per category.
+
+    ROW_NUMBER() is computed per category in the database, so only the rows
+    that are displayed are fetched no matter how large the catalog is. Rows
+    come back ordered by category position, then account position.
+    """
+    return (
+        with_available_stock(SocialMediaAccount.objects.filter(is_active=True, category__isnull=False))
+        .select_related('category')
+        .annotate(category_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('category')],
+            order_by=[F('position').asc(), F('position_created_at').asc()],
+        ))
+        .filter(category_rank__lte=per_category)
+        .order_by('category__position', 'category__created_at', 'category_id', 'position', 'position_created_at')
+    )
+
+
+def group_home_catalog(accounts):
+    """
+    Group the rows of home_catalog_queryset() into the structure
+    marketplace.html renders.
+    """
+    grouped_accounts = []
+    for category, category_accounts in groupby(accounts, key=lambda account: account.category):
+        grouped_accounts.append({
+            "name": category.name,
+            "slug": category.slug,
+            "id": category.name,
+            "accounts": [serialize_account(account) for account in category_accounts],
+        })
+    return grouped_accounts
+
+
+def load_home_catalog(per_category=HOME_ACCOUNTS_PER_CATEGORY):
+    """Grouped home page catalog in a single query"""
+    return group_home_catalog(home_catalog_queryset(per_category))
+
+
+def category_snapshot_key(slug):
+    return f'category:{slug}'
+
+
+def build_home_snapshot():
+    return {'grouped_accounts': load_home_catalog()}
+
+
+def build_category_snapshot(category: Category):
+    accounts = with_available_stock(SocialMediaAccount.objects.filter(is_active=True, category=category)).select_related('category')
+    return {
+        'accounts': [serialize_account(account) for account in accounts],
+        'facets': category_facets(category),
+    }
+
+
+# view_all sort options, the composite indexes on SocialMediaAccount back them
+ACCOUNT_SORTS = {
+    'position': ('position', 'position_created_at'),
+    'price': ('price', 'position'),
+    '-price': ('-price', 'position'),
+    'followers': ('followers_count', 'position'),
+    '-followers': ('-followers_count', 'position'),
+}
+
+
+def parse_account_filters(params):
+    """
+    Valid view_all facet filters of a query dict, invalid values are ignored.
+
+    Supported: min_price, max_price, min_followers, verification_status,
+    account_age, in_stock=1 and sort (one of ACCOUNT_SORTS).
+    """
+    filters = {}
+    for name in ('min_price', 'max_price'):
+        try:
+            value = Decimal(params[name])
+        except (KeyError, ArithmeticError):
+            continue
+        if value.is_finite():
+            filters[name] = value
+    if params.get('min_followers', '').isdigit():
+        filters['min_followers'] = int(params['min_followers'])
+    if params.get('verification_status') in dict(SocialMediaAccount.VERIFICATION_STATUS_CHOICES):
+        filters['verification_status'] = params['verification_status']
+    if params.get('account_age'):
+        filters['account_age'] = params['account_age'][:4]
+    if params.get('in_stock') in ('1', 'true', 'on'):
+        filters['in_stock'] = True
+    if params.get('sort') in ACCOUNT_SORTS:
+        filters['sort'] = params['sort']
+    return filters
+
+
+def filter_category_accounts(slug, filters):
+    """Serialized active accounts of a category matching the facet filters, in one query"""
+    accounts = with_available_stock(SocialMediaAccount.objects.filter(is_active=True, category__slug=slug)).select_related('category')
+    if 'min_price' in filters:
+        accounts = accounts.filter(price__gte=filters['min_price'])
+    if 'max_price' in filters:
+        accounts = accounts.filter(price__lte=filters['max_price'])
+    if 'min_followers' in filters:
+        accounts = accounts.filter(followers_count__gte=filters['min_followers'])
+    if 'verification_status' in filters:
+        accounts = accounts.filter(verification_status=filters['verification_status'])
+    if 'account_age' in filters:
+        accounts = accounts.filter(account_age=filters['account_age'])
+    if filters.get('in_stock'):
+        accounts = accounts.filter(available__gt=0)
+    accounts = accounts.order_by(*ACCOUNT_SORTS[filters.get('sort', 'position')])
+    return [serialize_account(account) for account in accounts]
+
+
+def category_facets(category: Category):
+    """
+    Facet counts of the active accounts of a category, from one grouped query.
+    """
+    rows = (
+        with_available_stock(SocialMediaAccount.objects.filter(is_active=True, category=category))
+        .order_by()
+        .values('verification_status', 'account_age')
+        .annotate(
+            count=Count('pk'),
+            in_stock=Count('pk', filter=Q(available__gt=0)),
+            min_price=Min('price'),
+            max_price=Max('price'),
+        )
+    )
+
+    statuses, ages = {}, {}
+    facets = {'in_stock': 0, 'min_price': None, 'max_price': None}
+    for row in rows:
+        if row['verification_status']:
+            statuses[row['verification_status']] = statuses.get(row['verification_status'], 0) + row['count']
+        if row['account_age']:
+            ages[row['account_age']] = ages.get(row['account_age'], 0) + row['count']
+        facets['in_stock'] += row['in_stock']
+        facets['min_price'] = min(filter(None, [facets['min_price'], row['min_price']]), default=None)
+        facets['max_price'] = max(filter(None, [facets['max_price'], row['max_price']]), default=None)
+
+    labels = dict(SocialMediaAccount.VERIFICATION_STATUS_CHOICES)
+    facets['verification_status'] = [
+        {'value': value, 'label': labels.get(value, value), 'count': count} for value, count in sorted(statuses.items())
+    ]
+    facets['account_age'] = [{'value': value, 'count': count} for value, count in sorted(ages.items())]
+    return facets
+
+
+def _store_snapshot(key, payload):
+    fields = {'version': SNAPSHOT_VERSION, 'payload': payload, 'built_at': timezone.now()}
+    updated = CatalogSnapshot.objects.filter(key=key).update(revision=F('revision') + 1, **fields)
+    if not updated:
+        _, created = CatalogSnapshot.objects.get_or_create(key=key, defaults={'revision': 1, **fields})
+        if not created:
+            # someone else created it in the meantime
+            CatalogSnapshot.objects.filter(key=key).update(revision=F('revision') + 1, **fields)
+
+    revision, built_at = CatalogSnapshot.objects.filter(key=key).values_list('revision', 'built_at').get()
+    cache.set(f'catalog_snapshot:{key}', payload, settings.CACHE_TIMEOUT_VERY_LONG)
+    cache.set(f'catalog_version:{key}', (revision, built_at), settings.CACHE_TIMEOUT_VERY_LONG)
+    return payload
+
+
+def _load_snapshot(key):
+    payload = cache.get(f'catalog_snapshot:{key}')
+    if payload is not None:
+        return payload
+
+    snapshot = CatalogSnapshot.objects.filter(key=key, version=SNAPSHOT_VERSION).values_list('payload', flat=True).first()
+    if snapshot is not None:
+        cache.set(f'catalog_snapshot:{key}', snapshot, settings.CACHE_TIMEOUT_VERY_LONG)
+    return snapshot
+
+
+def get_catalog_version(key):
+    """
+    (revision, built_at) of a snapshot, or None if it was never built.
+
+    This is all a conditional GET needs, it is a single cache read while the
+    version is cached.
+    """
+    version = cache.get(f'catalog_version:{key}')
+    if version is None:
+        version = CatalogSnapshot.objects.filter(key=key, version=SNAPSHOT_VERSION).values_list('revision', 'built_at').first()
+        if version is not None:
+            cache.set(f'catalog_version:{key}', version, settings.CACHE_TIMEOUT_VERY_LONG)
+    return version
+
+
+def load_home_snapshot():
+    """Prepared home page payload, built on the first read if missing"""
+    payload = _load_snapshot(HOME_SNAPSHOT_KEY)
+    if payload is None:
+        payload = _store_snapshot(HOME_SNAPSHOT_KEY, build_home_snapshot())
+    return payload
+
+
+def load_category_snapshot(slug):
+    """
+    Prepared view_all payload of a category, built on the first read if missing.
+    Unknown slugs get an empty payload that is never stored.
+    """
+    payload = _load_snapshot(category_snapshot_key(slug))
+    if payload is None:
+        category = Category.objects.filter(slug=slug).first()
+        if category is None:
+            return {'accounts': []}
+        payload = _store_snapshot(category_snapshot_key(slug), build_category_snapshot(category))
+    return payload
+
+
+def rebuild_catalog_snapshots(category_ids=None):
+    """
+    Rebuild the home page snapshot and the snapshots of the given categories.
+
+    Without category_ids every category is rebuilt and snapshots of categories
+    that no longer exist are dropped.
+    """
+    _store_snapshot(HOME_SNAPSHOT_KEY, build_home_snapshot())
+
+    categories = Category.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(pk__in=category_ids)
+
+    keys = []
+    for category in categories:
+        keys.append(category_snapshot_key(category.slug))
+        _store_snapshot(keys[-1], build_category_snapshot(category))
+
+    if category_ids is None:
+        stale = CatalogSnapshot.objects.exclude(key__in=keys + [HOME_SNAPSHOT_KEY])
+        for key in stale.values_list('key', flat=True):
+            cache.delete_many([f'catalog_snapshot:{key}', f'catalog_version:{key}'])
+        stale.delete()
+    return len(keys)
+
+
+class _CatalogChanges:
+    """The catalog changes of one transaction, flushed by its on_commit callback"""
+
+    def __init__(self):
+        self.account_ids, self.category_ids, self.all_categories = set(), set(), False
+
+    def __call__(self):
+        if getattr(connection, '_catalog_changes', None) is self:
+            connection._catalog_changes = None
+        _flush_catalog_changes(self)
+
+
+def mark_catalog_changed(account_ids=(), category_ids=(), all_categories=False):
+    """
+    Schedule a snapshot rebuild and a stock event broadcast once the current
+    transaction commits.
+
+    Changes are collected on the connection and flushed by a single on_commit
+    callback, so saving hundreds of rows in one transaction still rebuilds
+    each affected snapshot once.
+    """
+    changes = getattr(connection, '_catalog_changes', None)
+    # a rollback drops the callback of the batch, and its changes with it
+    scheduled = changes is not None and any(entry[1] is changes for entry in connection.run_on_commit)
+    if not scheduled:
+        changes = connection._catalog_changes = _CatalogChanges()
+    changes.account_ids.update(account_ids)
+    changes.category_ids.update(category_ids)
+    changes.all_categories = changes.all_categories or all_categories
+    if not scheduled:
+        # runs right away outside a transaction
+        transaction.on_commit(changes)
+
+
+def mark_stock_changed(account_ids):
+    """
+    Publish the available stock of accounts whose holds moved once the current
+    transaction commits, and flag the snapshots showing them as stale.
+
+    Holds come and go with every checkout, so unlike mark_catalog_changed()
+    nothing is rebuilt here: rebuild_stale_snapshots() rebuilds each flagged
+    snapshot once, however many holds moved it in the meantime.
+    """
+    account_ids = set(account_ids)
+    if account_ids:
+        transaction.on_commit(partial(_flush_stock_changes, account_ids))
+
+
+def _flush_stock_changes(account_ids):
+    # category_snapshot_key() of the accounts, in the same UPDATE
+    keys = SocialMediaAccount.objects.filter(pk__in=account_ids, category__isnull=False).values(
+        key=Concat(Value('category:'), 'category__slug', output_field=CharField())
+    )
+    CatalogSnapshot.objects.filter(Q(key=HOME_SNAPSHOT_KEY) | Q(key__in=keys), stale=False).update(stale=True)
+    publish_stock_changes(account_ids)
+
+
+def rebuild_stale_snapshots():
+    """Rebuild the snapshots flagged by mark_stock_changed(), returns the number rebuilt"""
+    keys = list(CatalogSnapshot.objects.filter(stale=True).values_list('key', flat=True))
+    if not keys:
+        return 0
+
+    # cleared first, a hold committed during the rebuild flags the snapshot again
+    CatalogSnapshot.objects.filter(key__in=keys).update(stale=False)
+    if HOME_SNAPSHOT_KEY in keys:
+        _store_snapshot(HOME_SNAPSHOT_KEY, build_home_snapshot())
+    for category in Category.objects.filter(slug__in=[key.split(':', 1)[1] for key in keys if key != HOME_SNAPSHOT_KEY]):
+        _store_snapshot(category_snapshot_key(category.slug), build_category_snapshot(category))
+    return len(keys)
+
+
+def _flush_catalog_changes(changes):
+    account_ids, category_ids, all_categories = changes.account_ids, changes.category_ids, changes.all_categories
+    if not (account_ids or category_ids or all_categories):
+        return
+
+    if all_categories:
+        rebuild_catalog_snapshots()
+    else:
+        category_ids |= set(
+            SocialMediaAccount.objects.filter(pk__in=account_ids, category__isnull=False)
+            .values_list('category_id', flat=True)
+        )
+        rebuild_catalog_snapshots(category_ids)
+
+    publish_stock_changes(account_ids)
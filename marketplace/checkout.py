@@ -0,0 +1,121 @@
+"""
+Turning a cart into an order.
+
+A cart costs the same handful of queries whatever its size: the accounts are
+locked and read with one in_bulk(), the order is written once with its total,
+the items with one bulk_create() and the stock is checked and held for all
+accounts at once by hold_stock(). Everything happens in one transaction, an order that
+can't be held is never written.
+
+buy_with_wallet() goes all the way in that same transaction: it pays the
+order from the wallet and allocates the logs, for the buy now endpoint.
+"""
+from django.db import transaction
+from core.models import Transaction, Wallet
+from .models import Order, OrderItem
+from .reservations import lock_accounts, hold_stock, release_order
+from decimal import Decimal
+
+
+class CartError(ValueError):
+    """Raised for cart data that can't become an order"""
+
+
+class InsufficientFunds(Exception):
+    """Raised when the wallet can't pay for an order"""
+
+
+def parse_cart(cart_data):
+    """
+    {account id: units} of cart data ([{"id": ..., "quantity": ...}, ...]),
+    lines of the same account are added up
+
+    Raises:
+        CartError: if the cart is empty or a line is malformed
+    """
+    if not cart_data or not isinstance(cart_data, list):
+        raise CartError('No items in cart')
+
+    quantities = {}
+    for item_data in cart_data:
+        try:
+            account_id, quantity = int(item_data['id']), int(item_data['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise CartError('Invalid cart item')
+        if quantity <= 0:
+            raise CartError('Invalid quantity')
+        quantities[account_id] = quantities.get(account_id, 0) + quantity
+    return quantities
+
+
+def place_order(user, quantities):
+    """
+    Create a pending order for quantities ({account id: units}) and hold its stock
+
+    Raises:
+        CartError: if an account doesn't exist
+        InsufficientStock: if an account doesn't have the units available
+    """
+    with transaction.atomic():
+        # the prices are read with the locks hold_stock() needs, see reservations.py
+        accounts = lock_accounts(quantities).only('pk', 'price').in_bulk()
+        missing = set(quantities) - set(accounts)
+        if missing:
+            raise CartError(f'Account {min(missing)} does not exist')
+
+        order = Order.objects.create(
+            user=user,
+            total_amount=sum((accounts[pk].price * quantity for pk, quantity in quantities.items()), Decimal('0.00')),
+            status='pending',
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, account_id=pk, quantity=quantity, price=accounts[pk].price)
+            for pk, quantity in quantities.items()
+        ])
+
+        # hold the units until the order is paid, the new order has no holds to replace
+        hold_stock(order, quantities)
+    return order
+
+
+def buy_with_wallet(user, quantities):
+    """
+    Place, pay and fulfil an order for quantities ({account id: units}) in one transaction
+
+    The debit is a conditional UPDATE of the wallet (see Wallet.debit) and the
+    logs are allocated before the commit, the returned order is completed with
+    every item holding its full quantity. Any failure rolls everything back,
+    the debit included.
+
+    Raises:
+        CartError: if an account doesn't exist
+        InsufficientStock: if an account doesn't have the units available, or
+            fewer active logs than its stock counter says (a short allocation)
+        InsufficientFunds: if the wallet balance doesn't cover the total
+    """
+    with transaction.atomic():
+        order = place_order(user, quantities)
+
+        wallet = Wallet.objects.get(user=user)
+        payment = Transaction.objects.create(
+            payment_reference=order.order_number,
+            payment_gateway='wallet',
+            wallet=wallet,
+            type='debit',
+            amount=order.total_amount,
+            description="Pending payment for order #{}".format(order.order_number),
+        )
+        try:
+            wallet.debit(order.total_amount, payment)
+        except ValueError:
+            raise InsufficientFunds('Insufficient Funds in Wallet')
+
+        for order_item in order.items.all():
+            # raises InsufficientStock rather than handing out a short batch
+            order_item.get_allocated_logs()
+        release_order(order)
+
+        order.transaction = payment
+        order.status = 'completed'
+        order.save(update_fields=['transaction', 'status', 'updated_at'])
+    return order
@@ -0,0 +1,109 @@
+"""
+Streaming downloads of the logs of an order.
+
+Logs are read with server-side cursors (iterator(chunk_size=...)) from the
+live Log table and the SoldLog archive, merged by id, and encoded chunk by
+chunk, so memory use does not depend on the size of the order.
+
+Downloads are resumable by id: logs come out in ascending id order, the CSV
+format carries the id of every log, and ?after=<id> restarts the download
+right after that log.
+"""
+from django.db.models import F
+from django.utils.text import slugify
+from .models import Log, SoldLog
+import csv
+import heapq
+import io
+import zipfile
+
+
+DOWNLOAD_FORMATS = ('txt', 'csv', 'zip')
+
+# rows fetched per round trip of the server-side cursor
+DOWNLOAD_CHUNK_SIZE = 500
+
+# bytes collected before a chunk is sent to the client
+DOWNLOAD_BUFFER_SIZE = 64 * 1024
+
+
+def iter_order_logs(order, after=0, order_item=None):
+    """(log id, order item id, account title, log data) of the logs sold with order (or one of its items), by id"""
+    sold = {'order_item': order_item} if order_item else {'order_item__order': order}
+
+    def rows(model):
+        return (
+            model.objects.filter(pk__gt=after, **sold)
+            .order_by('pk')
+            .values_list('pk', 'order_item_id', F('account__title'), 'log_data')
+            .iterator(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        )
+    return heapq.merge(rows(Log), rows(SoldLog))
+
+
+def _buffered(pieces):
+    """Join small encoded pieces into chunks of about DOWNLOAD_BUFFER_SIZE bytes"""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= DOWNLOAD_BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def stream_txt(logs):
+    return _buffered(f'{log_data}\n'.encode('utf-8') for _, _, _, log_data in logs)
+
+
+def stream_csv(logs):
+    def rows():
+        line = io.StringIO()
+        writer = csv.writer(line)
+        writer.writerow(['id', 'order_item', 'account', 'log_data'])
+        for row in logs:
+            writer.writerow(row)
+            yield line.getvalue().encode('utf-8')
+            line.seek(0)
+            line.truncate()
+    return _buffered(rows())
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only file zipfile writes to, its bytes are taken out as they come"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+
+def stream_zip(order):
+    """
+    One text file per order item. The stream is not seekable, so zipfile
+    writes the sizes in a data descriptor after each file instead of going back.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for item in order.items.select_related('account').order_by('pk'):
+            name = f'{item.pk}-{slugify(item.account.title or item.account.pk)}.txt'
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for _, _, _, log_data in iter_order_logs(order, order_item=item):
+                    entry.write(f'{log_data}\n'.encode('utf-8'))
+                    if stream.size >= DOWNLOAD_BUFFER_SIZE:
+                        yield stream.take()
+    yield stream.take()
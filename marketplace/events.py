@@ -0,0 +1,164 @@
+import asyncio
+import threading
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from .models import SocialMediaAccount
+from .reservations import with_available_stock
+
+
+class StockSubscription:
+    """
+    A connected listener of StockEventBroker.
+
+    Events are delivered to a bounded queue on the subscriber's event loop.
+    When a slow client lets it fill up, the pending events are replaced by a
+    single resync event telling the client to refetch the stock instead.
+    """
+
+    def __init__(self, loop, queue_size, account_ids=None, category=None):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.account_ids = account_ids
+        self.category = category
+
+    def wants(self, change):
+        if self.account_ids is not None and change['id'] in self.account_ids:
+            return True
+        return self.category is not None and change['category'] == self.category
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # the loop of a disconnected client is already closed
+            pass
+
+    def _put(self, event):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {'type': 'resync'}
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class StockEventBroker:
+    """
+    In-process fan-out of stock and price changes to Server-Sent Events clients.
+
+    Changes made in this process are published from the catalog hooks as soon
+    as their transaction commits. Changes made by other processes (admin,
+    WSGI workers) are picked up by one watcher per process that checks the
+    catalog version every few seconds and then reloads only the accounts its
+    subscribers watch, so each change costs one broadcast no matter how many
+    clients are connected or how large the catalog is.
+    """
+
+    def __init__(self, queue_size=100, watch_interval=5):
+        self.queue_size = queue_size
+        self.watch_interval = watch_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last = {}
+        self._watcher = None
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, account_ids=None, category=None):
+        loop = asyncio.get_running_loop()
+        subscription = StockSubscription(loop, self.queue_size, account_ids, category)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._watcher is None or self._watcher.done():
+                self._watcher = loop.create_task(self._watch())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def watched(self):
+        """(account ids, category slugs) the current subscribers want"""
+        account_ids, categories = set(), set()
+        with self._lock:
+            for subscription in self._subscribers:
+                account_ids |= subscription.account_ids or set()
+                if subscription.category is not None:
+                    categories.add(subscription.category)
+        return account_ids, categories
+
+    def publish(self, changes):
+        """
+        Broadcast account states, only the ones that changed since the last
+        broadcast reach the subscribers. Safe to call from any thread.
+        """
+        with self._lock:
+            deltas = []
+            for change in changes:
+                state = (change['stock'], change['price'])
+                if self._last.get(change['id']) != state:
+                    self._last[change['id']] = state
+                    deltas.append(change)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            wanted = [change for change in deltas if subscription.wants(change)]
+            if wanted:
+                subscription.deliver({'type': 'stock', 'accounts': wanted})
+
+    async def _watch(self):
+        from .catalog import get_catalog_version, HOME_SNAPSHOT_KEY
+
+        revision = None
+        while self.has_subscribers:
+            version = await sync_to_async(get_catalog_version)(HOME_SNAPSHOT_KEY)
+            if version is not None and version[0] != revision:
+                seed = revision is None and not self._last
+                revision = version[0]
+                account_ids, categories = self.watched()
+                changes = await sync_to_async(account_states)(account_ids, categories)
+                if seed:
+                    with self._lock:
+                        self._last.update({change['id']: (change['stock'], change['price']) for change in changes})
+                else:
+                    self.publish(changes)
+            await asyncio.sleep(self.watch_interval)
+
+
+def account_states(account_ids=None, categories=None):
+    """
+    Current available stock and price of accounts as published to subscribers
+
+    Limited to account_ids, plus the accounts of the categories (slugs) when
+    they are given.
+    """
+    accounts = SocialMediaAccount.objects.all()
+    if categories is not None:
+        accounts = accounts.filter(Q(pk__in=account_ids or ()) | Q(category__slug__in=categories))
+    elif account_ids is not None:
+        accounts = accounts.filter(pk__in=account_ids)
+
+    changes = []
+    for account_id, category, available, price, is_active in with_available_stock(accounts).values_list(
+        'id', 'category__slug', 'available', 'price', 'is_active'
+    ):
+        changes.append({
+            'id': account_id,
+            'category': category,
+            'stock': max(available, 0) if is_active else 0,
+            'price': str(price),
+        })
+    return changes
+
+
+broker = StockEventBroker()
+
+
+def publish_stock_changes(account_ids):
+    """Push the state of the given accounts to the subscribers of this process"""
+    if account_ids and broker.has_subscribers:
+        broker.publish(account_states(account_ids))
@@ -0,0 +1,89 @@
+"""
+Model fields of the marketplace app.
+"""
+from django import forms
+from django.conf import settings
+from django.db import models
+import zlib
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text stored as bytes, zlib-compressed when that makes it smaller.
+
+    The first stored byte is the format marker, FORMAT_PLAIN (utf-8 text) or
+    FORMAT_ZLIB. Values without a marker are rows written before the column
+    was compressed (plain utf-8) and are read as they are, compress_logs
+    rewrites them. The attribute is always a str, so templates, forms and
+    values_list() don't have to know about the storage.
+
+    Compression is deterministic, so exact lookups on the field still work for
+    rows written by this field. Set LOG_DATA_COMPRESSION = False to store new
+    values uncompressed. Values encoded beforehand (bytes) are stored as they
+    are, that is how compress_logs picks the format of the rows it rewrites.
+    """
+
+    FORMAT_PLAIN = b'\x01'
+    FORMAT_ZLIB = b'\x02'
+
+    # shorter values rarely shrink enough to pay for the zlib header
+    MIN_COMPRESS_LENGTH = 64
+    COMPRESSION_LEVEL = 6
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('editable') is True:
+            del kwargs['editable']
+        else:
+            kwargs['editable'] = False
+        return name, path, args, kwargs
+
+    @classmethod
+    def encode(cls, value, compress=None):
+        """Stored bytes of a str value, compress defaults to LOG_DATA_COMPRESSION"""
+        raw = value.encode('utf-8')
+        if compress is None:
+            compress = getattr(settings, 'LOG_DATA_COMPRESSION', True)
+        if len(raw) >= cls.MIN_COMPRESS_LENGTH and compress:
+            compressed = zlib.compress(raw, cls.COMPRESSION_LEVEL)
+            if len(compressed) < len(raw):
+                return cls.FORMAT_ZLIB + compressed
+        return cls.FORMAT_PLAIN + raw
+
+    @classmethod
+    def decode(cls, value):
+        """str value of stored bytes, unmarked legacy text included"""
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        marker, data = value[:1], value[1:]
+        if marker == cls.FORMAT_ZLIB:
+            return zlib.decompress(data).decode('utf-8')
+        if marker == cls.FORMAT_PLAIN:
+            return data.decode('utf-8')
+        return value.decode('utf-8', errors='replace')
+
+    def get_default(self):
+        default = super().get_default()
+        return '' if default == b'' else default
+
+    def from_db_value(self, value, expression, connection):
+        return self.decode(value)
+
+    def to_python(self, value):
+        return self.decode(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            return self.encode(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'form_class': forms.CharField, 'widget': forms.Textarea, **kwargs})
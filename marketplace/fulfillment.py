@@ -0,0 +1,128 @@
+"""
+Log allocation outside the payment request.
+
+confirm_payment debits the wallet, moves the order to processing and queues a
+FulfillmentJob in the same transaction, so the request costs the same for one
+log or ten thousand. manage.py run_fulfillment works the queue: each job is
+claimed in its own transaction, the logs of every item are allocated (one
+UPDATE per item, see OrderItem.get_allocated_logs), the stock hold is released
+and the order completed. after_checkout polls order_status until then.
+
+Allocation is idempotent, a job that failed half way or was worked twice
+hands out the same logs, and an order is only completed once every item holds
+its full quantity. A failed job is retried with a doubling delay
+(FULFILLMENT_RETRY_SECONDS, 2x, 4x, ...). After FULFILLMENT_MAX_ATTEMPTS the
+order is refunded to the wallet and marked refunded, the error is kept in its
+notes for the admin. Workers skip jobs locked by other workers where the
+database supports it (Postgres), on SQLite run a single worker.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+from .models import Order, FulfillmentJob
+from .reservations import InsufficientStock, hold_for_fulfillment, release_order
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def queue_fulfillment(order):
+    """Mark a paid order processing and queue it, call it in the transaction of the payment"""
+    order.status = 'processing'
+    order.save(update_fields=['status', 'updated_at'])
+    hold_for_fulfillment(order)
+    FulfillmentJob.objects.get_or_create(order=order)
+
+
+def fulfil_order(order):
+    """
+    Allocate the logs of every item of order and complete it
+
+    Returns:
+        bool: False if the order is no longer processing, it is left alone then
+
+    Raises:
+        InsufficientStock: if an item can't get its full quantity
+    """
+    if order.status != 'processing':
+        # cancelled, refunded or completed since it was queued
+        return False
+
+    for order_item in order.items.all():
+        if len(order_item.get_allocated_logs()) != order_item.quantity:
+            # a short batch handed out before claims were checked, never complete on it
+            raise InsufficientStock(order_item.account)
+    release_order(order)
+    order.status = 'completed'
+    order.save(update_fields=['status', 'updated_at'])
+    return True
+
+
+def retry_delay(attempts):
+    """Wait before the next attempt of a job that failed attempts times"""
+    return timedelta(seconds=getattr(settings, 'FULFILLMENT_RETRY_SECONDS', 30) * 2 ** (attempts - 1))
+
+
+def refund_order(order, error):
+    """Give up on a paid order: refund the wallet, release the holds and record why"""
+    payment = order.transaction
+    if payment is not None and payment.type == 'debit' and payment.status == 'success':
+        payment.wallet.refund(order.total_amount, payment.id)
+        order.status = 'refunded'
+    else:
+        # nothing we can refund automatically, leave it to the admin
+        order.status = 'failed'
+    order.notes = '\n'.join(filter(None, [order.notes, f'Fulfillment failed: {error}']))
+    order.save(update_fields=['status', 'notes', 'updated_at'])
+    release_order(order)
+
+
+def run_fulfillment_batch(batch_size=20):
+    """
+    Work up to batch_size due jobs, the longest waiting first. Jobs of orders
+    that are no longer processing are dropped without touching the order.
+
+    Returns:
+        tuple: (orders completed, jobs that failed and stay queued, orders refunded)
+    """
+    completed = failed = refunded = 0
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    max_attempts = getattr(settings, 'FULFILLMENT_MAX_ATTEMPTS', 5)
+    done = set()
+
+    for _ in range(batch_size):
+        with transaction.atomic():
+            now = timezone.now()
+            job = (
+                FulfillmentJob.objects.select_for_update(skip_locked=skip_locked)
+                .filter(next_attempt_at__lte=now)
+                .exclude(pk__in=done)
+                .order_by('next_attempt_at', 'pk')
+                .first()
+            )
+            if job is None:
+                break
+            done.add(job.pk)
+
+            try:
+                with transaction.atomic():
+                    # locked, the status can't change under the allocation
+                    fulfilled = fulfil_order(Order.objects.select_for_update().get(pk=job.order_id))
+            except Exception as e:
+                logger.exception('Fulfillment of order %s failed', job.order_id)
+                job.attempts += 1
+                job.last_error = str(e)
+                if job.attempts >= max_attempts:
+                    refund_order(Order.objects.select_related('transaction__wallet').get(pk=job.order_id), e)
+                    job.delete()
+                    refunded += 1
+                else:
+                    job.next_attempt_at = now + retry_delay(job.attempts)
+                    job.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+                    failed += 1
+            else:
+                job.delete()
+                completed += bool(fulfilled)
+
+    return completed, failed, refunded
@@ -0,0 +1,184 @@
+"""
+Bulk import of logs from txt, CSV or JSONL files.
+
+The file is streamed record by record and cut into chunks. The chunks are
+parsed, validated and hashed in a process pool while the main process writes
+the previous ones with bulk_create, one transaction per chunk. The stock
+counter and the catalog are refreshed once at the end.
+
+Parsing helpers don't touch Django so the pool workers can import this module
+without setting up the project (spawn start method on macOS).
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import hashlib
+import json
+import os
+
+
+FORMATS = ('txt', 'csv', 'jsonl')
+
+# longer payloads are almost certainly a broken file rather than one credential
+MAX_LOG_LENGTH = 64 * 1024
+
+# line numbers of invalid records kept for the report
+MAX_REPORTED_ERRORS = 20
+
+
+def normalize_log_data(log_data):
+    """Payload with line endings and surrounding whitespace made uniform, used for hashing"""
+    return '\n'.join(line.strip() for line in log_data.strip().splitlines())
+
+
+def log_content_hash(log_data):
+    """Hex sha256 of the normalized payload, equal for logs that only differ in whitespace"""
+    return hashlib.sha256(normalize_log_data(log_data).encode('utf-8')).hexdigest()
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    return 'csv' if extension == 'csv' else 'txt'
+
+
+def read_records(stream, file_format):
+    """Yield (line number, raw record) from a text stream without reading it all"""
+    if file_format == 'csv':
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if not header or 'log_data' not in header:
+            raise ValueError('CSV files need a header row with a log_data column')
+        column = header.index('log_data')
+        for row in reader:
+            if row:
+                yield reader.line_num, row[column] if column < len(row) else ''
+    else:
+        for number, line in enumerate(stream, 1):
+            yield number, line
+
+
+def parse_chunk(chunk, file_format):
+    """
+    Validate and hash a chunk of raw records.
+
+    Returns:
+        tuple: ([(content hash, log data)], [(line number, error)])
+    """
+    logs, errors = [], []
+    for number, raw in chunk:
+        if file_format == 'jsonl':
+            if not raw.strip():
+                continue
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                errors.append((number, 'invalid JSON'))
+                continue
+            raw = value.get('log_data') if isinstance(value, dict) else value
+            if not isinstance(raw, str):
+                errors.append((number, 'missing log_data'))
+                continue
+
+        data = raw.strip()
+        if not data:
+            if file_format != 'txt':
+                errors.append((number, 'empty log_data'))
+        elif '\x00' in data:
+            errors.append((number, 'contains a NUL byte'))
+        elif len(data) > MAX_LOG_LENGTH:
+            errors.append((number, f'longer than {MAX_LOG_LENGTH} characters'))
+        else:
+            logs.append((log_content_hash(data), data))
+    return logs, errors
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_records(records, file_format, chunk_size, workers=0):
+    """
+    Parsed chunks in file order. With workers, at most two chunks per worker
+    are in flight so memory stays flat whatever the file size.
+    """
+    chunks = _chunks(records, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield parse_chunk(chunk, file_format)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(parse_chunk, chunk, file_format))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def import_logs(account, stream, file_format='txt', batch_size=1000, workers=0, dry_run=False):
+    """
+    Import the logs of a text stream into account.
+
+    Args:
+        account (SocialMediaAccount): account the logs are added to
+        stream: text file object, read line by line
+        file_format (str): one of FORMATS
+        batch_size (int): records parsed and inserted per transaction
+        workers (int): parser processes, 0 parses in this process
+        dry_run (bool): validate and count without writing
+
+    Returns:
+        dict: valid, created, duplicates and invalid counts, and the first errors
+    """
+    from django.db import transaction
+    from .models import Log, SocialMediaAccount
+    from .catalog import mark_catalog_changed
+
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown format {file_format}, expected one of {", ".join(FORMATS)}')
+
+    # committed batches are found by the hash lookups, only a dry run has to remember them
+    seen = set()
+    result = {'valid': 0, 'created': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+
+    try:
+        for logs, errors in parse_records(read_records(stream, file_format), file_format, batch_size, workers):
+            result['invalid'] += len(errors)
+            result['errors'].extend(errors[:max(MAX_REPORTED_ERRORS - len(result['errors']), 0)])
+            result['valid'] += len(logs)
+
+            existing = Log.duplicate_hashes(account.pk, {content_hash for content_hash, _ in logs})
+
+            batch = []
+            for content_hash, data in logs:
+                if content_hash in existing or content_hash in seen:
+                    result['duplicates'] += 1
+                    continue
+                existing.add(content_hash)
+                if dry_run:
+                    seen.add(content_hash)
+                batch.append(Log(account=account, log_data=data, content_hash=content_hash))
+
+            if batch and not dry_run:
+                with transaction.atomic():
+                    Log.objects.bulk_create(batch)
+                result['created'] += len(batch)
+    finally:
+        if result['created']:
+            # bulk_create skips Log.save(), count the committed batches once
+            with transaction.atomic():
+                SocialMediaAccount.recount_stock([account.pk])
+                mark_catalog_changed(account_ids=[account.pk])
+
+    return result
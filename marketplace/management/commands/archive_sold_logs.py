@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from marketplace.models import Log, SoldLog
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    """
+    Move sold logs out of the live Log table into SoldLog.
+
+    Stock queries and allocation only ever look at unsold logs, keeping old
+    sales out of Log keeps its table and indexes small. A log is archived once
+    the order item it was sold with is older than --older-than-days. Rows are
+    copied with INSERT ... SELECT and deleted in the same transaction, batch
+    by batch, so the payload is never decoded and the command can be stopped
+    at any time. The order page and the downloads read both tables.
+    """
+
+    help = 'Move sold logs older than the configured age into the SoldLog archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=getattr(settings, 'LOG_ARCHIVE_AFTER_DAYS', 30),
+            help='Archive logs sold more than this many days ago (default: LOG_ARCHIVE_AFTER_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of logs moved per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the logs that would be archived',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+        if options['older_than_days'] < 0:
+            raise CommandError('--older-than-days can not be negative')
+
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        sold = Log.objects.filter(
+            is_active=False, order_item__isnull=False, order_item__created_at__lt=cutoff
+        ).order_by('pk')
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+            archived = sold.count()
+        else:
+            archived = 0
+            while True:
+                with transaction.atomic():
+                    ids = list(sold.select_for_update(of=('self',)).values_list('pk', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    self._move(ids)
+                archived += len(ids)
+                self.stdout.write(f'Archived up to log {ids[-1]}')
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Sold before: {cutoff:%Y-%m-%d %H:%M}')
+        self.stdout.write(f'Logs archived: {archived}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\nMoved {archived} logs to the archive'))
+
+    def _move(self, ids):
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SoldLog._meta.db_table} (id, order_item_id, account_id, log_data, content_hash, timestamp, archived_at) "
+                f"SELECT id, order_item_id, account_id, log_data, content_hash, timestamp, %s FROM {Log._meta.db_table} "
+                f"WHERE id IN ({placeholders})",
+                [connection.ops.adapt_datetimefield_value(timezone.now()), *ids],
+            )
+            # plain DELETE, the rows are inactive so the stock signals have nothing to do
+            cursor.execute(f"DELETE FROM {Log._meta.db_table} WHERE id IN ({placeholders})", ids)
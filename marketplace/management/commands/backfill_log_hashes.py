@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from marketplace.importer import log_content_hash
+from marketplace.models import Log, SoldLog
+
+
+class Command(BaseCommand):
+    """
+    Fill Log.content_hash and SoldLog.content_hash for rows written before
+    the column existed, and report the duplicates among them.
+
+    Rows are processed in primary key batches. The first log of an account
+    with a given content keeps the hash, later live copies are listed as
+    duplicates and left without one (the unique index would reject them),
+    deactivate or delete them after checking the report.
+    """
+
+    help = 'Backfill log content hashes in batches and report duplicate logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of logs hashed per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report duplicates without writing hashes',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+
+        archived, _ = self._backfill(SoldLog, batch_size, dry_run)
+        hashed, duplicates = self._backfill(Log, batch_size, dry_run)
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Logs hashed: {hashed}')
+        self.stdout.write(f'Archived logs hashed: {archived}')
+        self.stdout.write(f'Duplicate logs: {duplicates}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        elif duplicates:
+            self.stdout.write(self.style.WARNING(f'\n{duplicates} duplicate logs were left without a hash'))
+        else:
+            self.stdout.write(self.style.SUCCESS('\nAll logs have a content hash'))
+
+    def _backfill(self, model, batch_size, dry_run):
+        hashed = duplicates = 0
+        # a dry run writes nothing, so it remembers the first log of each (account, hash) itself
+        seen = {}
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    model.objects.select_for_update()
+                    .filter(pk__gt=last_pk, content_hash__isnull=True)
+                    .order_by('pk')
+                    .only('pk', 'account_id', 'log_data')[:batch_size]
+                )
+                if not rows:
+                    break
+
+                for row in rows:
+                    row.content_hash = log_content_hash(row.log_data)
+
+                if model is Log:
+                    # hashes already taken by other live logs of the same accounts
+                    taken = seen if dry_run else {}
+                    for account_id, content_hash, pk in Log.objects.filter(
+                        account_id__in={row.account_id for row in rows},
+                        content_hash__in={row.content_hash for row in rows},
+                    ).values_list('account_id', 'content_hash', 'pk'):
+                        taken[(account_id, content_hash)] = pk
+
+                    unique = []
+                    for row in rows:
+                        key = (row.account_id, row.content_hash)
+                        if key in taken:
+                            duplicates += 1
+                            self.stdout.write(
+                                self.style.WARNING(f'Log {row.pk} duplicates log {taken[key]} of account {row.account_id}')
+                            )
+                        else:
+                            taken[key] = row.pk
+                            unique.append(row)
+                    rows_to_write = unique
+                else:
+                    rows_to_write = rows
+
+                if not dry_run:
+                    model.objects.bulk_update(rows_to_write, ['content_hash'])
+
+            hashed += len(rows_to_write)
+            last_pk = rows[-1].pk
+
+        return hashed, duplicates
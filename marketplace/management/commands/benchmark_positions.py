@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from marketplace.models import SocialMediaAccount, Category, POSITION_GAP
+from decimal import Decimal
+import time
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Measure the cost of saving, appending and moving an account as the
+    catalog grows.
+
+    Everything runs inside one transaction that is rolled back at the end,
+    so the command leaves the database as it found it. With sparse positions
+    the numbers should stay flat from the smallest size to the largest one.
+    """
+
+    help = 'Benchmark account saves, inserts and moves for growing catalog sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='100,1000,10000,100000',
+            help='Comma separated catalog sizes to measure (default: 100,1000,10000,100000)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Operations timed per size (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of numbers')
+        repeat = options['repeat']
+        if repeat <= 0 or not sizes or sizes[0] <= 0:
+            raise CommandError('--sizes and --repeat must be positive numbers')
+
+        self.stdout.write(f"{'accounts':>10} {'operation':>10} {'queries':>8} {'ms/op':>8}")
+        try:
+            with transaction.atomic():
+                self._run(sizes, repeat)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark finished, all rows were rolled back'))
+
+    def _run(self, sizes, repeat):
+        category = Category.objects.create(name='Position benchmark')
+        created = 0
+
+        for size in sizes:
+            last = SocialMediaAccount.objects.order_by('-position').values_list('position', flat=True).first() or 0
+            # rows are inserted directly at the end, the way appends space them
+            missing = size - created
+            SocialMediaAccount.objects.bulk_create(
+                [
+                    SocialMediaAccount(
+                        title=f'Benchmark {created + i}',
+                        category=category,
+                        description='Benchmark',
+                        price=Decimal('1.00'),
+                        position=last + (i + 1) * POSITION_GAP,
+                    )
+                    for i in range(missing)
+                ],
+                batch_size=1000,
+            )
+            created = size
+
+            accounts = list(SocialMediaAccount.objects.filter(category=category).order_by('?')[:repeat * 2])
+
+            def save():
+                for account in accounts[:repeat]:
+                    account.price += 1
+                    account.save()
+
+            def insert():
+                for i in range(repeat):
+                    SocialMediaAccount.objects.create(
+                        title=f'Appended {i}', category=category, description='Benchmark', price=Decimal('1.00')
+                    )
+
+            def move():
+                # each account takes the slot of another one
+                for account, target in zip(accounts[:repeat], accounts[repeat:]):
+                    account.position = target.position
+                    account.save()
+
+            for name, operation in (('save', save), ('insert', insert), ('move', move)):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    operation()
+                    elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{size:>10} {name:>10} {len(queries) / repeat:>8.1f} {elapsed * 1000 / repeat:>8.2f}'
+                )
+            created += repeat
@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from marketplace.fields import CompressedTextField
+from marketplace.models import Log
+import time
+
+
+class Command(BaseCommand):
+    """
+    Rewrite Log.log_data in the current storage format.
+
+    Rows written before log_data was compressed are stored as unmarked text,
+    this command re-encodes them (zlib when it makes them smaller) in primary
+    key batches, one transaction per batch. It is safe to stop and run again,
+    --start-after resumes from the last reported id. Run it with --decompress
+    before rolling back migration 0039.
+    """
+
+    help = 'Compress the log data of existing logs in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of logs rewritten per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--start-after',
+            type=int,
+            default=0,
+            help='Resume after this log id (default: 0)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to pause between batches to keep the load down (default: 0)',
+        )
+        parser.add_argument(
+            '--decompress',
+            action='store_true',
+            help='Store every log as plain text instead',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the expected savings without writing',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+
+        processed, plain_bytes, stored_bytes = self._rewrite(
+            batch_size, options['start_after'], options['sleep'], not options['decompress'], dry_run
+        )
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Logs processed: {processed}')
+        self.stdout.write(f'Plain size: {plain_bytes} bytes')
+        self.stdout.write(f'Stored size: {stored_bytes} bytes')
+        if plain_bytes:
+            self.stdout.write(f'Ratio: {stored_bytes / plain_bytes:.2f}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\nRewrote {processed} logs'))
+
+    def _rewrite(self, batch_size, last_pk, pause, compress, dry_run):
+        processed = plain_bytes = stored_bytes = 0
+
+        while True:
+            with transaction.atomic():
+                logs = list(
+                    Log.objects.select_for_update()
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .only('pk', 'log_data')[:batch_size]
+                )
+                if not logs:
+                    break
+                for log in logs:
+                    plain_bytes += len(log.log_data.encode('utf-8'))
+                    # encoded here, the field stores bytes as they are
+                    log.log_data = CompressedTextField.encode(log.log_data, compress=compress)
+                    stored_bytes += len(log.log_data)
+                if not dry_run:
+                    # update() instead of save(), the stock counter is not involved
+                    Log.objects.bulk_update(logs, ['log_data'])
+
+            processed += len(logs)
+            last_pk = logs[-1].pk
+            self.stdout.write(f'Processed up to log {last_pk}')
+
+            if pause:
+                time.sleep(pause)
+
+        return processed, plain_bytes, stored_bytes
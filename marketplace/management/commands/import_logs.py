@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.models import SocialMediaAccount
+from marketplace.importer import import_logs, detect_format, FORMATS
+import os
+import time
+
+
+class Command(BaseCommand):
+    """
+    Import logs for an account from a txt (one log per line), CSV (log_data
+    column) or JSONL ({"log_data": ...} per line) file.
+
+    The file is streamed, parsed in a process pool and inserted in batches,
+    logs already present on the account or repeated in the file are skipped.
+    See marketplace/importer.py.
+    """
+
+    help = 'Import logs for a social media account from a txt, CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument(
+            '--account',
+            type=int,
+            required=True,
+            help='Id of the social media account the logs belong to',
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='File format (default: guessed from the extension, txt otherwise)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of logs parsed and inserted per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Parser processes, 0 parses in the main process (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate the file and report what would be imported',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        file_format = options['format'] or detect_format(options['path'])
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+
+        try:
+            account = SocialMediaAccount.objects.get(pk=options['account'])
+        except SocialMediaAccount.DoesNotExist:
+            raise CommandError(f"Social media account {options['account']} does not exist")
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+
+        started = time.monotonic()
+        try:
+            with open(options['path'], encoding='utf-8', errors='replace', newline='') as stream:
+                result = import_logs(
+                    account, stream, file_format,
+                    batch_size=batch_size, workers=options['workers'], dry_run=dry_run,
+                )
+        except OSError as e:
+            raise CommandError(f'Could not read {options["path"]}: {e}')
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        for line, error in result['errors']:
+            self.stdout.write(self.style.WARNING(f'Line {line}: {error}'))
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Account: {account}')
+        self.stdout.write(f'Valid logs: {result["valid"]}')
+        self.stdout.write(f'Duplicates skipped: {result["duplicates"]}')
+        self.stdout.write(f'Invalid lines: {result["invalid"]}')
+        self.stdout.write(f'Logs created: {result["created"]}')
+        self.stdout.write(f'Time: {elapsed:.1f}s')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\nImported {result["created"]} logs'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.models import Category
+from marketplace.catalog import rebuild_catalog_snapshots
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the prepared listing page payloads (see marketplace/catalog.py).
+
+    The snapshots are normally rebuilt by the catalog signals whenever an
+    account, category or log changes. Run this after a deploy that changes
+    the payload format or after editing the catalog with raw SQL.
+    """
+
+    help = 'Rebuild the home page and category snapshots served by the listing views'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--category',
+            action='append',
+            dest='categories',
+            metavar='SLUG',
+            help='Only rebuild the home page and this category (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        slugs = options['categories']
+        category_ids = None
+
+        if slugs:
+            category_ids = list(Category.objects.filter(slug__in=slugs).values_list('pk', flat=True))
+            if len(category_ids) != len(set(slugs)):
+                raise CommandError(f'Unknown category in: {", ".join(slugs)}')
+
+        rebuilt = rebuild_catalog_snapshots(category_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt the home page snapshot and {rebuilt} category snapshots')
+        )
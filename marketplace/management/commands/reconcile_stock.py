@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from marketplace.models import SocialMediaAccount, Log
+
+
+class Command(BaseCommand):
+    """
+    Recompute SocialMediaAccount.stock from the active logs.
+
+    The counter is maintained incrementally by Log.save() and the log signals,
+    this command is the safety net for anything that bypassed them (raw SQL,
+    restored backups, ...). Accounts are processed in primary key batches and
+    each batch is locked while it is recounted so concurrent sales can't slip
+    in between the count and the write.
+    """
+
+    help = 'Recompute the stock counter of every social media account and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of accounts to recount per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without fixing it',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+
+        checked = 0
+        drifted = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                accounts = list(
+                    SocialMediaAccount.objects.select_for_update()
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', 'stock')[:batch_size]
+                )
+                if not accounts:
+                    break
+
+                account_ids = [pk for pk, _ in accounts]
+                counts = dict(
+                    Log.objects.filter(account_id__in=account_ids, is_active=True)
+                    .order_by()
+                    .values_list('account_id')
+                    .annotate(count=Count('pk'))
+                )
+
+                drifted_ids = []
+                for pk, stock in accounts:
+                    actual = counts.get(pk, 0)
+                    if actual != stock:
+                        drifted_ids.append(pk)
+                        self.stdout.write(
+                            self.style.WARNING(f'Account {pk}: stored stock {stock}, actual {actual}')
+                        )
+
+                if drifted_ids and not dry_run:
+                    SocialMediaAccount.recount_stock(drifted_ids)
+
+            checked += len(accounts)
+            drifted += len(drifted_ids)
+            last_pk = account_ids[-1]
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Accounts checked: {checked}')
+        self.stdout.write(f'Accounts with drift: {drifted}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        elif drifted:
+            self.stdout.write(self.style.SUCCESS(f'\nStock corrected for {drifted} accounts'))
+        else:
+            self.stdout.write(self.style.SUCCESS('\nAll stock counters are correct'))
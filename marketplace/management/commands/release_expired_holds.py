@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from marketplace.models import StockReservation, CatalogSnapshot
+from marketplace.catalog import rebuild_stale_snapshots
+from marketplace.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    """
+    Delete expired stock holds and publish the stock they give back.
+
+    Expired holds already count for nothing at checkout, but the listings,
+    the stock poll and the stock events publish available stock. Run this
+    from cron every minute or so, so units of abandoned checkouts show up as
+    available again and their holds don't pile up.
+
+    It also rebuilds the listing snapshots flagged stale by checkouts and
+    cancellations (see mark_stock_changed), which only publish stock events
+    and leave the listings to this command.
+    """
+
+    help = 'Release expired stock reservations and rebuild the stale listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the expired holds and stale snapshots without touching them',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        if dry_run:
+            self.stdout.write(
+                self.style.WARNING('DRY RUN MODE: No changes will be made to the database')
+            )
+            released = StockReservation.objects.filter(expires_at__lte=timezone.now()).count()
+            rebuilt = CatalogSnapshot.objects.filter(stale=True).count()
+        else:
+            released = release_expired_holds()
+            rebuilt = rebuild_stale_snapshots()
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Expired holds: {released}')
+        self.stdout.write(f'Stale snapshots: {rebuilt}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDRY RUN COMPLETED - No changes were made'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'\nReleased {released} expired holds and rebuilt {rebuilt} stale snapshots')
+            )
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+from marketplace.fulfillment import run_fulfillment_batch
+import time
+
+
+class Command(BaseCommand):
+    """
+    Allocate the logs of paid orders.
+
+    confirm_payment only debits the wallet and queues the order, this worker
+    allocates the logs and completes it (see marketplace/fulfillment.py). It
+    polls the queue until stopped, --once works the due jobs and exits (for
+    cron or tests). Failed jobs are retried later with a growing delay and
+    refunded after FULFILLMENT_MAX_ATTEMPTS. Several workers can run side by
+    side on Postgres.
+    """
+
+    help = 'Work the order fulfillment queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Number of orders fulfilled per batch (default: 20)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1,
+            help='Seconds to wait when the queue is empty (default: 1)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive number')
+
+        completed = failed = refunded = 0
+        try:
+            while True:
+                batch_completed, batch_failed, batch_refunded = run_fulfillment_batch(batch_size)
+                completed += batch_completed
+                failed += batch_failed
+                refunded += batch_refunded
+                if batch_completed or batch_failed or batch_refunded:
+                    self.stdout.write(
+                        f'Fulfilled {batch_completed} orders, {batch_failed} failed, {batch_refunded} refunded'
+                    )
+
+                # nothing left that can be fulfilled right now
+                if options['once']:
+                    if not batch_completed:
+                        break
+                elif not batch_completed or batch_completed + batch_failed + batch_refunded < batch_size:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write('\n' + '='*50)
+        self.stdout.write('SUMMARY:')
+        self.stdout.write(f'Orders fulfilled: {completed}')
+        self.stdout.write(f'Failed attempts: {failed}')
+        self.stdout.write(f'Orders refunded: {refunded}')
+
+        if refunded:
+            self.stdout.write(self.style.WARNING(f'\n{refunded} orders could not be fulfilled and were refunded'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'\n{failed} attempts failed, the orders stay queued for a retry'))
+        if not failed and not refunded:
+            self.stdout.write(self.style.SUCCESS(f'\nFulfilled {completed} orders'))
@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
 from django.conf import settings
-from marketplace.models import SocialMediaAccount, Category
+from marketplace.models import Category
+from marketplace.catalog import load_home_snapshot, load_category_snapshot
 from core.cache_utils import cache_queryset
 from django.db import connection
 
@@ -37,10 +38,9 @@ class Command(BaseCommand):
             force_anonymous = options.get('force_anonymous', False)
             if force_anonymous:
                 try:
-                    self.stdout.write('Caching marketplace accounts (forced)...')
-                    accounts_queryset = SocialMediaAccount.objects.filter(is_active=True)
-                    cache_queryset(accounts_queryset, 'marketplace_accounts_all', timeout=settings.CACHE_TIMEOUT_LONG, force_cache=True)
-                    self.stdout.write('✅ Marketplace accounts cached')
+                    self.stdout.write('Caching marketplace snapshot (forced)...')
+                    load_home_snapshot()
+                    self.stdout.write('✅ Marketplace snapshot cached')
                 except Exception as e:
                     self.stdout.write(
                         self.style.WARNING(f'⚠️ Failed to cache marketplace accounts: {e}')
@@ -56,13 +56,8 @@ class Command(BaseCommand):
                     categories = Category.objects.all()
                     for category in categories:
                         try:
-                            self.stdout.write(f'Caching accounts for {category.slug} (forced)...')
-                            category_accounts = SocialMediaAccount.objects.filter(
-                                is_active=True, 
-                                category__slug=category.slug
-                            )
-                            cache_key = f'accounts_{category.slug}'
-                            cache_queryset(category_accounts, cache_key, timeout=settings.CACHE_TIMEOUT_MEDIUM, force_cache=True)
+                            self.stdout.write(f'Caching snapshot for {category.slug} (forced)...')
+                            load_category_snapshot(category.slug)
                         except Exception as e:
                             self.stdout.write(
                                 self.style.WARNING(f'⚠️ Failed to cache category {category.slug}: {e}')
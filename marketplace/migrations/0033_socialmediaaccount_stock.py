@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:07
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_stock(apps, schema_editor):
+    SocialMediaAccount = apps.get_model('marketplace', 'SocialMediaAccount')
+    Log = apps.get_model('marketplace', 'Log')
+    active_logs = Log.objects.filter(
+        account=models.OuterRef('pk'), is_active=True
+    ).order_by().values('account').annotate(count=models.Count('pk')).values('count')
+    SocialMediaAccount.objects.update(stock=Coalesce(models.Subquery(active_logs), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0032_alter_socialmediaaccount_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socialmediaaccount',
+            name='stock',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of active logs. Maintained by Log.save() and the log signals.'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['account', 'is_active'], name='marketplace_account_45e2d8_idx'),
+        ),
+        migrations.RunPython(populate_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:09
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0033_socialmediaaccount_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
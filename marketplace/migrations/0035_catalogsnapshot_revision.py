@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0034_catalogsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogsnapshot',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
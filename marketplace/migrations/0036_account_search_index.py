@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE marketplace_socialmediaaccount ADD COLUMN search_vector tsvector")
+        schema_editor.execute(
+            "UPDATE marketplace_socialmediaaccount AS a SET search_vector = "
+            "setweight(to_tsvector('simple', coalesce(a.title, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(c.name, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(a.description, '')), 'C') "
+            "FROM marketplace_socialmediaaccount AS s "
+            "LEFT JOIN marketplace_category AS c ON c.id = s.category_id WHERE a.id = s.id"
+        )
+        schema_editor.execute(
+            "CREATE INDEX marketplace_account_search_idx ON marketplace_socialmediaaccount USING GIN (search_vector)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE marketplace_socialmediaaccount_fts "
+            "USING fts5(title, category, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO marketplace_socialmediaaccount_fts (rowid, title, category, description) "
+            "SELECT a.id, coalesce(a.title, ''), coalesce(c.name, ''), a.description "
+            "FROM marketplace_socialmediaaccount AS a "
+            "LEFT JOIN marketplace_category AS c ON c.id = a.category_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE marketplace_socialmediaaccount DROP COLUMN search_vector")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE marketplace_socialmediaaccount_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0035_catalogsnapshot_revision'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
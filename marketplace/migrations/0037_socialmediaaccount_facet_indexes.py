@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0036_account_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='socialmediaaccount',
+            index=models.Index(fields=['category', 'is_active', 'price'], name='marketplace_categor_e58cfe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='socialmediaaccount',
+            index=models.Index(fields=['category', 'is_active', 'followers_count'], name='marketplace_categor_f1e3c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='socialmediaaccount',
+            index=models.Index(fields=['category', 'is_active', 'position'], name='marketplace_categor_da4b12_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+GAP = 1024
+
+
+def spread_positions(apps, schema_editor):
+    for model_name, tiebreak in (('Category', 'created_at'), ('SocialMediaAccount', 'position_created_at')):
+        model = apps.get_model('marketplace', model_name)
+        rows = list(model.objects.order_by('position', tiebreak).only('pk', 'position'))
+        for index, row in enumerate(rows, 1):
+            row.position = index * GAP
+        model.objects.bulk_update(rows, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0037_socialmediaaccount_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='position',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Sort key, lower comes first. 0 moves the category to the end.'),
+        ),
+        migrations.AlterField(
+            model_name='socialmediaaccount',
+            name='position',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Sort key, lower comes first. 0 moves the account to the end.'),
+        ),
+        migrations.RunPython(spread_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:25
+
+import marketplace.fields
+from django.db import migrations, models
+
+
+def log_data_field(field, model):
+    field.set_attributes_from_name('log_data')
+    field.model = model
+    return field
+
+
+def alter_log_data(apps, schema_editor):
+    # rows keep their text as unmarked utf-8 bytes, manage.py compress_logs compresses them
+    Log = apps.get_model('marketplace', 'Log')
+    if schema_editor.connection.vendor == 'postgresql':
+        # a plain ::bytea cast would read backslashes as escapes
+        schema_editor.execute(
+            "ALTER TABLE marketplace_log ALTER COLUMN log_data TYPE bytea USING convert_to(log_data, 'UTF8')"
+        )
+    else:
+        schema_editor.alter_field(Log, Log._meta.get_field('log_data'), log_data_field(marketplace.fields.CompressedTextField(), Log))
+
+
+def restore_log_data(apps, schema_editor):
+    Log = apps.get_model('marketplace', 'Log')
+    if schema_editor.connection.vendor == 'postgresql':
+        # compressed rows have to be decompressed first (manage.py compress_logs --decompress)
+        schema_editor.execute(
+            "ALTER TABLE marketplace_log ALTER COLUMN log_data TYPE text USING convert_from(log_data, 'UTF8')"
+        )
+    else:
+        schema_editor.alter_field(
+            Log, log_data_field(marketplace.fields.CompressedTextField(), Log), log_data_field(models.TextField(), Log)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0038_sparse_positions'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(alter_log_data, restore_log_data),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='log',
+                    name='log_data',
+                    field=marketplace.fields.CompressedTextField(),
+                ),
+            ],
+        ),
+    ]
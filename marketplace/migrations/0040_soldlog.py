@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:27
+
+import django.db.models.deletion
+import marketplace.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0039_compressed_log_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoldLog',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('log_data', marketplace.fields.CompressedTextField(editable=False)),
+                ('timestamp', models.DateTimeField(editable=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='marketplace.socialmediaaccount')),
+                ('order_item', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='sold_logs', to='marketplace.orderitem')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0040_soldlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='content_hash',
+            field=models.CharField(editable=False, help_text='sha256 of the normalized log data, unique per account.', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='soldlog',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='soldlog',
+            index=models.Index(fields=['account', 'content_hash'], name='marketplace_account_fc1516_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='log',
+            constraint=models.UniqueConstraint(fields=('account', 'content_hash'), name='marketplace_log_unique_content'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_idempotencykey'),
+        ('marketplace', '0042_stockreservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='marketplace_user_id_0e25c7_idx'),
+        ),
+    ]
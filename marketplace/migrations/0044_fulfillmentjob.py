@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0043_order_list_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FulfillmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fulfillment_job', to='marketplace.order')),
+            ],
+        ),
+    ]
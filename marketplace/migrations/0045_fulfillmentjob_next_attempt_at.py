@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0044_fulfillmentjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fulfillmentjob',
+            name='next_attempt_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0045_fulfillmentjob_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='position',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Sort key, lower comes first. Positions are spaced 1024 apart (1024, 2048, 3072, ...), so enter the position of the row this one should go before, not a rank like 3. 0 moves the category to the end. The Reorder action sets positions by drag and drop.'),
+        ),
+        migrations.AlterField(
+            model_name='socialmediaaccount',
+            name='position',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Sort key, lower comes first. Positions are spaced 1024 apart (1024, 2048, 3072, ...), so enter the position of the row this one should go before, not a rank like 3. 0 moves the account to the end. The Reorder action sets positions by drag and drop.'),
+        ),
+    ]
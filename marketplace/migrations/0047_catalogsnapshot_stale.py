@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0046_position_help_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogsnapshot',
+            name='stale',
+            field=models.BooleanField(default=False),
+        ),
+    ]
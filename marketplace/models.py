@@ -1,26 +1,143 @@
-from django.db import models
+from django.db import models, transaction, connection, OperationalError
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from decimal import Decimal
 import uuid
+import random
+import time
 from core.models import Transaction
+from .fields import CompressedTextField
+from .importer import log_content_hash
 
 
 class Log(models.Model):
     order_item = models.ForeignKey("marketplace.OrderItem", on_delete=models.CASCADE, related_name='logs', null=True, blank=True, editable=False)
     account = models.ForeignKey("marketplace.SocialMediaAccount", on_delete=models.CASCADE)
-    log_data = models.TextField()
+    log_data = CompressedTextField()
+    content_hash = models.CharField(max_length=64, null=True, editable=False, help_text="sha256 of the normalized log data, unique per account.")
     is_active = models.BooleanField(default=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'is_active']),
+        ]
+        constraints = [
+            # a supplier resending a credential must not put it on sale twice
+            models.UniqueConstraint(fields=['account', 'content_hash'], name='marketplace_log_unique_content'),
+        ]
+
     def __str__(self):
         return f"Log for {self.account}"
 
+    @classmethod
+    def find_duplicate(cls, account_id, content_hash, exclude_pk=None):
+        """Id of a live or archived log of the account with the same content, None if there is none"""
+        duplicate = cls.objects.filter(account_id=account_id, content_hash=content_hash).exclude(pk=exclude_pk)
+        archived = SoldLog.objects.filter(account_id=account_id, content_hash=content_hash)
+        return duplicate.values_list('pk', flat=True).first() or archived.values_list('pk', flat=True).first()
+
+    @classmethod
+    def duplicate_hashes(cls, account_id, content_hashes):
+        """The content hashes a live or archived log of the account already has, find_duplicate for a batch"""
+        live = cls.objects.filter(account_id=account_id, content_hash__in=content_hashes)
+        archived = SoldLog.objects.filter(account_id=account_id, content_hash__in=content_hashes)
+        return set(live.values_list('content_hash', flat=True)) | set(archived.values_list('content_hash', flat=True))
+
+    def clean(self):
+        super().clean()
+        if self.account_id and self.log_data:
+            self.content_hash = log_content_hash(self.log_data)
+            duplicate = Log.find_duplicate(self.account_id, self.content_hash, exclude_pk=self.pk)
+            if duplicate:
+                raise ValidationError({'log_data': f'This account already has this log (log {duplicate}).'})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember what this row counted towards so save() can move the stock
+        instance._loaded_stock_state = (instance.__dict__.get('account_id'), instance.__dict__.get('is_active'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'log_data' in update_fields:
+            self.content_hash = log_content_hash(self.log_data)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_hash'}
+
+        # a live duplicate trips the (account, content_hash) index, archived
+        # ones are only caught by clean() and Log.duplicate_hashes()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._sync_account_stock()
+
+    def _sync_account_stock(self):
+        """Apply the change of this log to SocialMediaAccount.stock"""
+        old_account_id, old_is_active = getattr(self, '_loaded_stock_state', (None, False))
+        if old_account_id == self.account_id and old_is_active == self.is_active:
+            return
+
+        if old_account_id and old_is_active:
+            SocialMediaAccount.adjust_stock(old_account_id, -1)
+        if self.account_id and self.is_active:
+            SocialMediaAccount.adjust_stock(self.account_id, 1)
+        self._loaded_stock_state = (self.account_id, self.is_active)
+
+
+# positions are sparse sort keys, new rows are spaced POSITION_GAP apart so a
+# move can usually take a key between its neighbours and write only itself
+POSITION_GAP = 1024
+MAX_POSITION = 2147483647
+
+
+def rebalance_positions(model):
+    """Respace the positions of every row of model POSITION_GAP apart, keeping their order"""
+    rows = list(model.objects.order_by(*model._meta.ordering).only('pk', 'position'))
+    for index, row in enumerate(rows, 1):
+        row.position = index * POSITION_GAP
+    model.objects.bulk_update(rows, ['position'], batch_size=1000)
+
+
+def assign_position(instance):
+    """
+    Turn instance.position into a free sort key before instance is saved.
+
+    0 appends the row after the last one. A position already taken by
+    another row puts instance right before that row, halfway to the previous
+    one. Only when there is no room left there are the positions respaced.
+    """
+    model = type(instance)
+    others = model.objects.exclude(pk=instance.pk) if instance.pk else model.objects.all()
+
+    if not instance.position:
+        last = others.aggregate(max_pos=models.Max('position'))['max_pos'] or 0
+        if last + POSITION_GAP > MAX_POSITION:
+            rebalance_positions(model)
+            last = others.aggregate(max_pos=models.Max('position'))['max_pos'] or 0
+        instance.position = last + POSITION_GAP
+        return
+
+    occupant = others.filter(position=instance.position).values_list('pk', flat=True).first()
+    if occupant is None:
+        return
+
+    previous = others.filter(position__lt=instance.position).aggregate(max_pos=models.Max('position'))['max_pos'] or 0
+    if instance.position - previous < 2:
+        rebalance_positions(model)
+        instance.position = model.objects.values_list('position', flat=True).get(pk=occupant)
+        previous = others.filter(position__lt=instance.position).aggregate(max_pos=models.Max('position'))['max_pos'] or 0
+    instance.position = (previous + instance.position) // 2
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=100, unique=True, null=True)
-    position = models.PositiveIntegerField(default=0)
+    position = models.PositiveIntegerField(default=0, db_index=True, help_text="Sort key, lower comes first. Positions are spaced 1024 apart (1024, 2048, 3072, ...), so enter the position of the row this one should go before, not a rank like 3. 0 moves the category to the end. The Reorder action sets positions by drag and drop.")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -30,84 +147,22 @@ class Category(models.Model):
     
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_position = instance.__dict__.get('position')
+        return instance
     
     # automatically create slug from name
     def save(self, *args, **kwargs):
         self.slug = self.name.lower().replace(' ', '-')
-        
-        # Handle position assignment with date-based conflict resolution
-        if not self.pk:  # New category
-            if self.position == 0:
-                # Get the highest position and add 1
-                max_position = Category.objects.aggregate(max_pos=models.Max('position'))['max_pos']
-                self.position = (max_position or 0) + 1
-            else:
-                # Check if position already exists
-                existing_at_position = Category.objects.filter(position=self.position).exists()
-                if existing_at_position:
-                    # Shift existing categories with position >= self.position
-                    Category.objects.filter(position__gte=self.position).update(
-                        position=models.F('position') + 1
-                    )
-        else:  # Existing category
-            old_category: Category = Category.objects.get(pk=self.pk)
-            if old_category.position != self.position:
-                if self.position == 0:
-                    # Move to end
-                    max_position = Category.objects.exclude(pk=self.pk).aggregate(max_pos=models.Max('position'))['max_pos']
-                    self.position = (max_position or 0) + 1
-                else:
-                    # Check for position conflicts and resolve using creation date
-                    conflicting_category = Category.objects.filter(
-                        position=self.position
-                    ).exclude(pk=self.pk).first()
-                    
-                    if conflicting_category:
-                        if self.position < old_category.position:
-                            # Moving up - shift categories between new and old position down
-                            Category.objects.filter(
-                                position__gte=self.position,
-                                position__lt=old_category.position
-                            ).exclude(pk=self.pk).update(position=models.F('position') + 1)
-                        else:
-                            # Moving down - shift categories between old and new position up
-                            Category.objects.filter(
-                                position__gt=old_category.position,
-                                position__lte=self.position
-                            ).exclude(pk=self.pk).update(position=models.F('position') - 1)
-                            
-        # Ensure no duplicate positions exist after save
+
+        # only a new row or a moved one needs a sort key
+        if self.position != getattr(self, '_loaded_position', None):
+            assign_position(self)
         super(Category, self).save(*args, **kwargs)
-        
-        # Post-save cleanup: fix any remaining position conflicts using creation date
-        self._fix_position_conflicts()
-    
-    def _fix_position_conflicts(self):
-        """Fix position conflicts by using creation date as tiebreaker"""
-        # Get all categories with duplicate positions
-        from django.db.models import Count
-        duplicate_positions = Category.objects.values('position').annotate(
-            count=Count('position')
-        ).filter(count__gt=1).values_list('position', flat=True)
-        
-        for position in duplicate_positions:
-            # Get categories at this position, ordered by creation date
-            categories_at_position = Category.objects.filter(
-                position=position
-            ).order_by('created_at')
-            
-            # Keep the first (oldest) category at this position
-            # Move others to the next available positions
-            for i, category in enumerate(categories_at_position[1:], 1):
-                max_position = Category.objects.aggregate(
-                    max_pos=models.Max('position')
-                )['max_pos'] or 0
-                category.position = max_position + i
-                # Use update to avoid triggering save() again
-                Category.objects.filter(pk=category.pk).update(
-                    position=category.position
-                )
-    
+        self._loaded_position = self.position
     
     
 class SocialMediaAccount(models.Model):
@@ -131,100 +186,73 @@ class SocialMediaAccount(models.Model):
         validators=[MinValueValidator(Decimal('0.01'))],
         help_text="The price of the account. It is in Naira."
     )
-    # stock = models.PositiveIntegerField(default=0)
+    stock = models.PositiveIntegerField(default=0, editable=False, help_text="Number of active logs. Maintained by Log.save() and the log signals.")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    position = models.PositiveIntegerField(default=0)
+    position = models.PositiveIntegerField(default=0, db_index=True, help_text="Sort key, lower comes first. Positions are spaced 1024 apart (1024, 2048, 3072, ...), so enter the position of the row this one should go before, not a rank like 3. 0 moves the account to the end. The Reorder action sets positions by drag and drop.")
     position_created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['position', 'position_created_at']
+        indexes = [
+            # view_all facets: filter a category's active accounts, sort by price / followers / position
+            models.Index(fields=['category', 'is_active', 'price']),
+            models.Index(fields=['category', 'is_active', 'followers_count']),
+            models.Index(fields=['category', 'is_active', 'position']),
+        ]
     
     def __str__(self):
         return f"{self.social_media} - {self.title} - {self.followers_count} followers"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the category so the catalog hooks can refresh the one it left
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        instance._loaded_position = instance.__dict__.get('position')
+        return instance
     
     def save(self, *args, **kwargs):
-        # Handle position assignment with date-based conflict resolution
-        if not self.pk:  # New social_media_acct
-            if self.position == 0:
-                # Get the highest position and add 1
-                max_position = SocialMediaAccount.objects.aggregate(max_pos=models.Max('position'))['max_pos']
-                self.position = (max_position or 0) + 1
-            else:
-                # Check if position already exists
-                existing_at_position = SocialMediaAccount.objects.filter(position=self.position).exists()
-                if existing_at_position:
-                    # Shift existing categories with position >= self.position
-                    SocialMediaAccount.objects.filter(position__gte=self.position).update(
-                        position=models.F('position') + 1
-                    )
-        else:  # Existing social_media_acct
-            old_social_media_acct: SocialMediaAccount = SocialMediaAccount.objects.get(pk=self.pk)
-            if old_social_media_acct.position != self.position:
-                if self.position == 0:
-                    # Move to end
-                    max_position = SocialMediaAccount.objects.exclude(pk=self.pk).aggregate(max_pos=models.Max('position'))['max_pos']
-                    self.position = (max_position or 0) + 1
-                else:
-                    # Check for position conflicts and resolve using creation date
-                    conflicting_social_media_acct = SocialMediaAccount.objects.filter(
-                        position=self.position
-                    ).exclude(pk=self.pk).first()
-                    
-                    if conflicting_social_media_acct:
-                        if self.position < old_social_media_acct.position:
-                            # Moving up - shift categories between new and old position down
-                            SocialMediaAccount.objects.filter(
-                                position__gte=self.position,
-                                position__lt=old_social_media_acct.position
-                            ).exclude(pk=self.pk).update(position=models.F('position') + 1)
-                        else:
-                            # Moving down - shift categories between old and new position up
-                            SocialMediaAccount.objects.filter(
-                                position__gt=old_social_media_acct.position,
-                                position__lte=self.position
-                            ).exclude(pk=self.pk).update(position=models.F('position') - 1)
-                            
-        # Ensure no duplicate positions exist after save
+        # stock is owned by the log hooks, never write back a stale in-memory value
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'stock'
+            ]
+
+        # only a new row or a moved one needs a sort key
+        if self.position != getattr(self, '_loaded_position', None):
+            assign_position(self)
         super(SocialMediaAccount, self).save(*args, **kwargs)
-        
-        # Post-save cleanup: fix any remaining position conflicts using creation date
-        self._fix_position_conflicts()
-    
-    def _fix_position_conflicts(self):
-        """Fix position conflicts by using creation date as tiebreaker"""
-        # Get all categories with duplicate positions
-        from django.db.models import Count
-        duplicate_positions = SocialMediaAccount.objects.values('position').annotate(
-            count=Count('position')
-        ).filter(count__gt=1).values_list('position', flat=True)
-        
-        for position in duplicate_positions:
-            # Get categories at this position, ordered by creation date
-            categories_at_position: list[SocialMediaAccount] = SocialMediaAccount.objects.filter(
-                position=position
-            ).order_by('position_created_at')
-            
-            # Keep the first (oldest) social_media_acct at this position
-            # Move others to the next available positions
-            for i, social_media_acct in enumerate(categories_at_position[1:], 1):
-                max_position = SocialMediaAccount.objects.aggregate(
-                    max_pos=models.Max('position')
-                )['max_pos'] or 0
-                social_media_acct.position = max_position + i
-                # Use update to avoid triggering save() again
-                SocialMediaAccount.objects.filter(pk=social_media_acct.pk).update(
-                    position=social_media_acct.position
-                )
+        self._loaded_position = self.position
     
     @property
     def social_media(self):
         return self.category.name if self.category else ''
 
-    @property
-    def stock(self):
-        return Log.objects.filter(account=self, is_active=True).count()
+    @classmethod
+    def adjust_stock(cls, account_id, delta):
+        """
+        Move the stock counter of an account by delta inside the current transaction
+
+        Args:
+            account_id (int): the account whose logs changed
+            delta (int): number of active logs added (positive) or removed (negative)
+        """
+        if not delta:
+            return
+        cls.objects.filter(pk=account_id).update(stock=models.F('stock') + delta)
+
+    @classmethod
+    def recount_stock(cls, account_ids):
+        """Recompute the stock counter of the given accounts from their active logs"""
+        active_logs = Log.objects.filter(
+            account=models.OuterRef('pk'), is_active=True
+        ).order_by().values('account').annotate(count=models.Count('pk')).values('count')
+        cls.objects.filter(pk__in=account_ids).update(
+            stock=Coalesce(models.Subquery(active_logs), 0)
+        )
 
     @property
     def is_in_stock(self):
@@ -248,6 +276,12 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # the orders list: a user's orders, newest first, keyset paginated
+            models.Index(fields=['user', '-created_at', '-id']),
+        ]
+
     def __str__(self):
         return f"Order {self.order_number}"
 
@@ -263,6 +297,10 @@ class Order(models.Model):
     def disp_order_number(self):
         return f"{self.order_number}".lower().replace('ord-', '')
 
+# attempts of a log claim that found SQLite locked by another writer
+ALLOCATION_RETRIES = 10
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     account = models.ForeignKey(SocialMediaAccount, on_delete=models.CASCADE)
@@ -277,20 +315,168 @@ class OrderItem(models.Model):
     def subtotal(self):
         return self.quantity * self.price
 
+    @property
+    def delivered_logs(self):
+        """Logs sold with this item, live and archived ones (see SoldLog)"""
+        return list(self.logs.all()) + list(self.sold_logs.all())
+
     def get_allocated_logs(self):
+        """
+        Claim quantity active logs of the account for this item, or return the
+        ones it already has. Raises InsufficientStock, and claims nothing, when
+        fewer than quantity active logs are left.
+
+        Rows are claimed with one locking SELECT and one UPDATE. On Postgres the
+        SELECT skips rows locked by concurrent buyers instead of waiting for them.
+        SQLite has no row locks but runs one writer at a time, there the claim is
+        a single UPDATE over a LIMIT subquery so two buyers can't take the same
+        row, and a claim that finds the database locked is retried.
+        """
         if self.quantity <= 0:
             return []
 
-        # check if the item already has allocated logs
-        if Log.objects.filter(order_item=self).exists():
-            return Log.objects.filter(order_item=self)
+        for attempt in range(ALLOCATION_RETRIES):
+            try:
+                return self._claim_logs()
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == ALLOCATION_RETRIES - 1 or connection.in_atomic_block:
+                    raise
+                time.sleep(random.uniform(0.01, 0.05) * (attempt + 1))
 
-        # allocate logs (quantity, for example 10 for 10 logs) to order item and mark them as inactive
-        new_logs = Log.objects.filter(account=self.account, is_active=True)[:self.quantity]
-        for log in new_logs:
-            log.order_item = self
-            log.is_active = False
-            log.save()
-        
-        return new_logs
+    def _claim_logs(self):
+        allocated = Log.objects.filter(order_item=self)
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                # one claim per item, a concurrent call for the same item waits here
+                list(OrderItem.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+                if allocated.exists() or self.sold_logs.exists():
+                    return self.delivered_logs
+                logs = list(
+                    Log.objects.select_for_update(skip_locked=True)
+                    .filter(account_id=self.account_id, is_active=True)
+                    .order_by('pk')[:self.quantity]
+                )
+                claimed = Log.objects.filter(pk__in=[log.pk for log in logs]).update(order_item=self, is_active=False)
+                for log in logs:
+                    log.order_item, log.is_active = self, False
+                    log._loaded_stock_state = (log.account_id, False)
+            else:
+                if allocated.exists() or self.sold_logs.exists():
+                    return self.delivered_logs
+                claim = Log.objects.filter(account_id=self.account_id, is_active=True).order_by('pk').values('pk')[:self.quantity]
+                # the Exists() guard keeps a concurrent call for the same item from claiming a second batch
+                claimed = Log.objects.filter(pk__in=models.Subquery(claim)).exclude(
+                    models.Exists(allocated)
+                ).update(order_item=self, is_active=False)
+                logs = list(allocated)
+                if not claimed and logs:
+                    # a concurrent call for the same item claimed them first
+                    return logs
+
+            if claimed != self.quantity:
+                # rolls the partial claim back, a short batch must never be delivered
+                from .reservations import InsufficientStock
+                raise InsufficientStock(self.account)
+
+            # bulk updates skip Log.save(), move the stock counter here
+            SocialMediaAccount.adjust_stock(self.account_id, -claimed)
+            if claimed:
+                from .catalog import mark_catalog_changed
+                mark_catalog_changed(account_ids=[self.account_id])
+
+        return logs
         
+
+
+class SoldLog(models.Model):
+    """
+    A sold log moved out of Log by manage.py archive_sold_logs.
+
+    Keeps the id, payload and creation time of the original row so the live
+    Log table only holds unsold inventory and recent sales. Read through
+    OrderItem.delivered_logs.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    order_item = models.ForeignKey(OrderItem, on_delete=models.CASCADE, related_name='sold_logs', editable=False)
+    account = models.ForeignKey(SocialMediaAccount, on_delete=models.CASCADE, editable=False)
+    log_data = CompressedTextField(editable=False)
+    content_hash = models.CharField(max_length=64, null=True, editable=False)
+    timestamp = models.DateTimeField(editable=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'content_hash']),
+        ]
+
+    def __str__(self):
+        return f"Sold log for {self.account}"
+
+    @property
+    def is_active(self):
+        return False
+
+
+class StockReservation(models.Model):
+    """
+    Units of an account held for an unpaid order until expires_at.
+
+    Written by checkout and consumed when the logs are allocated. Available
+    stock is stock minus the unexpired holds (see reservations.py), expired
+    rows are simply ignored until manage.py release_expired_holds deletes them.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    account = models.ForeignKey(SocialMediaAccount, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # the unexpired holds of an account, summed next to its stock
+            models.Index(fields=['account', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.account_id} held for order {self.order_id}"
+
+
+class FulfillmentJob(models.Model):
+    """
+    A paid order waiting for its logs.
+
+    confirm_payment queues the order in the transaction of the debit and
+    returns, manage.py run_fulfillment allocates the logs, completes the order
+    and deletes the job (see fulfillment.py). A failed attempt stays queued
+    with its error and is retried at next_attempt_at, with a growing delay,
+    until FULFILLMENT_MAX_ATTEMPTS is reached and the order is refunded.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='fulfillment_job')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Fulfillment of order {self.order_id}"
+
+
+class CatalogSnapshot(models.Model):
+    """
+    Fully prepared payload of a listing page (the home page or one category).
+
+    Rebuilt on write by the catalog signals so listing views only have to load
+    and render it. version is the payload format, snapshots written in an older
+    format are ignored and rebuilt on the next read. revision is bumped on every
+    rebuild and, with built_at, drives the ETag / Last-Modified of the page.
+    stale is set when stock holds move the available stock it shows, stale
+    snapshots are rebuilt by manage.py release_expired_holds.
+    """
+    key = models.CharField(max_length=150, unique=True)
+    version = models.PositiveIntegerField(default=0)
+    revision = models.PositiveBigIntegerField(default=0)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    built_at = models.DateTimeField(auto_now=True)
+    stale = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"Catalog snapshot {self.key} (v{self.version})"
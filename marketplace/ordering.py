@@ -0,0 +1,93 @@
+"""
+Bulk reordering of categories and accounts.
+
+A complete new ordering is applied in one transaction with a single
+UPDATE ... CASE per model, and positions_reordered is sent once afterwards
+so the catalog hooks in signals.py run once instead of once per row.
+"""
+from django.db import models, transaction
+from django.dispatch import Signal
+from .models import SocialMediaAccount, Category, POSITION_GAP, rebalance_positions
+
+
+# sent once per apply_ordering() with the ids of the categories whose accounts moved
+positions_reordered = Signal()
+
+
+def _write_positions(model, positions):
+    """Write {pk: position} with one UPDATE ... CASE statement"""
+    if not positions:
+        return
+    model.objects.filter(pk__in=positions).update(position=models.Case(
+        *[models.When(pk=pk, then=models.Value(position)) for pk, position in positions.items()],
+        output_field=models.PositiveIntegerField(),
+    ))
+
+
+def _category_positions(category_ids):
+    current = set(Category.objects.select_for_update().values_list('pk', flat=True))
+    if len(category_ids) != len(current) or set(category_ids) != current:
+        raise ValueError('The category ordering must list every category exactly once')
+    return {pk: index * POSITION_GAP for index, pk in enumerate(category_ids, 1)}
+
+
+def _account_positions(orderings):
+    """
+    The accounts of a category take the positions the category already uses,
+    in the new order, so their place relative to other categories is kept.
+    """
+    rows = list(
+        SocialMediaAccount.objects.select_for_update()
+        .filter(category_id__in=orderings)
+        .order_by('position', 'position_created_at')
+        .values_list('category_id', 'pk', 'position')
+    )
+    if len({position for _, _, position in rows}) < len(rows):
+        # duplicate positions from before positions were sparse, spread them first
+        rebalance_positions(SocialMediaAccount)
+        return _account_positions(orderings)
+
+    slots = {category_id: [] for category_id in orderings}
+    members = {category_id: set() for category_id in orderings}
+    for category_id, pk, position in rows:
+        slots[category_id].append(position)
+        members[category_id].add(pk)
+
+    positions = {}
+    for category_id, account_ids in orderings.items():
+        if len(account_ids) != len(members[category_id]) or set(account_ids) != members[category_id]:
+            raise ValueError(f'The ordering of category {category_id} must list each of its accounts exactly once')
+        positions.update(zip(account_ids, slots[category_id]))
+    return positions
+
+
+def apply_ordering(categories=None, accounts=None):
+    """
+    Apply complete new orderings in a single transaction.
+
+    Args:
+        categories (list): every category id, in the new order
+        accounts (dict): {category_id: [every account id of that category, in the new order]}
+
+    Raises:
+        ValueError: when an ordering is not complete or lists foreign ids
+    """
+    accounts = {int(category_id): [int(pk) for pk in ids] for category_id, ids in (accounts or {}).items()}
+    categories = [int(pk) for pk in categories] if categories is not None else None
+
+    with transaction.atomic():
+        category_positions = _category_positions(categories) if categories is not None else {}
+        account_positions = _account_positions(accounts) if accounts else {}
+
+        _write_positions(Category, category_positions)
+        _write_positions(SocialMediaAccount, account_positions)
+
+        if category_positions or account_positions:
+            positions_reordered.send(
+                sender=Category if category_positions else SocialMediaAccount,
+                category_ids=set(accounts),
+                account_ids=set(account_positions),
+                all_categories=bool(category_positions),
+            )
+
+    return len(category_positions) + len(account_positions)
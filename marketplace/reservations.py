@@ -0,0 +1,168 @@
+"""
+Time-boxed stock holds between checkout and payment.
+
+Checkout reserves the units of an order for STOCK_RESERVATION_MINUTES.
+Available stock is the stock counter minus the unexpired holds of the account,
+read once the account rows are locked, so a checkout can only reserve
+units nobody else holds and the payment of a held order always finds its logs.
+
+Holds are released when the logs are allocated or the order is cancelled.
+Expired holds count for nothing, correctness doesn't depend on a cron job.
+They are deleted when an order takes its units again, and by manage.py
+release_expired_holds which also publishes the units they give back.
+"""
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import SocialMediaAccount, StockReservation
+from datetime import timedelta
+
+
+class InsufficientStock(Exception):
+    """Raised when an account can't cover a reservation"""
+
+    def __init__(self, account):
+        self.account = account
+        super().__init__(f'Insufficient stock for {account.social_media}')
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+
+
+def with_available_stock(queryset, now=None):
+    """Annotate accounts with reserved (unexpired holds) and available (stock - reserved)"""
+    now = now or timezone.now()
+    reserved = StockReservation.objects.filter(
+        account=models.OuterRef('pk'), expires_at__gt=now
+    ).order_by().values('account').annotate(total=models.Sum('quantity')).values('total')
+    return queryset.annotate(
+        reserved=Coalesce(models.Subquery(reserved), 0),
+        available=models.F('stock') - models.F('reserved'),
+    )
+
+
+def order_quantities(order):
+    """{account id: units} of an order"""
+    return dict(
+        order.items.order_by().values('account').annotate(total=models.Sum('quantity')).values_list('account', 'total')
+    )
+
+
+def reserve_stock(order, quantities):
+    """
+    Hold quantities ({account id: units}) for order, replacing the holds it had
+
+    Raises:
+        SocialMediaAccount.DoesNotExist: if an account is gone
+        InsufficientStock: if an account doesn't have the units available, nothing is held then
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # the write comes first so SQLite takes its lock before the stock is read
+        StockReservation.objects.filter(
+            models.Q(account_id__in=quantities, expires_at__lte=now) | models.Q(order=order)
+        ).delete()
+        list(lock_accounts(quantities).values_list('pk', flat=True))
+        return hold_stock(order, quantities, now)
+
+
+def lock_accounts(account_ids):
+    """
+    Accounts of account_ids, locked (select_for_update) when evaluated
+
+    Lock them before hold_stock() reads their holds, in a separate statement:
+    a locking read returns the row as it is once the lock is granted, but
+    READ COMMITTED evaluates the rest of the statement (the holds subquery) on
+    the snapshot taken before waiting, missing the holds of the checkout it
+    waited for.
+    """
+    # always in the same order, two carts sharing accounts can't deadlock
+    return SocialMediaAccount.objects.select_for_update().filter(pk__in=account_ids).order_by('pk')
+
+
+def hold_stock(order, quantities, now=None):
+    """
+    Hold quantities ({account id: units}) for an order that holds nothing yet
+
+    Must run in the transaction that locked the accounts (see lock_accounts).
+
+    Raises:
+        SocialMediaAccount.DoesNotExist: if an account is gone
+        InsufficientStock: if an account doesn't have the units available, nothing is held then
+    """
+    now = now or timezone.now()
+    accounts = with_available_stock(SocialMediaAccount.objects.filter(pk__in=quantities), now).in_bulk()
+    for account_id, quantity in quantities.items():
+        account = accounts.get(account_id)
+        if account is None:
+            raise SocialMediaAccount.DoesNotExist(f'Account {account_id} does not exist')
+        if account.available < quantity:
+            raise InsufficientStock(account)
+
+    expires_at = now + reservation_ttl()
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, account_id=account_id, quantity=quantity, expires_at=expires_at)
+        for account_id, quantity in quantities.items() if quantity > 0
+    ])
+    _publish_available_stock(quantities)
+    return expires_at
+
+
+def hold_order(order):
+    """
+    Make sure order holds all its units for another TTL before it is paid
+
+    A hold that is still valid is extended, an expired one is taken again if
+    the stock allows it.
+
+    Raises:
+        InsufficientStock: if the hold expired and the units went to someone else
+    """
+    now = timezone.now()
+    quantities = order_quantities(order)
+    with transaction.atomic():
+        held = StockReservation.objects.select_for_update().filter(order=order, expires_at__gt=now)
+        if dict(held.values_list('account', 'quantity')) == {k: v for k, v in quantities.items() if v > 0}:
+            expires_at = now + reservation_ttl()
+            held.update(expires_at=expires_at)
+            return expires_at
+        return reserve_stock(order, quantities)
+
+
+# a paid order keeps its units until the fulfillment worker allocates them
+PAID_HOLD = timedelta(days=30)
+
+
+def hold_for_fulfillment(order):
+    """Keep the holds of a paid order until its logs are allocated (see fulfillment.py)"""
+    StockReservation.objects.filter(order=order).update(expires_at=timezone.now() + PAID_HOLD)
+
+
+def release_order(order):
+    """Drop the holds of an order, its logs were allocated or it won't be paid"""
+    holds = StockReservation.objects.filter(order=order)
+    account_ids = set(holds.values_list('account', flat=True))
+    if account_ids:
+        holds.delete()
+        _publish_available_stock(account_ids)
+
+
+def release_expired_holds():
+    """Delete the expired holds and publish the stock they give back, returns the number of holds deleted"""
+    expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+    with transaction.atomic():
+        account_ids = set(expired.values_list('account', flat=True))
+        deleted, _ = expired.delete()
+        if account_ids:
+            # runs from cron, the listings are rebuilt right away
+            from .catalog import mark_catalog_changed
+            mark_catalog_changed(account_ids=account_ids)
+    return deleted
+
+
+def _publish_available_stock(account_ids):
+    """Publish the stock events of accounts whose available stock moved, the listings catch up later"""
+    from .catalog import mark_stock_changed
+    mark_stock_changed(account_ids)
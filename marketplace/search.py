@@ -0,0 +1,108 @@
+"""
+Full-text search over the catalog.
+
+Accounts are indexed on their title, category name and description. The
+index lives in the database: an FTS5 table on SQLite and a tsvector column
+with a GIN index on Postgres (both created by migration 0036). It is kept up
+to date incrementally by the account and category signals.
+"""
+import re
+from django.db import connection
+from .models import SocialMediaAccount
+from .reservations import with_available_stock
+
+
+FTS_TABLE = 'marketplace_socialmediaaccount_fts'
+ACCOUNT_TABLE = 'marketplace_socialmediaaccount'
+CATEGORY_TABLE = 'marketplace_category'
+
+# Postgres document: title weighs most, then the category, then the description
+PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(a.title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(c.name, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(a.description, '')), 'C')"
+)
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+def index_accounts(account_ids):
+    """(Re)index the given accounts, deleted ones are dropped from the index"""
+    account_ids = list(account_ids)
+    if not account_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(account_ids))
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"UPDATE {ACCOUNT_TABLE} AS a SET search_vector = {PG_DOCUMENT} "
+                f"FROM {ACCOUNT_TABLE} AS s LEFT JOIN {CATEGORY_TABLE} AS c ON c.id = s.category_id "
+                f"WHERE a.id = s.id AND a.id IN ({placeholders})",
+                account_ids,
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", account_ids)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, category, description) "
+                f"SELECT a.id, coalesce(a.title, ''), coalesce(c.name, ''), a.description "
+                f"FROM {ACCOUNT_TABLE} AS a LEFT JOIN {CATEGORY_TABLE} AS c ON c.id = a.category_id "
+                f"WHERE a.id IN ({placeholders})",
+                account_ids,
+            )
+
+
+def index_category(category_id):
+    """Reindex the accounts of a category after it was renamed"""
+    index_accounts(SocialMediaAccount.objects.filter(category_id=category_id).values_list('pk', flat=True))
+
+
+def search_account_ids(query, limit=20, offset=0, active_only=True):
+    """
+    Ids of the accounts matching every word of query (as a prefix), best
+    match first, and the total number of matches.
+    """
+    active = 'AND a.is_active' if active_only else ''
+    terms = _terms(query)
+    if not terms:
+        return [], 0
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            tsquery = ' & '.join(f'{term}:*' for term in terms)
+            matches = (
+                f"FROM {ACCOUNT_TABLE} AS a, to_tsquery('simple', %s) AS q "
+                f"WHERE a.search_vector @@ q {active}"
+            )
+            cursor.execute(f"SELECT count(*) {matches}", [tsquery])
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT a.id {matches} ORDER BY ts_rank_cd(a.search_vector, q) DESC, a.position LIMIT %s OFFSET %s",
+                [tsquery, limit, offset],
+            )
+        elif connection.vendor == 'sqlite':
+            match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+            matches = (
+                f"FROM {FTS_TABLE} JOIN {ACCOUNT_TABLE} AS a ON a.id = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s {active}"
+            )
+            cursor.execute(f"SELECT count(*) {matches}", [match])
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT a.id {matches} ORDER BY bm25({FTS_TABLE}, 10.0, 5.0, 1.0), a.position LIMIT %s OFFSET %s",
+                [match, limit, offset],
+            )
+        else:
+            raise NotImplementedError(f'Catalog search is not supported on {connection.vendor}')
+        ids = [row[0] for row in cursor.fetchall()]
+
+    return ids, total
+
+
+def search_accounts(query, limit=20, offset=0):
+    """Accounts matching query in rank order, and the total number of matches"""
+    ids, total = search_account_ids(query, limit, offset)
+    accounts = with_available_stock(SocialMediaAccount.objects.select_related('category')).in_bulk(ids)
+    return [accounts[pk] for pk in ids if pk in accounts], total
@@ -1,21 +1,21 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
-from .models import SocialMediaAccount, Category
+from django.utils import timezone
+from .models import SocialMediaAccount, Category, Log, Order, OrderItem
+from .catalog import mark_catalog_changed
+from .search import index_accounts, index_category
+from .ordering import positions_reordered
 from core.cache_utils import invalidate_cache_pattern
 
 
 @receiver([post_save, post_delete], sender=SocialMediaAccount)
 def invalidate_account_cache(sender, instance, **kwargs):
-    """Invalidate cache when SocialMediaAccount is modified"""
-    # Clear specific account caches
-    cache_keys_to_clear = [
-        f'accounts_{instance.category.slug}',
-        'marketplace_accounts_all',
-    ]
-    
-    for key in cache_keys_to_clear:
-        cache.delete(key)
+    """Invalidate cache and rebuild catalog snapshots when SocialMediaAccount is modified"""
+    # Rebuild the category the account is in and the one it was moved out of
+    category_ids = {instance.category_id, getattr(instance, '_loaded_category_id', None)} - {None}
+    mark_catalog_changed(account_ids=[instance.pk], category_ids=category_ids)
+    instance._loaded_category_id = instance.category_id
+    index_accounts([instance.pk])
     
     # Clear view caches
     invalidate_cache_pattern('view_all')
@@ -24,8 +24,51 @@ def invalidate_account_cache(sender, instance, **kwargs):
 
 @receiver([post_save, post_delete], sender=Category)
 def invalidate_category_cache(sender, instance, **kwargs):
-    """Invalidate cache when Category is modified"""
+    """Invalidate cache and rebuild catalog snapshots when Category is modified"""
+    # Name, slug and position changes affect every listing page
+    mark_catalog_changed(all_categories=True)
+    if kwargs.get('signal') is post_delete:
+        # the accounts of a deleted category were moved out of it
+        index_accounts(SocialMediaAccount.objects.filter(category__isnull=True).values_list('pk', flat=True))
+    else:
+        index_category(instance.pk)
+
     # Clear all marketplace related caches
     invalidate_cache_pattern('marketplace')
     invalidate_cache_pattern('view_all')
-    cache.delete('marketplace_accounts_all')
\ No newline at end of file
+
+
+@receiver(positions_reordered)
+def invalidate_reordered_cache(sender, category_ids, account_ids, all_categories, **kwargs):
+    """Rebuild catalog snapshots once after a bulk reorder (no per-row save signals are sent)"""
+    mark_catalog_changed(category_ids=category_ids, all_categories=all_categories)
+
+    invalidate_cache_pattern('marketplace')
+    invalidate_cache_pattern('view_all')
+
+
+@receiver(post_save, sender=Log)
+def refresh_log_account(sender, instance, **kwargs):
+    """Refresh the stock shown in the catalog when a log is added or sold"""
+    mark_catalog_changed(account_ids=[instance.account_id])
+
+
+@receiver(post_delete, sender=Log)
+def release_log_stock(sender, instance, **kwargs):
+    """Keep SocialMediaAccount.stock in sync when an active log is deleted"""
+    if instance.is_active:
+        SocialMediaAccount.adjust_stock(instance.account_id, -1)
+        mark_catalog_changed(account_ids=[instance.account_id])
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def invalidate_order_page(sender, instance, **kwargs):
+    """An edited item changes the cached page of its order (see views.order_details)"""
+    Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Log)
+def invalidate_sold_log_page(sender, instance, **kwargs):
+    """An edited sold log changes the cached log pages of its order"""
+    if instance.order_item_id:
+        Order.objects.filter(items=instance.order_item_id).update(updated_at=timezone.now())
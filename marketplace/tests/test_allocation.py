@@ -0,0 +1,81 @@
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from marketplace.models import SocialMediaAccount, Category, Order, OrderItem, Log
+from marketplace.reservations import InsufficientStock
+from collections import Counter
+from decimal import Decimal
+from threading import Barrier, Thread
+
+
+class AllocationTests(TestCase):
+    def setUp(self):
+        self.account = SocialMediaAccount.objects.create(
+            title='Test Account', category=Category.objects.create(name='Twitter'), description='Test', price=Decimal('10.00')
+        )
+        Log.objects.bulk_create([Log(account=self.account, log_data=f'user{i}:pass') for i in range(600)])
+        SocialMediaAccount.recount_stock([self.account.pk])
+        self.order = Order.objects.create(total_amount=Decimal('5000.00'))
+
+    def test_large_order_is_claimed_in_one_update(self):
+        item = OrderItem.objects.create(order=self.order, account=self.account, quantity=500, price=Decimal('10.00'))
+        with CaptureQueriesContext(connection) as queries:
+            logs = item.get_allocated_logs()
+
+        self.assertEqual(len(logs), 500)
+        log_updates = [q for q in queries if q['sql'].startswith('UPDATE "marketplace_log"')]
+        self.assertEqual(len(log_updates), 1)
+        self.assertEqual(Log.objects.filter(order_item=item, is_active=False).count(), 500)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 100)
+
+        # a second call returns the same logs
+        self.assertEqual(sorted(log.pk for log in item.get_allocated_logs()), sorted(log.pk for log in logs))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 100)
+
+    def test_short_claim_is_rolled_back(self):
+        item = OrderItem.objects.create(order=self.order, account=self.account, quantity=601, price=Decimal('10.00'))
+        with self.assertRaises(InsufficientStock):
+            item.get_allocated_logs()
+
+        self.assertFalse(Log.objects.filter(order_item=item).exists())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 600)
+
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    def test_no_log_is_sold_twice(self):
+        account = SocialMediaAccount.objects.create(title='Test Account', description='Test', price=Decimal('10.00'))
+        Log.objects.bulk_create([Log(account=account, log_data=f'user{i}:pass') for i in range(50)])
+        SocialMediaAccount.recount_stock([account.pk])
+        order = Order.objects.create(total_amount=Decimal('1000.00'))
+        items = [OrderItem.objects.create(order=order, account=account, quantity=3, price=Decimal('10.00')) for _ in range(20)]
+
+        barrier = Barrier(len(items))
+        errors = []
+
+        def buy(item):
+            try:
+                barrier.wait()
+                item.get_allocated_logs()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=buy, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 20 buyers want 60 logs, 16 get their 3 and the others get nothing
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(e, InsufficientStock) for e in errors))
+        sold = list(Log.objects.filter(is_active=False).values_list('order_item_id', flat=True))
+        self.assertEqual(len(sold), 48)
+        self.assertEqual(set(Counter(sold).values()), {3})
+        self.assertEqual(Log.objects.filter(is_active=False, order_item=None).count(), 0)
+        account.refresh_from_db()
+        self.assertEqual(account.stock, 2)
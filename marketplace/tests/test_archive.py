@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from marketplace.models import SocialMediaAccount, Order, OrderItem, Log, SoldLog
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SoldLogArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.account = SocialMediaAccount.objects.create(title='Test', description='Test', price=Decimal('10.00'))
+        for i in range(5):
+            Log.objects.create(account=self.account, log_data=f'user{i}:pass')
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('30.00'), status='completed')
+        self.old_item = OrderItem.objects.create(order=self.order, account=self.account, quantity=2, price=Decimal('10.00'))
+        self.new_item = OrderItem.objects.create(order=self.order, account=self.account, quantity=1, price=Decimal('10.00'))
+        self.sold = {log.log_data for log in self.old_item.get_allocated_logs()}
+        self.new_item.get_allocated_logs()
+        OrderItem.objects.filter(pk=self.old_item.pk).update(created_at=timezone.now() - timedelta(days=40))
+
+    def test_archives_old_sales_only(self):
+        out = StringIO()
+        call_command('archive_sold_logs', '--batch-size', '1', stdout=out)
+        self.assertIn('Logs archived: 2', out.getvalue())
+
+        # the live table keeps unsold inventory and recent sales
+        self.assertEqual(Log.objects.filter(is_active=True).count(), 2)
+        self.assertEqual(Log.objects.filter(is_active=False).count(), 1)
+        self.assertEqual({log.log_data for log in SoldLog.objects.all()}, self.sold)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 2)
+
+        # archived logs are still delivered and never reallocated
+        self.assertEqual({log.log_data for log in self.old_item.get_allocated_logs()}, self.sold)
+        self.assertEqual(Log.objects.filter(is_active=True).count(), 2)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('marketplace:order_item_logs', args=[self.order.id, self.old_item.id]))
+        for log_data in self.sold:
+            self.assertIn(log_data, response.json()['html'])
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('archive_sold_logs', '--dry-run', '--older-than-days', '0', stdout=out)
+        self.assertIn('Logs archived: 3', out.getvalue())
+        self.assertFalse(SoldLog.objects.exists())
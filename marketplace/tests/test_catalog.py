@@ -0,0 +1,203 @@
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.management import call_command
+from django.core.cache import cache
+from marketplace.models import SocialMediaAccount, Category, CatalogSnapshot, Log
+from marketplace.catalog import (
+    load_home_catalog, load_home_snapshot, load_category_snapshot,
+    rebuild_catalog_snapshots, category_facets, mark_catalog_changed, HOME_ACCOUNTS_PER_CATEGORY,
+)
+from decimal import Decimal
+from io import StringIO
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class HomeCatalogTests(TestCase):
+    def setUp(self):
+        self.twitter = Category.objects.create(name='Twitter', position=2)
+        self.instagram = Category.objects.create(name='Instagram', position=1)
+        for category in (self.twitter, self.instagram):
+            for i in range(HOME_ACCOUNTS_PER_CATEGORY + 4):
+                SocialMediaAccount.objects.create(
+                    title=f'{category.name} {i}',
+                    category=category,
+                    description='Test',
+                    price=Decimal('100.00'),
+                )
+        SocialMediaAccount.objects.create(
+            title='Hidden', category=self.twitter, description='Test', price=Decimal('1.00'), is_active=False
+        )
+
+    def test_top_accounts_per_category_in_one_query(self):
+        with self.assertNumQueries(1):
+            grouped_accounts = load_home_catalog()
+
+        self.assertEqual([group['slug'] for group in grouped_accounts], ['instagram', 'twitter'])
+        for group in grouped_accounts:
+            expected = list(
+                SocialMediaAccount.objects.filter(category__slug=group['slug'], is_active=True)
+                .values_list('id', flat=True)[:HOME_ACCOUNTS_PER_CATEGORY]
+            )
+            self.assertEqual([account['id'] for account in group['accounts']], expected)
+
+    def test_marketplace_page(self):
+        response = self.client.get(reverse('marketplace:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Instagram 0')
+        self.assertNotContains(response, 'Hidden')
+        self.assertNotContains(response, f'Twitter {HOME_ACCOUNTS_PER_CATEGORY}`')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        # flush the catalog changes of the fixtures, the tests count their own
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name='Twitter')
+            self.account = SocialMediaAccount.objects.create(
+                title='Snapshot Account',
+                category=self.category,
+                description='Test',
+                price=Decimal('100.00'),
+                followers_count=1500,
+            )
+        rebuild_catalog_snapshots()
+
+    def test_listing_pages_only_read_the_snapshot(self):
+        # catalog version and snapshot, both are cache reads with a real cache backend
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('marketplace:home'))
+        self.assertContains(response, 'Snapshot Account')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('marketplace:view_all', args=['twitter']))
+        self.assertContains(response, 'Snapshot Account')
+
+    def test_snapshot_rebuilt_on_write(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account.title = ''
+            self.account.save()
+        self.assertEqual(load_home_snapshot()['grouped_accounts'][0]['accounts'][0]['title'], 'Twitter | 1.5K followers')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Log.objects.create(account=self.account, log_data='user:pass')
+        self.assertEqual(load_category_snapshot('twitter')['accounts'][0]['stock'], 1)
+
+    def test_changes_are_flushed_once_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for i in range(3):
+                Log.objects.create(account=self.account, log_data=f'user{i}:pass')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(callbacks[0].account_ids, {self.account.pk})
+
+    def test_rolled_back_changes_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Log.objects.create(account=self.account, log_data='user:pass')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            mark_catalog_changed(category_ids=[self.category.pk])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(callbacks[0].account_ids, set())
+
+    def test_moving_account_rebuilds_both_categories(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Category.objects.create(name='Instagram')
+            account = SocialMediaAccount.objects.get(pk=self.account.pk)
+            account.category = other
+            account.save()
+
+        self.assertEqual(load_category_snapshot('twitter')['accounts'], [])
+        self.assertEqual(len(load_category_snapshot('instagram')['accounts']), 1)
+
+    def test_rebuild_catalog_snapshot_command(self):
+        CatalogSnapshot.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_catalog_snapshot', stdout=out)
+        self.assertIn('1 category snapshots', out.getvalue())
+        self.assertTrue(CatalogSnapshot.objects.filter(key='category:twitter').exists())
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # flush the catalog changes of the fixtures, the tests count their own
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name='Twitter')
+            self.account = SocialMediaAccount.objects.create(
+                title='Versioned Account', category=self.category, description='Test', price=Decimal('100.00')
+            )
+        rebuild_catalog_snapshots()
+
+    def test_not_modified_without_touching_the_catalog(self):
+        for url in (reverse('marketplace:home'), reverse('marketplace:view_all', args=['twitter'])):
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('ETag'))
+            self.assertTrue(response.has_header('Last-Modified'))
+            self.assertIn('no-cache', response['Cache-Control'])
+
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_the_catalog(self):
+        url = reverse('marketplace:view_all', args=['twitter'])
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Log.objects.create(account=self.account, log_data='user:pass')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_does_not_depend_on_the_csrf_cookie(self):
+        url = reverse('marketplace:home')
+        etag = self.client.get(url)['ETag']
+        self.client.cookies['csrftoken'] = 'rotated'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ViewAllFacetTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Twitter')
+        self.cheap = SocialMediaAccount.objects.create(
+            title='Cheap', category=self.category, description='Test', price=Decimal('10.00'),
+            followers_count=100, verification_status='verified', account_age='2015',
+        )
+        self.pricey = SocialMediaAccount.objects.create(
+            title='Pricey', category=self.category, description='Test', price=Decimal('90.00'),
+            followers_count=5000, verification_status='not_verified', account_age='2012',
+        )
+        Log.objects.create(account=self.pricey, log_data='user:pass')
+
+    def test_filters_and_sorting(self):
+        url = reverse('marketplace:view_all', args=['twitter'])
+        response = self.client.get(url, {'min_price': '50'})
+        self.assertEqual([account['id'] for account in response.context['accounts']], [self.pricey.pk])
+
+        response = self.client.get(url, {'sort': '-followers', 'min_price': 'junk'})
+        self.assertEqual([account['id'] for account in response.context['accounts']], [self.pricey.pk, self.cheap.pk])
+
+        response = self.client.get(url, {'verification_status': 'verified', 'in_stock': '1'})
+        self.assertEqual(response.context['accounts'], [])
+
+    def test_facet_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = category_facets(self.category)
+        self.assertEqual(facets['in_stock'], 1)
+        self.assertEqual(facets['min_price'], Decimal('10.00'))
+        self.assertEqual(facets['max_price'], Decimal('90.00'))
+        self.assertEqual([facet['value'] for facet in facets['account_age']], ['2012', '2015'])
+        self.assertEqual(
+            {facet['value']: facet['count'] for facet in facets['verification_status']},
+            {'verified': 1, 'not_verified': 1},
+        )
@@ -0,0 +1,128 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from core.models import Transaction
+from marketplace.models import SocialMediaAccount, Category, Order, OrderItem, Log, StockReservation
+from decimal import Decimal
+import json
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BulkCheckoutTests(TestCase):
+    def setUp(self):
+        # flush the catalog changes of the fixtures, the tests count their own
+        with self.captureOnCommitCallbacks(execute=True):
+            categories = [Category.objects.create(name=f'Category {i}') for i in range(10)]
+            self.accounts = [
+                SocialMediaAccount.objects.create(
+                    title=f'Account {i}', category=categories[i % 10], description='Test', price=Decimal('10.00') + i
+                )
+                for i in range(20)
+            ]
+            Log.objects.bulk_create([Log(account=account, log_data=f'{account.pk}:{i}') for account in self.accounts for i in range(3)])
+            SocialMediaAccount.recount_stock([account.pk for account in self.accounts])
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.client.force_login(self.user)
+
+    def checkout(self, cart):
+        return self.client.post(reverse('marketplace:checkout'), {'cart_data': json.dumps(cart)})
+
+    def checkout_queries(self, cart):
+        # the on_commit work of the checkout counts too
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout(cart)
+        self.assertEqual(response.status_code, 302)
+        return [q['sql'] for q in queries]
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        single = self.checkout_queries([{'id': self.accounts[0].pk, 'quantity': 1}])
+        # 20 accounts in 10 categories
+        full = self.checkout_queries([{'id': account.pk, 'quantity': 2} for account in self.accounts])
+        self.assertEqual(len(full), len(single))
+
+        # locked accounts, order, items, available stock, new holds and, on
+        # commit, the stale flag of the listings; the rest is session and savepoints
+        full = [sql for sql in full if 'marketplace_' in sql]
+        self.assertLessEqual(len(full), 6)
+        self.assertEqual(sum(1 for sql in full if sql.startswith('INSERT INTO "marketplace_orderitem"')), 1)
+        self.assertFalse(any(sql.startswith('UPDATE "marketplace_order"') for sql in full))
+
+        order = Order.objects.latest('id')
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(order.total_amount, sum(account.price * 2 for account in self.accounts))
+
+    def test_lines_of_the_same_account_are_merged(self):
+        account = self.accounts[0]
+        self.checkout([{'id': account.pk, 'quantity': 1}, {'id': account.pk, 'quantity': '2'}])
+        item = OrderItem.objects.get()
+        self.assertEqual((item.account_id, item.quantity, item.order.total_amount), (account.pk, 3, Decimal('30.00')))
+
+    def test_failure_leaves_nothing_behind(self):
+        cart = [{'id': account.pk, 'quantity': 1} for account in self.accounts[:5]]
+        for bad in ({'id': self.accounts[5].pk, 'quantity': 4}, {'id': 0, 'quantity': 1}, {'id': self.accounts[5].pk, 'quantity': 0}):
+            response = self.checkout(cart + [bad])
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BuyNowTests(TestCase):
+    def setUp(self):
+        self.account = SocialMediaAccount.objects.create(title='Test Account', description='Test', price=Decimal('10.00'))
+        Log.objects.bulk_create([Log(account=self.account, log_data=f'user{i}:pass') for i in range(5)])
+        SocialMediaAccount.recount_stock([self.account.pk])
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.user.wallet.balance = Decimal('30.00')
+        self.user.wallet.save()
+        self.client.force_login(self.user)
+
+    def buy(self, quantity):
+        return self.client.post(
+            reverse('marketplace:buy_now'), json.dumps({'items': [{'id': self.account.pk, 'quantity': quantity}]}),
+            content_type='application/json'
+        )
+
+    def test_purchase_completes_in_one_request(self):
+        response = self.buy(3)
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.status, 'completed')
+        self.assertEqual(order.transaction.status, 'success')
+        self.assertEqual(order.transaction.amount, Decimal('30.00'))
+        self.assertEqual(Log.objects.filter(order_item__order=order, is_active=False).count(), 3)
+        self.assertFalse(StockReservation.objects.exists())
+        self.user.wallet.refresh_from_db()
+        self.assertEqual(self.user.wallet.balance, Decimal('0.00'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 2)
+
+    def test_failures_roll_everything_back(self):
+        response = self.buy(4)
+        self.assertEqual(response.status_code, 402)
+        self.assertIn('redirect_url', response.json())
+
+        self.user.wallet.balance = Decimal('100.00')
+        self.user.wallet.save()
+        self.assertEqual(self.buy(6).status_code, 409)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.user.wallet.refresh_from_db()
+        self.assertEqual(self.user.wallet.balance, Decimal('100.00'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 5)
+
+    def test_short_allocation_rolls_everything_back(self):
+        # the counter promises 5 logs but only 2 are left to hand out
+        Log.objects.filter(pk__in=Log.objects.order_by('pk').values('pk')[:3]).update(is_active=False)
+        self.assertEqual(self.buy(3).status_code, 409)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(Log.objects.filter(is_active=True).count(), 2)
+        self.user.wallet.refresh_from_db()
+        self.assertEqual(self.user.wallet.balance, Decimal('30.00'))
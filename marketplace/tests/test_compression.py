@@ -0,0 +1,61 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from marketplace.fields import CompressedTextField
+from marketplace.models import SocialMediaAccount, Log
+from decimal import Decimal
+from io import StringIO
+
+
+class CompressedLogDataTests(TestCase):
+    def setUp(self):
+        self.account = SocialMediaAccount.objects.create(title='Test', description='Test', price=Decimal('10.00'))
+        self.bundle = 'user:pass\n' + '; '.join(f'cookie{i}=abcdef0123456789' for i in range(50))
+
+    def stored(self, log):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT log_data FROM marketplace_log WHERE id = %s', [log.pk])
+            return bytes(cursor.fetchone()[0])
+
+    def test_round_trip(self):
+        log = Log.objects.create(account=self.account, log_data=self.bundle)
+        short = Log.objects.create(account=self.account, log_data='user:pass')
+
+        self.assertTrue(self.stored(log).startswith(CompressedTextField.FORMAT_ZLIB))
+        self.assertLess(len(self.stored(log)), len(self.bundle) / 3)
+        self.assertEqual(self.stored(short), CompressedTextField.FORMAT_PLAIN + b'user:pass')
+
+        self.assertEqual(Log.objects.get(pk=log.pk).log_data, self.bundle)
+        self.assertEqual(list(Log.objects.filter(pk=short.pk).values_list('log_data', flat=True)), ['user:pass'])
+        self.assertTrue(Log.objects.filter(log_data=self.bundle).exists())
+
+    def test_compress_legacy_rows(self):
+        log = Log.objects.create(account=self.account, log_data='placeholder')
+        # a row written before the column was compressed
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE marketplace_log SET log_data = %s WHERE id = %s', [self.bundle, log.pk])
+        self.assertEqual(Log.objects.get(pk=log.pk).log_data, self.bundle)
+
+        out = StringIO()
+        call_command('compress_logs', '--batch-size', '1', stdout=out)
+        self.assertIn('Logs processed: 1', out.getvalue())
+        self.assertTrue(self.stored(log).startswith(CompressedTextField.FORMAT_ZLIB))
+        self.assertEqual(Log.objects.get(pk=log.pk).log_data, self.bundle)
+
+        call_command('compress_logs', '--decompress', stdout=StringIO())
+        self.assertTrue(self.stored(log).startswith(CompressedTextField.FORMAT_PLAIN))
+
+    @override_settings(LOG_DATA_COMPRESSION=False)
+    def test_compression_can_be_disabled(self):
+        log = Log.objects.create(account=self.account, log_data=self.bundle)
+        self.assertEqual(self.stored(log), CompressedTextField.FORMAT_PLAIN + self.bundle.encode())
+
+    @override_settings(LOG_DATA_COMPRESSION=False)
+    def test_command_mode_does_not_depend_on_the_setting(self):
+        log = Log.objects.create(account=self.account, log_data=self.bundle)
+        call_command('compress_logs', '--dry-run', stdout=StringIO())
+        self.assertTrue(self.stored(log).startswith(CompressedTextField.FORMAT_PLAIN))
+
+        call_command('compress_logs', stdout=StringIO())
+        self.assertTrue(self.stored(log).startswith(CompressedTextField.FORMAT_ZLIB))
+        self.assertEqual(Log.objects.get(pk=log.pk).log_data, self.bundle)
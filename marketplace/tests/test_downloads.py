@@ -0,0 +1,157 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from marketplace.models import SocialMediaAccount, Order, OrderItem, Log
+from decimal import Decimal
+import csv
+import io
+import re
+import zipfile
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class LogDownloadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('50.00'), status='completed')
+        for title in ('Twitter', 'Instagram'):
+            account = SocialMediaAccount.objects.create(title=title, description='Test', price=Decimal('10.00'))
+            for i in range(3):
+                Log.objects.create(account=account, log_data=f'{title.lower()}{i}:pass,"x"')
+            item = OrderItem.objects.create(order=self.order, account=account, quantity=2, price=Decimal('10.00'))
+            item.get_allocated_logs()
+        self.client.force_login(self.user)
+
+    def download(self, file_format, **params):
+        response = self.client.get(reverse('marketplace:download_logs', args=[self.order.id, file_format]), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_txt_and_resume(self):
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{self.order.order_number}.txt"')
+        self.assertEqual(content.decode().splitlines(), [
+            'twitter0:pass,"x"', 'twitter1:pass,"x"', 'instagram0:pass,"x"', 'instagram1:pass,"x"',
+        ])
+
+        _, content = self.download('csv')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], ['id', 'order_item', 'account', 'log_data'])
+        self.assertEqual(rows[1][3], 'twitter0:pass,"x"')
+
+        _, content = self.download('csv', after=rows[2][0])
+        self.assertEqual([row[3] for row in csv.reader(io.StringIO(content.decode()))][1:], ['instagram0:pass,"x"', 'instagram1:pass,"x"'])
+
+    def test_zip(self):
+        _, content = self.download('zip')
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        names = archive.namelist()
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].endswith('-twitter.txt'))
+        self.assertEqual(archive.read(names[1]).decode(), 'instagram0:pass,"x"\ninstagram1:pass,"x"\n')
+
+    def test_only_the_buyer_can_download(self):
+        self.client.force_login(User.objects.create_user(username='other', password='testpass123'))
+        response = self.client.get(reverse('marketplace:download_logs', args=[self.order.id, 'txt']))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class OrderDetailsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('50.00'), status='completed')
+        self.items = []
+        for title in ('Twitter', 'Instagram', 'Facebook'):
+            account = SocialMediaAccount.objects.create(title=title, description='Test', price=Decimal('10.00'))
+            Log.objects.bulk_create([Log(account=account, log_data=f'{title}{i}:pass') for i in range(120)])
+            SocialMediaAccount.recount_stock([account.pk])
+            item = OrderItem.objects.create(order=self.order, account=account, quantity=120, price=Decimal('10.00'))
+            item.get_allocated_logs()
+            self.items.append(item)
+        self.client.force_login(self.user)
+
+    def test_page_does_not_load_logs(self):
+        self.client.get(reverse('marketplace:order_details', args=[self.order.id]))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('marketplace:order_details', args=[self.order.id]))
+        self.assertContains(response, 'Instagram')
+        self.assertNotContains(response, 'Twitter0:pass')
+        marketplace_queries = [q['sql'] for q in queries if 'marketplace_' in q['sql']]
+        # the ownership check, then (nothing is cached here) the order and its items with their accounts
+        self.assertEqual(len(marketplace_queries), 3)
+
+    def test_log_pages(self):
+        url = reverse('marketplace:order_item_logs', args=[self.order.id, self.items[0].id])
+        seen, after = [], 0
+        while after is not None:
+            data = self.client.get(url, {'after': after}).json()
+            seen += re.findall(r'Twitter\d+:pass', data['html'])
+            after = data['next']
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(len(set(seen)), 120)
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'order-pages'}},
+)
+class OrderPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('20.00'), status='completed')
+        account = SocialMediaAccount.objects.create(title='Twitter', description='Test', price=Decimal('10.00'))
+        Log.objects.bulk_create([Log(account=account, log_data=f'user{i}:pass') for i in range(2)])
+        SocialMediaAccount.recount_stock([account.pk])
+        self.item = OrderItem.objects.create(order=self.order, account=account, quantity=2, price=Decimal('10.00'))
+        self.item.get_allocated_logs()
+        self.client.force_login(self.user)
+        self.page_url = reverse('marketplace:order_details', args=[self.order.id])
+        self.logs_url = reverse('marketplace:order_item_logs', args=[self.order.id, self.item.id])
+
+    def marketplace_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in queries if 'marketplace_' in q['sql']]
+
+    def test_completed_page_is_served_from_the_cache(self):
+        self.client.get(self.page_url)
+        self.client.get(self.logs_url)
+
+        response, queries = self.marketplace_queries(self.page_url)
+        self.assertContains(response, 'Twitter')
+        self.assertEqual(len(queries), 1)
+        response, queries = self.marketplace_queries(self.logs_url)
+        self.assertIn('user0:pass', response.json()['html'])
+        self.assertEqual(len(queries), 1)
+
+        # the cache doesn't skip the ownership check
+        self.client.force_login(User.objects.create_user(username='other', password='testpass123'))
+        self.assertEqual(self.client.get(self.page_url).status_code, 404)
+        self.assertEqual(self.client.get(self.logs_url).status_code, 404)
+
+    def test_admin_edits_and_refunds_invalidate(self):
+        self.client.get(self.page_url)
+        self.client.get(self.logs_url)
+
+        self.item.price = Decimal('7.50')
+        self.item.save()
+        self.assertContains(self.client.get(self.page_url), '7.50 each')
+
+        log = Log.objects.get(order_item=self.item, log_data='user0:pass')
+        log.log_data = 'fixed:pass'
+        log.save()
+        self.assertIn('fixed:pass', self.client.get(self.logs_url).json()['html'])
+
+        self.order.status = 'refunded'
+        self.order.save()
+        self.assertContains(self.client.get(self.page_url), 'Refunded')
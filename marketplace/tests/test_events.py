@@ -0,0 +1,78 @@
+from django.test import TestCase, AsyncRequestFactory
+from marketplace import views
+from marketplace.events import StockEventBroker, account_states
+from marketplace.models import SocialMediaAccount, Category
+from decimal import Decimal
+from unittest import mock
+import asyncio
+import json
+
+
+class StockEventBrokerTests(TestCase):
+    async def test_fan_out_only_sends_deltas(self):
+        broker = StockEventBroker(watch_interval=60)
+        by_category = broker.subscribe(category='twitter')
+        by_id = broker.subscribe(account_ids={2})
+
+        change = {'id': 1, 'category': 'twitter', 'stock': 3, 'price': '10.00'}
+        broker.publish([change, {'id': 2, 'category': 'instagram', 'stock': 1, 'price': '5.00'}])
+        broker.publish([change])  # unchanged, not sent again
+        await asyncio.sleep(0)
+
+        self.assertEqual((await by_category.get())['accounts'], [change])
+        self.assertEqual((await by_id.get())['accounts'][0]['id'], 2)
+        self.assertTrue(by_category.queue.empty())
+        broker.unsubscribe(by_category)
+        broker.unsubscribe(by_id)
+
+    async def test_watched_accounts(self):
+        broker = StockEventBroker(watch_interval=60)
+        subscriptions = [broker.subscribe(category='twitter'), broker.subscribe(account_ids={2, 3})]
+        self.assertEqual(broker.watched(), ({2, 3}, {'twitter'}))
+        for subscription in subscriptions:
+            broker.unsubscribe(subscription)
+
+    def test_watcher_only_reloads_watched_accounts(self):
+        twitter = Category.objects.create(name='Twitter')
+        accounts = [
+            SocialMediaAccount.objects.create(
+                title=f'Account {i}', category=twitter if i == 0 else None, description='Test', price=Decimal('10.00')
+            )
+            for i in range(3)
+        ]
+        states = account_states({accounts[1].pk}, {'twitter'})
+        self.assertEqual(sorted(state['id'] for state in states), [accounts[0].pk, accounts[1].pk])
+
+    async def test_slow_subscriber_is_told_to_resync(self):
+        broker = StockEventBroker(queue_size=2, watch_interval=60)
+        subscription = broker.subscribe(category='twitter')
+
+        for stock in range(5):
+            broker.publish([{'id': 1, 'category': 'twitter', 'stock': stock, 'price': '10.00'}])
+        await asyncio.sleep(0)
+
+        self.assertEqual((await subscription.get())['type'], 'resync')
+        broker.unsubscribe(subscription)
+
+    async def test_event_stream(self):
+        broker = StockEventBroker(watch_interval=60)
+        request = AsyncRequestFactory().get('/stock/events/', {'category': 'twitter'})
+        with mock.patch.object(views, 'broker', broker):
+            response = await views.stock_events(request)
+            chunks = asyncio.Queue()
+
+            async def consume():
+                async for chunk in response.streaming_content:
+                    await chunks.put(chunk)
+            consumer = asyncio.ensure_future(consume())
+
+            self.assertTrue((await chunks.get()).startswith(b'retry:'))
+            broker.publish([{'id': 1, 'category': 'twitter', 'stock': 0, 'price': '10.00'}])
+            chunk = (await chunks.get()).decode()
+            self.assertTrue(chunk.startswith('event: stock\n'))
+            self.assertEqual(json.loads(chunk.split('data: ')[1])['accounts'][0]['stock'], 0)
+
+            # the ASGI handler cancels the stream when the client disconnects
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+        self.assertFalse(broker.has_subscribers)
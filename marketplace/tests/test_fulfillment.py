@@ -0,0 +1,137 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from marketplace.models import SocialMediaAccount, Order, Log, FulfillmentJob, StockReservation
+from marketplace.fulfillment import run_fulfillment_batch
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import json
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class FulfillmentTests(TestCase):
+    def setUp(self):
+        self.account = SocialMediaAccount.objects.create(title='Test Account', description='Test', price=Decimal('1.00'))
+        Log.objects.bulk_create([Log(account=self.account, log_data=f'user{i}:pass') for i in range(300)])
+        SocialMediaAccount.recount_stock([self.account.pk])
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.user.wallet.balance = Decimal('1000.00')
+        self.user.wallet.save()
+        self.client.force_login(self.user)
+
+    def paid_order(self, quantity):
+        self.client.post(reverse('marketplace:checkout'), {
+            'cart_data': json.dumps([{'id': self.account.pk, 'quantity': quantity}])
+        })
+        order = Order.objects.latest('id')
+        self.client.get(reverse('marketplace:password_confirm', args=[order.order_number]))
+        response = self.client.post(
+            reverse('marketplace:confirm_payment'), json.dumps({'order_number': order.order_number}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return order
+
+    def status(self, order):
+        return self.client.get(reverse('marketplace:order_status', args=[order.id])).json()
+
+    def test_payment_queues_and_the_worker_completes(self):
+        order = self.paid_order(250)
+        order.refresh_from_db()
+        # the payment is done, the logs are not allocated yet
+        self.assertEqual(order.status, 'processing')
+        self.assertEqual(order.transaction.status, 'success')
+        self.assertFalse(Log.objects.filter(order_item__order=order).exists())
+        # the units stay held however long the worker takes
+        self.assertGreater(StockReservation.objects.get(order=order).expires_at, order.updated_at + timedelta(days=1))
+        self.assertEqual(self.status(order), {'status': 'success', 'order_status': 'processing', 'redirect_url': None})
+        self.assertContains(self.client.get(reverse('marketplace:after_checkout', args=[order.id])), 'being prepared')
+
+        call_command('run_fulfillment', '--once', stdout=StringIO())
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'completed')
+        self.assertEqual(Log.objects.filter(order_item__order=order, is_active=False).count(), 250)
+        self.assertFalse(FulfillmentJob.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.status(order)['redirect_url'], reverse('marketplace:order_details', args=[order.id]))
+
+    def test_failed_job_stays_queued(self):
+        order = self.paid_order(5)
+        with mock.patch('marketplace.fulfillment.fulfil_order', side_effect=RuntimeError('database went away')):
+            call_command('run_fulfillment', '--once', stdout=StringIO())
+        job = FulfillmentJob.objects.get(order=order)
+        self.assertEqual((job.attempts, job.last_error), (1, 'database went away'))
+        self.assertGreater(job.next_attempt_at, timezone.now())
+
+        # not retried before its delay is over
+        call_command('run_fulfillment', '--once', stdout=StringIO())
+        self.assertTrue(FulfillmentJob.objects.filter(order=order).exists())
+
+        FulfillmentJob.objects.update(next_attempt_at=timezone.now())
+        call_command('run_fulfillment', '--once', stdout=StringIO())
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'completed')
+
+    @override_settings(FULFILLMENT_MAX_ATTEMPTS=2)
+    def test_order_is_refunded_after_the_last_attempt(self):
+        order = self.paid_order(5)
+        with mock.patch('marketplace.fulfillment.fulfil_order', side_effect=RuntimeError('database went away')):
+            for _ in range(2):
+                FulfillmentJob.objects.update(next_attempt_at=timezone.now())
+                run_fulfillment_batch()
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'refunded')
+        self.assertIn('database went away', order.notes)
+        self.assertFalse(FulfillmentJob.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.user.wallet.refresh_from_db()
+        self.assertEqual(self.user.wallet.balance, Decimal('1000.00'))
+        # the poller stops on the refund
+        self.assertEqual(self.status(order)['order_status'], 'refunded')
+        self.assertContains(self.client.get(reverse('marketplace:after_checkout', args=[order.id])), 'refunded to your wallet')
+
+    def test_short_allocation_does_not_complete(self):
+        order = self.paid_order(5)
+        # the counter promises logs that were sold elsewhere
+        Log.objects.filter(pk__in=Log.objects.order_by('pk').values('pk')[:297]).update(is_active=False)
+        run_fulfillment_batch()
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'processing')
+        self.assertFalse(Log.objects.filter(order_item__order=order).exists())
+        self.assertEqual(FulfillmentJob.objects.get(order=order).attempts, 1)
+
+    def test_paid_order_cannot_be_cancelled(self):
+        order = self.paid_order(5)
+        self.client.get(reverse('marketplace:cancel_order', args=[order.order_number]))
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'processing')
+        self.assertEqual(order.transaction.status, 'success')
+        self.assertTrue(StockReservation.objects.filter(order=order).exists())
+
+        self.assertEqual(run_fulfillment_batch(), (1, 0, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'completed')
+
+    def test_job_of_an_order_no_longer_processing_is_dropped(self):
+        order = self.paid_order(5)
+        # refunded by an admin before the worker got to it
+        Order.objects.filter(pk=order.pk).update(status='refunded')
+
+        self.assertEqual(run_fulfillment_batch(), (0, 0, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'refunded')
+        self.assertFalse(Log.objects.filter(order_item__order=order).exists())
+        self.assertFalse(FulfillmentJob.objects.exists())
+
+    def test_status_of_someone_elses_order(self):
+        order = self.paid_order(1)
+        self.client.force_login(User.objects.create_user(username='other'))
+        self.assertEqual(self.client.get(reverse('marketplace:order_status', args=[order.id])).status_code, 404)
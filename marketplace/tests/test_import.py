@@ -0,0 +1,154 @@
+from django.contrib.auth.models import Permission, User
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from marketplace.models import SocialMediaAccount, Category, Log, Order, OrderItem, SoldLog
+from marketplace.importer import import_logs, log_content_hash
+from decimal import Decimal
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+
+class LogImportTests(TestCase):
+    def setUp(self):
+        # flush the catalog changes of the fixtures, the tests count their own
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(name='Twitter')
+            self.account = SocialMediaAccount.objects.create(
+                title='Test Account', category=category, description='Test', price=Decimal('10.00')
+            )
+            Log.objects.create(account=self.account, log_data='existing:pass')
+
+    def write(self, name, content):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        self.addCleanup(shutil.rmtree, directory)
+        return path
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            call_command('import_logs', path, '--account', str(self.account.pk), *args, stdout=out)
+        return out.getvalue(), callbacks
+
+    def test_txt_import_skips_duplicates(self):
+        path = self.write('logs.txt', 'user1:pass\n\nuser2:pass\n  user1:pass  \nexisting:pass\n')
+        out, callbacks = self.run_import(path, '--batch-size', '2', '--workers', '0')
+
+        self.assertIn('Logs created: 2', out)
+        self.assertIn('Duplicates skipped: 2', out)
+        self.assertEqual(
+            sorted(Log.objects.filter(account=self.account).values_list('log_data', flat=True)),
+            ['existing:pass', 'user1:pass', 'user2:pass'],
+        )
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 3)
+        # the catalog is refreshed once for the whole file
+        self.assertEqual(len(callbacks), 1)
+
+    def test_jsonl_and_csv(self):
+        path = self.write('logs.jsonl', '{"log_data": "a:1"}\nnot json\n"b:2"\n{"other": 1}\n')
+        out, _ = self.run_import(path, '--workers', '2', '--batch-size', '1')
+        self.assertIn('Logs created: 2', out)
+        self.assertIn('Line 2: invalid JSON', out)
+        self.assertIn('Line 4: missing log_data', out)
+
+        path = self.write('logs.csv', 'email,log_data\nx@y.z,"c:3\nline two"\nq@y.z,\n')
+        out, _ = self.run_import(path, '--workers', '0')
+        self.assertIn('Logs created: 1', out)
+        self.assertIn('empty log_data', out)
+        self.assertTrue(Log.objects.filter(log_data='c:3\nline two').exists())
+
+    def test_dry_run(self):
+        path = self.write('logs.txt', 'user1:pass\n')
+        out, _ = self.run_import(path, '--dry-run', '--workers', '0')
+        self.assertIn('Valid logs: 1', out)
+        self.assertEqual(Log.objects.count(), 1)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class LogImportAdminTests(TestCase):
+    def test_upload_action(self):
+        account = SocialMediaAccount.objects.create(title='Test', description='Test', price=Decimal('10.00'))
+        self.client.force_login(User.objects.create_superuser(username='admin', password='testpass123'))
+
+        response = self.client.post(reverse('admin:marketplace_socialmediaaccount_changelist'), {
+            'action': 'import_logs_from_file',
+            '_selected_action': [account.pk],
+            'apply': 'Import',
+            'file': SimpleUploadedFile('logs.txt', b'user1:pass\nuser2:pass\nuser1:pass\n'),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Log.objects.filter(account=account).count(), 2)
+
+    def test_upload_action_needs_add_log_permission(self):
+        account = SocialMediaAccount.objects.create(title='Test', description='Test', price=Decimal('10.00'))
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        staff.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='marketplace', codename__in=['view_socialmediaaccount', 'change_socialmediaaccount']
+        ))
+        self.client.force_login(staff)
+
+        response = self.client.get(reverse('admin:marketplace_socialmediaaccount_changelist'))
+        actions = [name for name, _ in response.context['action_form'].fields['action'].choices]
+        self.assertNotIn('import_logs_from_file', actions)
+        self.assertIn('reorder_accounts', actions)
+        response = self.client.post(reverse('admin:marketplace_socialmediaaccount_changelist'), {
+            'action': 'import_logs_from_file',
+            '_selected_action': [account.pk],
+            'apply': 'Import',
+            'file': SimpleUploadedFile('logs.txt', b'user1:pass\n'),
+        })
+        self.assertFalse(Log.objects.exists())
+
+
+class DuplicateLogTests(TestCase):
+    def setUp(self):
+        self.account = SocialMediaAccount.objects.create(title='Test', description='Test', price=Decimal('10.00'))
+        self.log = Log.objects.create(account=self.account, log_data='user:pass')
+
+    def test_save_and_clean_reject_duplicates(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Log.objects.create(account=self.account, log_data='  user:pass\n')
+        with self.assertRaises(ValidationError):
+            Log(account=self.account, log_data='user:pass').full_clean()
+
+        # the same credential may be sold under another account
+        other = SocialMediaAccount.objects.create(title='Other', description='Test', price=Decimal('10.00'))
+        Log.objects.create(account=other, log_data='user:pass')
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.stock, 1)
+
+    def test_archived_logs_count_as_duplicates(self):
+        order = Order.objects.create(total_amount=Decimal('10.00'))
+        item = OrderItem.objects.create(order=order, account=self.account, quantity=1, price=Decimal('10.00'))
+        SoldLog.objects.create(
+            id=self.log.pk + 1000, order_item=item, account=self.account, log_data='sold:pass',
+            content_hash=log_content_hash('sold:pass'), timestamp=self.log.timestamp,
+        )
+        with self.assertRaises(ValidationError):
+            Log(account=self.account, log_data='sold:pass').full_clean()
+        self.assertEqual(Log.duplicate_hashes(self.account.pk, {log_content_hash('sold:pass')}), {log_content_hash('sold:pass')})
+
+        result = import_logs(self.account, StringIO('sold:pass\nnew:pass\n'))
+        self.assertEqual((result['created'], result['duplicates']), (1, 1))
+
+    def test_backfill_reports_duplicates(self):
+        copy = Log.objects.create(account=self.account, log_data='copy')
+        Log.objects.filter(pk=copy.pk).update(log_data='user:pass ', content_hash=None)
+        Log.objects.filter(pk=self.log.pk).update(content_hash=None)
+
+        out = StringIO()
+        call_command('backfill_log_hashes', '--batch-size', '1', stdout=out)
+        self.assertIn(f'Log {copy.pk} duplicates log {self.log.pk}', out.getvalue())
+        self.assertIn('Duplicate logs: 1', out.getvalue())
+        self.log.refresh_from_db()
+        self.assertIsNotNone(self.log.content_hash)
+        self.assertIsNone(Log.objects.get(pk=copy.pk).content_hash)
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from marketplace.models import SocialMediaAccount, Order, OrderItem
+from marketplace.views import ORDERS_PAGE_SIZE
+from decimal import Decimal
+from datetime import timedelta
+import re
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class OrdersListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        account = SocialMediaAccount.objects.create(title='Test Account', description='Test', price=Decimal('10.00'))
+        now = timezone.now()
+        for i in range(ORDERS_PAGE_SIZE * 2 + 3):
+            order = Order.objects.create(user=self.user, total_amount=Decimal('10.00'), status='completed' if i % 2 else 'pending')
+            OrderItem.objects.bulk_create([OrderItem(order=order, account=account, price=Decimal('10.00'))] * (i % 3 + 1))
+            # pairs of orders share a timestamp, the id breaks the tie
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(minutes=i // 2))
+        Order.objects.create(user=User.objects.create_user(username='other'), total_amount=Decimal('99.00'))
+        self.client.force_login(self.user)
+
+    def order_ids(self, html):
+        return list(dict.fromkeys(int(pk) for pk in re.findall(r'/order_details/(\d+)/', html)))
+
+    def test_list_is_keyset_paginated(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('marketplace:orders'))
+        # the page and the totals, no query per order
+        self.assertEqual(len([q for q in queries if 'marketplace_order' in q['sql']]), 2)
+        self.assertEqual(response.context['total_orders'], ORDERS_PAGE_SIZE * 2 + 3)
+        self.assertEqual(response.context['total_spent'], Decimal('10.00') * (ORDERS_PAGE_SIZE + 1))
+
+        ids = self.order_ids(response.content.decode())
+        self.assertEqual(len(ids), ORDERS_PAGE_SIZE)
+        counts = {order.pk: order.item_count for order in response.context['orders']}
+        self.assertEqual(counts, {order.pk: order.items.count() for order in Order.objects.filter(pk__in=ids)})
+
+        cursor = response.context['next_cursor']
+        while cursor:
+            data = self.client.get(reverse('marketplace:more_orders'), {'after': cursor}).json()
+            ids += self.order_ids(data['html'])
+            cursor = data['next']
+
+        expected = list(Order.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_bad_cursor_is_an_empty_page(self):
+        data = self.client.get(reverse('marketplace:more_orders'), {'after': 'nope'}).json()
+        self.assertEqual((data['html'].strip(), data['next']), ('', None))
@@ -0,0 +1,132 @@
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from marketplace.models import SocialMediaAccount, Category, POSITION_GAP
+from decimal import Decimal
+import json
+
+
+class SparsePositionTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Twitter')
+        self.accounts = [
+            SocialMediaAccount.objects.create(
+                title=f'Account {i}', category=self.category, description='Test', price=Decimal('10.00')
+            )
+            for i in range(3)
+        ]
+
+    def ordered_titles(self):
+        return list(SocialMediaAccount.objects.values_list('title', flat=True))
+
+    def test_new_rows_are_appended_with_gaps(self):
+        self.assertEqual([account.position for account in self.accounts], [POSITION_GAP, 2 * POSITION_GAP, 3 * POSITION_GAP])
+        self.assertEqual(Category.objects.create(name='Instagram').position, 2 * POSITION_GAP)
+
+    def test_move_writes_only_the_moved_row(self):
+        last = SocialMediaAccount.objects.get(pk=self.accounts[2].pk)
+        last.position = self.accounts[0].position
+
+        with CaptureQueriesContext(connection) as queries:
+            last.save()
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "marketplace_socialmediaaccount"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.ordered_titles(), ['Account 2', 'Account 0', 'Account 1'])
+
+        # 0 moves the row to the end
+        last.position = 0
+        last.save()
+        self.assertEqual(self.ordered_titles(), ['Account 0', 'Account 1', 'Account 2'])
+
+    def test_plain_save_does_not_touch_positions(self):
+        account = SocialMediaAccount.objects.get(pk=self.accounts[1].pk)
+        account.price = Decimal('20.00')
+
+        with CaptureQueriesContext(connection) as queries:
+            account.save()
+        sql = ' '.join(q['sql'] for q in queries)
+        self.assertNotIn('MAX(', sql)
+        self.assertNotIn('COUNT(', sql)
+        self.assertEqual(sql.count('UPDATE "marketplace_socialmediaaccount"'), 1)
+
+    def test_rebalances_when_the_gap_is_used_up(self):
+        SocialMediaAccount.objects.filter(pk=self.accounts[1].pk).update(position=self.accounts[0].position + 1)
+
+        account = SocialMediaAccount.objects.get(pk=self.accounts[2].pk)
+        account.position = self.accounts[0].position + 1
+        account.save()
+
+        self.assertEqual(self.ordered_titles(), ['Account 0', 'Account 2', 'Account 1'])
+        positions = list(SocialMediaAccount.objects.values_list('position', flat=True))
+        self.assertEqual(len(set(positions)), 3)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BulkReorderTests(TestCase):
+    def setUp(self):
+        # flush the catalog changes of the fixtures, the tests count their own
+        with self.captureOnCommitCallbacks(execute=True):
+            self.twitter = Category.objects.create(name='Twitter')
+            self.instagram = Category.objects.create(name='Instagram')
+            self.accounts = [
+                SocialMediaAccount.objects.create(
+                    title=f'Account {i}', category=self.twitter if i % 2 == 0 else self.instagram,
+                    description='Test', price=Decimal('10.00')
+                )
+                for i in range(5)
+            ]
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.staff.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='marketplace', codename__in=['change_category', 'change_socialmediaaccount']
+        ))
+        self.client.force_login(self.staff)
+
+    def post(self, data):
+        return self.client.post(reverse('marketplace:reorder'), json.dumps(data), content_type='application/json')
+
+    def test_reorder_in_one_update(self):
+        twitter_ids = [self.accounts[4].pk, self.accounts[0].pk, self.accounts[2].pk]
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks() as callbacks:
+            response = self.post({
+                'categories': [self.instagram.pk, self.twitter.pk],
+                'accounts': {str(self.twitter.pk): twitter_ids},
+            })
+        self.assertEqual(response.json(), {'status': 'success', 'updated': 5})
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "marketplace_')]
+        self.assertEqual(len(updates), 2)
+        # the catalog hooks run once for the whole ordering
+        self.assertEqual(len(callbacks), 1)
+
+        self.assertEqual(list(Category.objects.values_list('name', flat=True)), ['Instagram', 'Twitter'])
+        self.assertEqual(list(SocialMediaAccount.objects.filter(category=self.twitter).values_list('pk', flat=True)), twitter_ids)
+        # accounts of other categories keep their positions
+        self.assertEqual(SocialMediaAccount.objects.get(pk=self.accounts[1].pk).position, self.accounts[1].position)
+
+    def test_incomplete_ordering_is_rejected(self):
+        response = self.post({'accounts': {str(self.twitter.pk): [self.accounts[0].pk, self.accounts[1].pk]}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post({'categories': [self.twitter.pk]}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user(username='buyer', password='testpass123'))
+        self.assertEqual(self.post({'categories': [self.instagram.pk, self.twitter.pk]}).status_code, 403)
+        self.assertEqual(Category.objects.first(), self.twitter)
+
+    def test_needs_change_permission(self):
+        # staff without the permission to edit the rows can't reorder them either
+        self.client.force_login(User.objects.create_user(username='viewer', password='testpass123', is_staff=True))
+        self.assertEqual(self.post({'categories': [self.instagram.pk, self.twitter.pk]}).status_code, 403)
+        self.assertEqual(Category.objects.first(), self.twitter)
+
+    def test_admin_action_lists_the_whole_category(self):
+        self.staff.is_superuser = True
+        self.staff.save()
+        response = self.client.post(reverse('admin:marketplace_socialmediaaccount_changelist'), {
+            'action': 'reorder_accounts',
+            '_selected_action': [self.accounts[0].pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([account.pk for account in response.context['groups'][0][1]], [self.accounts[i].pk for i in (0, 2, 4)])
+        self.assertContains(response, reverse('marketplace:reorder'))
@@ -0,0 +1,190 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.models import Transaction
+from marketplace.models import SocialMediaAccount, Category, CatalogSnapshot, Order, Log, StockReservation
+from marketplace.catalog import load_category_snapshot
+from marketplace.events import account_states
+from marketplace.fulfillment import run_fulfillment_batch
+from marketplace.reservations import InsufficientStock, reserve_stock, with_available_stock
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+from threading import Barrier, Thread
+import json
+import random
+import time
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class StockReservationTests(TestCase):
+    def setUp(self):
+        # flush the catalog changes of the fixtures, the tests count their own
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account = SocialMediaAccount.objects.create(
+                title='Test Account', category=Category.objects.create(name='Twitter'), description='Test', price=Decimal('10.00')
+            )
+            Log.objects.bulk_create([Log(account=self.account, log_data=f'user{i}:pass') for i in range(3)])
+            SocialMediaAccount.recount_stock([self.account.pk])
+        self.buyers = []
+        for name in ('first', 'second'):
+            user = User.objects.create_user(username=name, password='testpass123')
+            user.wallet.balance = Decimal('100.00')
+            user.wallet.save()
+            self.buyers.append(user)
+
+    def checkout(self, user, quantity):
+        self.client.force_login(user)
+        return self.client.post(reverse('marketplace:checkout'), {
+            'cart_data': json.dumps([{'id': self.account.pk, 'quantity': quantity}])
+        })
+
+    def pay(self, order):
+        self.client.force_login(order.user)
+        self.client.get(reverse('marketplace:password_confirm', args=[order.order_number]))
+        response = self.client.post(
+            reverse('marketplace:confirm_payment'), json.dumps({'order_number': order.order_number}),
+            content_type='application/json'
+        )
+        run_fulfillment_batch()
+        return response
+
+    def available(self):
+        return with_available_stock(SocialMediaAccount.objects.filter(pk=self.account.pk)).get().available
+
+    def test_checkout_holds_the_stock(self):
+        self.assertEqual(self.checkout(self.buyers[0], 2).status_code, 302)
+        order = Order.objects.get(user=self.buyers[0])
+        self.assertEqual(list(order.reservations.values_list('quantity', flat=True)), [2])
+        self.assertEqual(self.available(), 1)
+
+        # the second buyer can't check out the units the first one holds
+        response = self.checkout(self.buyers[1], 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.filter(user=self.buyers[1]).exists())
+
+        response = self.pay(order)
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'completed')
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.available(), 1)
+
+    def test_available_stock_is_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.available()
+        self.assertEqual(len(queries), 1)
+
+    def test_expired_hold_is_released_lazily(self):
+        self.checkout(self.buyers[0], 3)
+        first = Order.objects.get(user=self.buyers[0])
+        first.reservations.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.available(), 3)
+
+        self.assertEqual(self.checkout(self.buyers[1], 2).status_code, 302)
+        # the expired hold counts for nothing next to the second one
+        self.assertEqual(self.available(), 1)
+
+        # the first order can't take its units back, it fails before the wallet is touched
+        response = self.pay(first)
+        self.assertEqual(response.status_code, 409)
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'failed')
+        self.buyers[0].wallet.refresh_from_db()
+        self.assertEqual(self.buyers[0].wallet.balance, Decimal('100.00'))
+        self.assertEqual(Transaction.objects.get(payment_reference=first.order_number).status, 'failed')
+
+        second = Order.objects.get(user=self.buyers[1])
+        self.assertEqual(self.pay(second).status_code, 200)
+        self.assertEqual(Log.objects.filter(order_item__order=second).count(), 2)
+
+    def test_expired_hold_is_taken_again_when_stock_allows(self):
+        self.checkout(self.buyers[0], 2)
+        order = Order.objects.get(user=self.buyers[0])
+        order.reservations.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(self.pay(order).status_code, 200)
+        self.assertEqual(Log.objects.filter(order_item__order=order).count(), 2)
+
+    def test_listings_publish_available_stock(self):
+        # creating the hold publishes the stock of the account
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.checkout(self.buyers[0], 2)
+        self.assertEqual([callback.args for callback in callbacks], [({self.account.pk},)])
+
+        response = self.client.get(reverse('marketplace:stock'), {'ids': str(self.account.pk)})
+        self.assertEqual(response.json()['accounts'][str(self.account.pk)]['stock'], 1)
+        self.assertEqual(account_states([self.account.pk])[0]['stock'], 1)
+
+        # the snapshots are only flagged, the cron rebuilds them
+        self.assertEqual(
+            set(CatalogSnapshot.objects.filter(stale=True).values_list('key', flat=True)), {'home', 'category:twitter'}
+        )
+        self.assertEqual(load_category_snapshot('twitter')['accounts'][0]['stock'], 3)
+        call_command('release_expired_holds', stdout=StringIO())
+        self.assertFalse(CatalogSnapshot.objects.filter(stale=True).exists())
+        self.assertEqual(load_category_snapshot('twitter')['accounts'][0]['stock'], 1)
+
+        # the expired hold is given back without waiting for another checkout
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('release_expired_holds', stdout=StringIO())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(load_category_snapshot('twitter')['accounts'][0]['stock'], 3)
+
+    def test_cancel_releases_the_hold(self):
+        self.checkout(self.buyers[0], 3)
+        order = Order.objects.get(user=self.buyers[0])
+        self.client.get(reverse('marketplace:password_confirm', args=[order.order_number]))
+        self.client.get(reverse('marketplace:cancel_order', args=[order.order_number]))
+        self.assertEqual(self.available(), 3)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.transaction.status), ('cancelled', 'cancelled'))
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    def test_last_unit_is_reserved_once(self):
+        account = SocialMediaAccount.objects.create(title='Test Account', description='Test', price=Decimal('10.00'))
+        Log.objects.create(account=account, log_data='user:pass')
+        SocialMediaAccount.recount_stock([account.pk])
+        orders = [Order.objects.create(total_amount=Decimal('10.00')) for _ in range(2)]
+
+        barrier = Barrier(len(orders))
+        results, errors = [], []
+
+        def reserve(order):
+            try:
+                barrier.wait()
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    try:
+                        reserve_stock(order, {account.pk: 1})
+                        results.append(True)
+                        return
+                    except InsufficientStock:
+                        results.append(False)
+                        return
+                    except OperationalError as e:
+                        # SQLite test databases refuse a second writer instead of waiting
+                        if 'locked' not in str(e):
+                            raise
+                        time.sleep(random.uniform(0.005, 0.02))
+                raise AssertionError('database stayed locked')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [Thread(target=reserve, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [False, True])
+        self.assertEqual(StockReservation.objects.filter(account=account).count(), 1)
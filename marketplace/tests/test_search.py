@@ -0,0 +1,52 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from marketplace.models import SocialMediaAccount, Category
+from marketplace.search import search_account_ids
+from decimal import Decimal
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        self.twitter = Category.objects.create(name='Twitter')
+        self.instagram = Category.objects.create(name='Instagram')
+        self.aged = SocialMediaAccount.objects.create(
+            title='Aged Twitter account', category=self.twitter, description='Created in 2012', price=Decimal('10.00')
+        )
+        self.fresh = SocialMediaAccount.objects.create(
+            title='Fresh account', category=self.instagram, description='Verified with email, aged feel', price=Decimal('5.00')
+        )
+        self.hidden = SocialMediaAccount.objects.create(
+            title='Aged hidden account', category=self.twitter, description='Hidden', price=Decimal('5.00'), is_active=False
+        )
+
+    def test_ranked_prefix_search(self):
+        ids, total = search_account_ids('age')
+        # title matches rank above description matches, inactive accounts are excluded
+        self.assertEqual(ids, [self.aged.pk, self.fresh.pk])
+        self.assertEqual(total, 2)
+
+        self.assertEqual(search_account_ids('instagram verified')[0], [self.fresh.pk])
+        self.assertEqual(search_account_ids('  "*')[0], [])
+
+    def test_index_follows_saves_and_renames(self):
+        self.fresh.title = 'Brand new'
+        self.fresh.save()
+        self.assertEqual(search_account_ids('brand')[0], [self.fresh.pk])
+
+        self.instagram.name = 'Threads'
+        self.instagram.save()
+        self.assertEqual(search_account_ids('threads')[0], [self.fresh.pk])
+
+        self.fresh.delete()
+        self.assertEqual(search_account_ids('brand')[0], [])
+
+    def test_search_view_paginates(self):
+        response = self.client.get(reverse('marketplace:search'), {'q': 'account'})
+        data = response.json()
+        self.assertEqual(data['total'], 2)
+        self.assertFalse(data['has_next'])
+        self.assertEqual(data['accounts'][0]['category'], 'twitter')
+
+        response = self.client.get(reverse('marketplace:search'), {'q': 'account', 'page': 2})
+        self.assertEqual(response.json()['accounts'], [])
@@ -0,0 +1,133 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.management import call_command
+from marketplace.models import SocialMediaAccount, Category, Order, OrderItem, Log
+from decimal import Decimal
+from io import StringIO
+
+
+class StockCounterTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Twitter')
+        self.account = SocialMediaAccount.objects.create(
+            title='Test Account',
+            category=self.category,
+            description='Test',
+            price=Decimal('1000.00'),
+        )
+
+    def assertStock(self, expected, account=None):
+        account = account or self.account
+        account.refresh_from_db()
+        self.assertEqual(account.stock, expected)
+
+    def test_creating_and_deleting_logs(self):
+        logs = [Log.objects.create(account=self.account, log_data=f'user{i}:pass') for i in range(3)]
+        Log.objects.create(account=self.account, log_data='sold', is_active=False)
+        self.assertStock(3)
+
+        logs[0].delete()
+        self.assertStock(2)
+
+        Log.objects.filter(pk=logs[1].pk).delete()
+        self.assertStock(1)
+
+    def test_toggling_and_moving_logs(self):
+        other = SocialMediaAccount.objects.create(
+            title='Other', category=self.category, description='Other', price=Decimal('10.00')
+        )
+        log = Log.objects.create(account=self.account, log_data='user:pass')
+
+        log = Log.objects.get(pk=log.pk)
+        log.is_active = False
+        log.save()
+        self.assertStock(0)
+
+        log.is_active = True
+        log.save()
+        self.assertStock(1)
+
+        log.account = other
+        log.save()
+        self.assertStock(0)
+        self.assertStock(1, other)
+
+    def test_account_save_keeps_stock(self):
+        stale = SocialMediaAccount.objects.get(pk=self.account.pk)
+        Log.objects.create(account=self.account, log_data='user:pass')
+
+        stale.price = Decimal('5.00')
+        stale.save()
+        self.assertStock(1)
+
+    def test_create_with_explicit_pk(self):
+        account = SocialMediaAccount(pk=9999, title='Imported', description='Test', price=Decimal('10.00'))
+        account.save()
+        self.assertStock(0, account)
+        SocialMediaAccount(pk=9998, title='Forced', description='Test', price=Decimal('10.00')).save(force_insert=True)
+        self.assertTrue(SocialMediaAccount.objects.filter(pk=9998).exists())
+
+    def test_allocation_releases_stock(self):
+        for i in range(5):
+            Log.objects.create(account=self.account, log_data=f'user{i}:pass')
+        order = Order.objects.create(total_amount=Decimal('2000.00'))
+        item = OrderItem.objects.create(order=order, account=self.account, quantity=2, price=Decimal('1000.00'))
+
+        self.assertEqual(len(item.get_allocated_logs()), 2)
+        self.assertStock(3)
+
+    def test_reconcile_stock(self):
+        Log.objects.create(account=self.account, log_data='user:pass')
+        SocialMediaAccount.objects.filter(pk=self.account.pk).update(stock=7)
+
+        out = StringIO()
+        call_command('reconcile_stock', '--dry-run', stdout=out)
+        self.assertIn('Accounts with drift: 1', out.getvalue())
+        self.assertStock(7)
+
+        call_command('reconcile_stock', '--batch-size', '1', stdout=StringIO())
+        self.assertStock(1)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class StockPollingTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Twitter')
+        self.accounts = [
+            SocialMediaAccount.objects.create(
+                title=f'Account {i}', category=category, description='Test', price=Decimal('100.00')
+            )
+            for i in range(3)
+        ]
+        for i in range(2):
+            Log.objects.create(account=self.accounts[0], log_data=f'user{i}:pass')
+        self.accounts[2].is_active = False
+        self.accounts[2].save()
+        Log.objects.create(account=self.accounts[2], log_data='user:pass')
+
+    def test_stock_for_many_accounts_in_one_query(self):
+        ids = ','.join(str(account.pk) for account in self.accounts)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('marketplace:stock'), {'ids': ids})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        accounts = response.json()['accounts']
+        self.assertEqual(accounts[str(self.accounts[0].pk)], {'stock': 2, 'price': '100.00'})
+        self.assertEqual(accounts[str(self.accounts[1].pk)]['stock'], 0)
+        # inactive accounts can't be bought
+        self.assertEqual(accounts[str(self.accounts[2].pk)]['stock'], 0)
+
+    def test_invalid_ids(self):
+        response = self.client.get(reverse('marketplace:stock'), {'ids': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_too_many_ids(self):
+        # duplicates count once, only unique ids past the limit are rejected
+        ids = ','.join([str(self.accounts[0].pk)] * 1000)
+        self.assertEqual(self.client.get(reverse('marketplace:stock'), {'ids': ids}).status_code, 200)
+
+        ids = ','.join(str(i) for i in range(1, 100001))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('marketplace:stock'), {'ids': ids})
+        self.assertEqual(response.status_code, 400)
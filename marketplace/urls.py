@@ -7,12 +7,21 @@ app_name = 'marketplace'
 urlpatterns = [
     path('', views.marketplace, name='home'),
     path('checkout/', views.checkout, name='checkout'),
+    path('buy_now/', views.buy_now, name='buy_now'),
     path('after_checkout/<int:order_id>/', views.after_checkout, name='after_checkout'),
+    path('order_status/<int:order_id>/', views.order_status, name='order_status'),
     path('view_all/<str:social_media>/', views.view_all, name='view_all'),
+    path('stock/', views.stock, name='stock'),
+    path('stock/events/', views.stock_events, name='stock_events'),
+    path('search/', views.search, name='search'),
+    path('reorder/', views.reorder, name='reorder'),
 
     path('password_confirm/<str:order_number>/', views.password_confirm, name='password_confirm'),
     path('confirm/payment/', views.confirm_payment, name='confirm_payment'),
     path('cancel/<str:order_number>/', views.cancel_order, name='cancel_order'),
     path('orders/', views.orders, name='orders'),
+    path('orders/more/', views.more_orders, name='more_orders'),
     path('order_details/<int:order_id>/', views.order_details, name='order_details'),
+    path('order_details/<int:order_id>/items/<int:item_id>/logs/', views.order_item_logs, name='order_item_logs'),
+    path('order_details/<int:order_id>/logs.<str:file_format>', views.download_logs, name='download_logs'),
 ]
\ No newline at end of file
@@ -1,20 +1,40 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from decimal import Decimal
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST, require_GET, require_http_methods
-from django.views.decorators.cache import cache_page
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseNotAllowed, Http404
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import require_POST, require_GET, require_http_methods, condition
+from django.views.decorators.cache import cache_page, cache_control
 from django.core.cache import cache
 from django.conf import settings
 import json
-from .models import SocialMediaAccount, Order, OrderItem
-from numerize.numerize import numerize
+import hashlib
+import re
+import asyncio
+from .models import SocialMediaAccount, Order, OrderItem, Log, SoldLog
+from .catalog import (
+    load_home_snapshot, load_category_snapshot, get_catalog_version,
+    category_snapshot_key, HOME_SNAPSHOT_KEY, serialize_account,
+    parse_account_filters, filter_category_accounts, ACCOUNT_SORTS,
+)
+from .search import search_accounts
+from .ordering import apply_ordering
+from .downloads import DOWNLOAD_FORMATS, iter_order_logs, stream_txt, stream_csv, stream_zip
+from .checkout import CartError, InsufficientFunds, parse_cart, place_order, buy_with_wallet
+from .reservations import InsufficientStock, with_available_stock, hold_order, release_order
+from .fulfillment import queue_fulfillment
+from .events import broker
 from core.models import Transaction, Wallet
+from core.idempotency import idempotent
 from core.cache_utils import cache_view_result, cache_queryset, invalidate_cache_pattern
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
 from django.contrib.auth import authenticate
 
-from django.db.models import Sum
+from django.db import transaction as db_transaction
+from django.db.models import Sum, Count, Q, Prefetch
+from datetime import datetime, timezone as dt_timezone
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
 
 import logging
@@ -22,121 +42,422 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _catalog_version(request, key):
+    """
+    Catalog version of a listing page for conditional GETs, memoized on the request.
+
+    Only anonymous pages are versioned, authenticated pages carry user
+    specific content (wallet, cart) that the catalog version doesn't cover.
+    """
+    if request.user.is_authenticated:
+        return None
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = get_catalog_version(key)
+    return request._catalog_version
+
+
+def _catalog_etag(request, key):
+    version = _catalog_version(request, key)
+    if version is None:
+        return None
+    # the snapshot revision and the query string, view_all filters on it. The
+    # page embeds a CSRF token but is sent with Vary: Cookie and kept out of
+    # shared caches, so the cookie stays out of the tag and a new or rotated
+    # token doesn't invalidate it
+    return hashlib.md5(f'{key}:{version[0]}:{request.GET.urlencode()}'.encode()).hexdigest()
+
+
+def _catalog_last_modified(request, key):
+    version = _catalog_version(request, key)
+    return version[1] if version else None
+
+
+@condition(
+    etag_func=lambda request, social_media: _catalog_etag(request, category_snapshot_key(social_media)),
+    last_modified_func=lambda request, social_media: _catalog_last_modified(request, category_snapshot_key(social_media)),
+)
 @cache_view_result(timeout=settings.CACHE_TIMEOUT_MEDIUM, key_prefix='view_all', cloudflare_aware=True)
 def view_all(request, social_media):
-    # Fetch accounts from the database with caching
-    cache_key = f'accounts_{social_media}'
-    accounts_queryset = SocialMediaAccount.objects.filter(is_active=True, category__slug=social_media)
-    # For authenticated users, use local caching; for anonymous users, rely on Cloudflare
-    force_local_cache = request.user.is_authenticated
-    accounts = cache_queryset(accounts_queryset, cache_key, timeout=settings.CACHE_TIMEOUT_MEDIUM, force_cache=force_local_cache)
-    accounts_data = []
-    
-    for account in accounts:
-        # format followers count to 1000 to 1k or 5000
-        followers_count = account.followers_count
-        try:
-            formatted_followers = numerize(followers_count, 2)
-        except:
-            formatted_followers = followers_count
-        
-        accounts_data.append({
-            'id': account.id,
-            'title': f"{account.social_media} | {formatted_followers} followers" if not account.title else account.title,
-            'description': account.description,
-            'price': account.price,
-            'stock': account.stock,
-            'inStock': account.is_in_stock,  # Use the property to check stock
-            'verification_status': f"{account.verification_status}".replace('_', ' '),
-            'account_age': account.account_age,
-        })
-    
-    return render(request, 'view_all.html', {'accounts': accounts_data, 'social_media': social_media})
+    # The accounts and facet counts are prepared when the catalog changes, see catalog.py
+    snapshot = load_category_snapshot(social_media)
+    filters = parse_account_filters(request.GET)
+    # Only filtered or sorted listings hit the database
+    accounts = filter_category_accounts(social_media, filters) if filters else snapshot['accounts']
+
+    return render(request, 'view_all.html', {
+        'accounts': accounts,
+        'social_media': social_media,
+        'facets': snapshot.get('facets', {}),
+        'filters': filters,
+        'sorts': ACCOUNT_SORTS,
+    })
 
     
+@condition(
+    etag_func=lambda request: _catalog_etag(request, HOME_SNAPSHOT_KEY),
+    last_modified_func=lambda request: _catalog_last_modified(request, HOME_SNAPSHOT_KEY),
+)
 @cache_view_result(timeout=settings.CACHE_TIMEOUT_LONG, key_prefix='marketplace', cloudflare_aware=True)
 def marketplace(request):
-    # Cache the main marketplace data
-    cache_key = 'marketplace_accounts_all'
-    accounts_queryset = SocialMediaAccount.objects.filter(is_active=True)
-    # For authenticated users, use local caching; for anonymous users, rely on Cloudflare
-    force_local_cache = request.user.is_authenticated
-    social_media_accounts = cache_queryset(accounts_queryset, cache_key, timeout=settings.CACHE_TIMEOUT_LONG, force_cache=force_local_cache)
-    grouped_accounts = []
-
-    # Group accounts by social media
-    social_media_dict = {}
-    social_media_with_slug = {}
-    for account in social_media_accounts:
-        social_media = account.social_media
-        slug = account.category.slug
-        social_media_with_slug[social_media] = slug
-        if social_media not in social_media_dict:
-            social_media_dict[social_media] = []
-        followers_count = account.followers_count
+    # The grouped accounts are prepared when the catalog changes, see catalog.py
+    snapshot = load_home_snapshot()
+    return render(request, 'marketplace.html', {'grouped_accounts': snapshot['grouped_accounts']})
+
+# Upper bound of ids accepted by a single stock poll or event stream
+STOCK_POLL_MAX_IDS = 100
+# Seconds between keep-alive comments on idle event streams
+STOCK_EVENTS_KEEPALIVE = 15
+# Reconnection delay suggested to EventSource clients
+STOCK_EVENTS_RETRY_MS = 5000
+
+
+def _parse_account_ids(request):
+    """
+    Unique account ids of a ?ids=1,2,3 query parameter, in order
+
+    Parsing stops at the first id past STOCK_POLL_MAX_IDS, so a huge query
+    string costs no more than a rejected one.
+    """
+    ids = {}
+    for match in re.finditer(r'[^,]+', request.GET.get('ids', '')):
+        value = match.group().strip()
+        if value.isdigit():
+            ids[int(value)] = None
+            if len(ids) > STOCK_POLL_MAX_IDS:
+                break
+    return list(ids)
+
+
+@require_GET
+@cache_control(public=True, max_age=5, s_maxage=5)
+def stock(request):
+    """
+    Current available stock and price of a list of accounts (?ids=1,2,3),
+    units held by unpaid orders are not counted.
+
+    Used by the listing pages and the cart to refresh stock without reloading
+    the page. Answered with a single query and cacheable for a few seconds,
+    so identical polls are collapsed at the edge.
+    """
+    ids = _parse_account_ids(request)
+    if not ids or len(ids) > STOCK_POLL_MAX_IDS:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Provide between 1 and {STOCK_POLL_MAX_IDS} account ids'
+        }, status=400)
+
+    accounts = {}
+    available_stock = with_available_stock(SocialMediaAccount.objects.filter(pk__in=ids))
+    for account_id, available, price, is_active in available_stock.values_list('id', 'available', 'price', 'is_active'):
+        accounts[account_id] = {
+            'stock': max(available, 0) if is_active else 0,
+            'price': price,
+        }
+
+    return JsonResponse({'status': 'success', 'accounts': accounts})
+
+async def stock_events(request):
+    """
+    Server-Sent Events stream of stock and price changes.
+
+    Subscribe to a category (?category=<slug>) and/or accounts (?ids=1,2,3).
+    Served by the ASGI application, an idle connection only costs a
+    coroutine and a bounded queue, see marketplace/events.py.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    # a WSGI worker would buffer the endless stream and hang
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Stock events are only available on the ASGI server'
+        }, status=503)
+
+    ids = _parse_account_ids(request)
+    category = request.GET.get('category') or None
+    if (not ids and not category) or len(ids) > STOCK_POLL_MAX_IDS:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Provide a category or between 1 and {STOCK_POLL_MAX_IDS} account ids'
+        }, status=400)
+
+    subscription = broker.subscribe(account_ids=set(ids) or None, category=category)
+
+    async def stream():
         try:
-            formatted_followers = numerize(followers_count, 2)
-        except:
-            formatted_followers = followers_count
-        social_media_dict[social_media].append({
-            'id': account.id,
-            'title': f"{account.social_media} | {formatted_followers} followers" if not account.title else account.title,
-            'description': account.description,
-            'price': account.price,
-            'stock': account.stock,
-            'inStock': account.is_in_stock,  # Use the property to check stock
-            'verification_status': f"{account.verification_status}".replace('_', ' '),
-            'account_age': account.account_age,
-        })
-
-    from .models import Category
-    # Get all categories ordered by position
-    categories: list[Category] = Category.objects.all()
-    
-    # Create a mapping of category name to their position
-    social_media_order = {cat.name: cat.position for cat in categories}
-    
-    # Sort the social_media_dict based on the category positions
-    social_media_dict = dict(sorted(
-        social_media_dict.items(),
-        key=lambda item: social_media_order.get(item[0], float('inf'))
-    ))
-    
+            yield f'retry: {STOCK_EVENTS_RETRY_MS}\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=STOCK_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # keep proxies from closing idle connections
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# Number of search results per page
+SEARCH_PAGE_SIZE = 20
 
-    # Convert to the desired structure
-    for name, accounts in social_media_dict.items():
-        slug = social_media_with_slug[name]
-        grouped_accounts.append({
-            "name": name,
-            "slug": slug,
-            "id": name,
-            "accounts": accounts[:8]  # Limit to 8 accounts per social media
-        })
 
-    return render(request, 'marketplace.html', {'grouped_accounts': grouped_accounts})
+@require_GET
+def search(request):
+    """
+    Ranked, paginated catalog search over account titles, descriptions and
+    category names (?q=...&page=N), backed by the full-text index in search.py.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    accounts, total = search_accounts(query, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE)
+
+    return JsonResponse({
+        'status': 'success',
+        'query': query,
+        'page': page,
+        'total': total,
+        'has_next': page * SEARCH_PAGE_SIZE < total,
+        'accounts': [
+            {**serialize_account(account), 'category': account.category.slug if account.category else None}
+            for account in accounts
+        ],
+    })
+
+@login_required
+@require_POST
+def reorder(request):
+    """
+    Apply a complete new ordering sent by the admin drag-and-drop page.
+
+    Body: {"categories": [every category id in order]} and/or
+    {"accounts": {"<category id>": [every account id of it in order]}}.
+    Everything is written in one transaction, see marketplace/ordering.py.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Staff only'}, status=403)
+
+    try:
+        data = json.loads(request.body)
+        categories, accounts = data.get('categories'), data.get('accounts')
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid request format'}, status=400)
+
+    # the same permissions the admin asks for to edit the rows
+    required = []
+    if categories is not None:
+        required.append('marketplace.change_category')
+    if accounts is not None:
+        required.append('marketplace.change_socialmediaaccount')
+    if not request.user.has_perms(required):
+        return JsonResponse({'status': 'error', 'message': 'You are not allowed to reorder the catalog'}, status=403)
+
+    try:
+        updated = apply_ordering(categories=categories, accounts=accounts)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({'status': 'success', 'updated': updated})
+
+def _visible_orders(request):
+    """Orders the user may look at: their own, or every order for staff"""
+    return Order.objects.all() if request.user.is_staff else Order.objects.filter(user=request.user)
+
+# Number of orders per page of the orders list
+ORDERS_PAGE_SIZE = 25
+
+
+def _order_cursor(order):
+    """Opaque keyset cursor of an order: created_at in microseconds and id"""
+    created_at = order.created_at.astimezone(dt_timezone.utc)
+    return f'{int(created_at.replace(microsecond=0).timestamp()) * 1_000_000 + created_at.microsecond}-{order.id}'
+
+
+def _orders_page(user, cursor=None):
+    """
+    (orders, next cursor) of a page of the orders of user, newest first
+
+    Keyset paginated on (created_at, id), so a page costs the same however far
+    down the list it is. Item counts come from the same query.
+    """
+    orders = (
+        Order.objects.filter(user=user)
+        .annotate(item_count=Count('items'))
+        .order_by('-created_at', '-id')
+    )
+    if cursor:
+        try:
+            micros, order_id = (int(part) for part in cursor.split('-'))
+            created_at = datetime.fromtimestamp(micros // 1_000_000, tz=dt_timezone.utc).replace(microsecond=micros % 1_000_000)
+        except (ValueError, OverflowError, OSError):
+            return [], None
+        orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+
+    page = list(orders[:ORDERS_PAGE_SIZE + 1])
+    has_next = len(page) > ORDERS_PAGE_SIZE
+    page = page[:ORDERS_PAGE_SIZE]
+    return page, _order_cursor(page[-1]) if has_next else None
+
 
 @login_required
 @require_http_methods(["GET"])
 def orders(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    total_orders = orders.count()
-    total_spent = orders.filter(status="completed").aggregate(Sum('total_amount'))['total_amount__sum'] or 0
+    orders, next_cursor = _orders_page(request.user)
+    # both statistics in one aggregate
+    totals = Order.objects.filter(user=request.user).aggregate(
+        total_orders=Count('id'),
+        total_spent=Sum('total_amount', filter=Q(status='completed')),
+    )
 
     context = {
         'orders': orders,
-        'total_orders': total_orders,
-        'total_spent': total_spent,
+        'next_cursor': next_cursor,
+        'total_orders': totals['total_orders'],
+        'total_spent': totals['total_spent'] or 0,
     }
     return render(request, 'orders.html', context)
 
+@login_required
+@require_GET
+def more_orders(request):
+    """The next page of the orders list (?after=<cursor>) as an HTML fragment"""
+    orders, next_cursor = _orders_page(request.user, request.GET.get('after'))
+    return JsonResponse({
+        'status': 'success',
+        'html': render_to_string('components/order_rows.html', {'orders': orders}, request=request),
+        'next': next_cursor,
+    })
+
+def _order_page_cache_key(kind, order_id, updated_at, *parts):
+    """
+    Cache key of a rendered part of a completed order page
+
+    updated_at is the content version: every save of the order moves it, and
+    the signals touch the order when an admin edits one of its items or logs.
+    """
+    return ':'.join(map(str, ('order_page', kind, order_id, f'{updated_at:%Y%m%d%H%M%S%f}', *parts)))
+
+
+def _render_order_body(request, order_id):
+    # one query for the items with their accounts and categories, logs are loaded per item on demand
+    items = OrderItem.objects.select_related('account__category').order_by('pk')
+    order = get_object_or_404(_visible_orders(request).prefetch_related(Prefetch('items', queryset=items)), id=order_id)
+    return render_to_string('components/order_body.html', {'order': order}, request=request)
+
+
 @login_required
 @require_http_methods(["GET"])
 def order_details(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    return render(request, 'order_details.html', {'order': order})
+    # the ownership check, it also says whether the page can come from the cache
+    order = _visible_orders(request).filter(id=order_id).values('id', 'order_number', 'status', 'updated_at').first()
+    if order is None:
+        raise Http404('Order not found')
+
+    if order['status'] != 'completed':
+        order_body = _render_order_body(request, order_id)
+    else:
+        # a completed order only changes on a refund or an admin edit, both move updated_at
+        key = _order_page_cache_key('body', order_id, order['updated_at'])
+        order_body = cache.get(key)
+        if order_body is None:
+            order_body = _render_order_body(request, order_id)
+            cache.set(key, str(order_body), settings.CACHE_TIMEOUT_VERY_LONG)
+
+    return render(request, 'order_details.html', {'order': order, 'order_body': mark_safe(order_body)})
+
+# Number of logs per fragment on the order page
+LOG_PAGE_SIZE = 50
+
+
+@login_required
+@require_GET
+def order_item_logs(request, order_id, item_id):
+    """
+    One page of the logs of an order item as an HTML fragment (?after=<last log id>),
+    keyset paginated on the log id over the live and archived logs.
+    """
+    order = OrderItem.objects.filter(
+        id=item_id, order__in=_visible_orders(request).filter(id=order_id)
+    ).values('order__status', 'order__updated_at').first()
+    if order is None:
+        raise Http404('Order item not found')
+    try:
+        after = max(int(request.GET.get('after', 0)), 0)
+    except ValueError:
+        after = 0
+
+    # the logs of a completed order don't change either, see order_details
+    key = None
+    if order['order__status'] == 'completed':
+        key = _order_page_cache_key('logs', order_id, order['order__updated_at'], item_id, after)
+        payload = cache.get(key)
+        if payload is not None:
+            return JsonResponse(payload)
+
+    logs = sorted(
+        [*Log.objects.filter(order_item_id=item_id, pk__gt=after).order_by('pk')[:LOG_PAGE_SIZE + 1],
+         *SoldLog.objects.filter(order_item_id=item_id, pk__gt=after).order_by('pk')[:LOG_PAGE_SIZE + 1]],
+        key=lambda log: log.pk,
+    )
+    page, has_next = logs[:LOG_PAGE_SIZE], len(logs) > LOG_PAGE_SIZE
+
+    payload = {
+        'status': 'success',
+        'html': render_to_string('components/log_list.html', {'logs': page}, request=request),
+        'next': page[-1].pk if has_next else None,
+    }
+    if key:
+        cache.set(key, payload, settings.CACHE_TIMEOUT_VERY_LONG)
+    return JsonResponse(payload)
+
+@login_required
+@require_GET
+def download_logs(request, order_id, file_format):
+    """
+    Stream the logs of an order as .txt, .csv or .zip.
+
+    Memory use is constant whatever the order size, see marketplace/downloads.py.
+    txt and csv downloads can be resumed with ?after=<id of the last log received>.
+    """
+    order = get_object_or_404(_visible_orders(request), id=order_id)
+    if file_format not in DOWNLOAD_FORMATS:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Unknown format, use one of {", ".join(DOWNLOAD_FORMATS)}'
+        }, status=404)
+
+    try:
+        after = max(int(request.GET.get('after', 0)), 0)
+    except ValueError:
+        after = 0
+
+    if file_format == 'zip':
+        content, content_type = stream_zip(order), 'application/zip'
+    elif file_format == 'csv':
+        content, content_type = stream_csv(iter_order_logs(order, after)), 'text/csv; charset=utf-8'
+    else:
+        content, content_type = stream_txt(iter_order_logs(order, after)), 'text/plain; charset=utf-8'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{order.order_number}.{file_format}"'
+    response['Cache-Control'] = 'private, no-store'
+    # resumed with ?after=<id> rather than byte ranges, the length isn't known up front
+    response['Accept-Ranges'] = 'none'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @login_required
 @require_POST
+@idempotent
 def checkout(request):
     
     if request.method != 'POST':
@@ -147,48 +468,99 @@ def checkout(request):
 
     try:
         cart_data = json.loads(request.POST.get('cart_data', '[]'))
-        
-        # Validate the cart data
-        if not cart_data:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'No items in cart'
-            }, status=400)
 
-        # Create an order in your database
-        order: Order = Order.objects.create(
-            user=request.user,  # Assuming you have a user object
-            total_amount=Decimal('0.00'),  # Initialize with a default value
-            status='pending'  # You can set this based on your workflow
-        )
-
-        # Create order items for each cart item
-        for item_data in cart_data:
-            item_data['quantity'] = int(item_data['quantity'])
-            account: SocialMediaAccount = SocialMediaAccount.objects.get(id=item_data['id'])
-            # validate stock
-            if account.stock < item_data['quantity']:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'Insufficient stock for {account.social_media}'
-                }, status=400)
-            
-            order_item: OrderItem = OrderItem.objects.create(
-                order=order,
-                account=account,
-                quantity=item_data['quantity'],
-                price=account.price
-            )
-            order.total_amount += order_item.subtotal
-            order.save()
+        # one atomic unit, see marketplace/checkout.py
+        order: Order = place_order(request.user, parse_cart(cart_data))
+
         # Redirect to checkout page with order data
         return redirect('marketplace:after_checkout', order_id=order.id)
     except Exception as e:
+        # CartError, InsufficientStock and malformed JSON alike
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+
+
+@login_required
+@require_POST
+@idempotent
+def buy_now(request):
+    """
+    Wallet-funded purchase in a single request
+
+    Takes {"items": [{"id": ..., "quantity": ...}, ...]} and, in one
+    transaction, checks the stock, creates the order, debits the wallet and
+    allocates the logs (see buy_with_wallet). Returns the completed order.
+    """
+    try:
+        data = json.loads(request.body)
+        quantities = parse_cart(data.get('items'))
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid request format'
+        }, status=400)
+    except CartError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+    try:
+        order: Order = buy_with_wallet(request.user, quantities)
+    except InsufficientFunds as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e),
+            'redirect_url': reverse('add_funds'),
+        }, status=402)
+    except InsufficientStock as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=409)
+    except CartError as e:
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         }, status=400)
+    except Exception:
+        logger.exception('Buy now failed')
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Payment processing failed'
+        }, status=500)
 
+    return JsonResponse({
+        'status': 'success',
+        'order_id': order.id,
+        'order_number': order.order_number,
+        'redirect_url': reverse('marketplace:order_details', args=[order.id])
+    })
+
+
+@login_required
+@require_GET
+def order_status(request, order_id):
+    """
+    Status of an order, polled by after_checkout while the logs are allocated
+
+    The poller stops on completed, and on refunded or failed (the logs could
+    not be allocated and the payment went back to the wallet).
+    """
+    status = _visible_orders(request).filter(id=order_id).values_list('status', flat=True).first()
+    if status is None:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Order not found'
+        }, status=404)
+    return JsonResponse({
+        'status': 'success',
+        'order_status': status,
+        'redirect_url': reverse('marketplace:order_details', args=[order_id]) if status == 'completed' else None,
+    })
 
 
 @login_required
@@ -201,6 +573,14 @@ def after_checkout(request, order_id):
     if order.status == 'completed':
         return render(request, 'after_checkout.html', {'order': order, 'is_paid': True})
 
+    # paid, the logs are being allocated, the page polls order_status
+    if order.status == 'processing' and order.transaction and order.transaction.status == 'success':
+        return render(request, 'after_checkout.html', {'order': order, 'is_paid': True, 'is_fulfilling': True})
+
+    # paid, but the logs could not be allocated and the payment was refunded
+    if order.status == 'refunded':
+        return render(request, 'after_checkout.html', {'order': order, 'is_paid': True, 'is_refunded': True})
+
 
     # site_url = request.build_absolute_uri('/')
     # callback_url = site_url + 'after_checkout/' + str(order_id) + '/'
@@ -230,9 +610,9 @@ def password_confirm(request, order_number):
                 description = "Pending payment for order #{}".format(order.order_number),
             )
             new_pending_transaction.save()
+            # the order stays pending until it is paid, queue_fulfillment() moves it on
             order.transaction = new_pending_transaction
-            order.status = 'processing'
-            order.save()
+            order.save(update_fields=['transaction', 'updated_at'])
         
         context = {
             'amount': order.total_amount,
@@ -244,6 +624,7 @@ def password_confirm(request, order_number):
 
 @login_required
 @require_http_methods(["POST"])
+@idempotent
 def confirm_payment(request):
     """
     Handle the transaction confirmation
@@ -279,25 +660,55 @@ def confirm_payment(request):
                 'errors': {'general': 'Insufficient Funds in Wallet, redirecting to topup page...'}
             }, status=400)
 
-        # Process payment
+        # get order
         try:
-            # Deduct from wallet
-            transaction_wallet.debit(transaction.amount, transaction)
-
-            # get order
             order: Order = Order.objects.get(order_number=order_number)
+        except Order.DoesNotExist:
+            return JsonResponse({
+                'status': 'error',
+                'errors': {'general': 'Order not found, Please try again'}
+            }, status=404)
 
-            # allocate logs to each order item
-            for order_item in order.items.all():
-                order_item.get_allocated_logs()
-
-            order.status = 'completed'
+        # the units must be held before any money moves, an expired hold is taken again if the stock allows
+        try:
+            hold_order(order)
+        except InsufficientStock as e:
+            order.status = 'failed'
             order.save()
+            transaction.status = 'failed'
+            transaction.save()
+            return JsonResponse({
+                'status': 'error',
+                'errors': {'general': f'{e}, your reservation expired and this order can no longer be paid'}
+            }, status=409)
+
+        # Process payment
+        try:
+            with db_transaction.atomic():
+                # only one confirmation of the transaction gets past this line
+                if not Transaction.objects.filter(pk=transaction.pk, status='pending').update(status='success'):
+                    return JsonResponse({
+                        'status': 'error',
+                        'errors': {'general': 'Transaction already processed or cancelled, Please try again'}
+                    }, status=400)
+
+                # Deduct from wallet, a conditional UPDATE that fails instead of overspending
+                transaction_wallet.debit(transaction.amount, transaction)
+
+                # the logs are allocated by manage.py run_fulfillment, see marketplace/fulfillment.py
+                queue_fulfillment(order)
 
             return JsonResponse({
                 'status': 'success',
                 'redirect_url': reverse('marketplace:after_checkout', args=[order.id])
             })
+        except ValueError:
+            # another payment spent the balance since it was checked above
+            return JsonResponse({
+                'status': 'error',
+                'redirect_url': reverse('add_funds'),
+                'errors': {'general': 'Insufficient Funds in Wallet, redirecting to topup page...'}
+            }, status=400)
         except Exception as e:
             print(e)
             return JsonResponse({
@@ -320,20 +731,24 @@ def confirm_payment(request):
 @login_required
 def cancel_order(request, order_number):
     """
-    Cancel a order
+    Cancel a pending order
+
+    Paid orders are left alone, the fulfillment worker completes them or
+    refunds the wallet (see marketplace/fulfillment.py).
     """
-    try:
-        order = Order.objects.get(
-            order_number=order_number,
-            user=request.user
-        )
-        order.status = 'cancelled'
-        order.save()
+    with db_transaction.atomic():
+        order = get_object_or_404(Order.objects.select_for_update(), order_number=order_number, user=request.user)
+        if order.status != 'pending':
+            return redirect('marketplace:order_details', order_id=order.id)
 
-        # make order.transaction as cancelled
-        order.transaction.status = 'cancelled'
-        order.transaction.save()
+        # the payment flips the same transaction from pending, only one of them gets past this line
+        if order.transaction_id and not Transaction.objects.filter(
+            pk=order.transaction_id, status='pending'
+        ).update(status='cancelled'):
+            return redirect('marketplace:order_details', order_id=order.id)
 
-        return redirect('marketplace:order_details', order_id=order.id)
-    except Order.DoesNotExist:
-        return redirect('marketplace:order_details', order_id=order.id)
\ No newline at end of file
+        order.status = 'cancelled'
+        order.save(update_fields=['status', 'updated_at'])
+        release_order(order)
+
+    return redirect('marketplace:order_details', order_id=order.id)
\ No newline at end of file
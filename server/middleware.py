@@ -1,4 +1,4 @@
-from django.utils.cache import patch_cache_control
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.http import HttpResponse
 from django.conf import settings
 
@@ -20,6 +20,19 @@ class CloudflareCacheMiddleware:
         if request.method != 'GET':
             return response
         
+        # Views that declared a public cache policy (e.g. the stock polling API)
+        # serve the same data to everyone, keep it as is
+        if 'public' in response.get('Cache-Control', ''):
+            return response
+        
+        # Catalog pages answer conditional GETs (ETag / Last-Modified from the
+        # catalog version), let the browser keep its copy and revalidate it.
+        # private because the page embeds the visitor's CSRF token.
+        if not request.user.is_authenticated and response.has_header('ETag'):
+            patch_cache_control(response, private=True, no_cache=True, must_revalidate=True)
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        
         # Don't cache for authenticated users OR pages with forms that need CSRF
         if request.user.is_authenticated or self._requires_csrf_protection(request.path):
             patch_cache_control(response, no_cache=True, no_store=True, must_revalidate=True)
@@ -151,6 +151,27 @@ CACHE_TIMEOUT_MEDIUM = 1800    # 30 minutes - for moderately changing data
 CACHE_TIMEOUT_LONG = 3600      # 1 hour - for rarely changing data
 CACHE_TIMEOUT_VERY_LONG = 86400  # 24 hours - for static-like data
 
+# Store Log.log_data zlib-compressed (see marketplace/fields.py)
+LOG_DATA_COMPRESSION = True
+
+# Sold logs older than this are moved to SoldLog by manage.py archive_sold_logs
+LOG_ARCHIVE_AFTER_DAYS = 30
+
+# Minutes checkout holds the stock of an order while it waits for payment
+STOCK_RESERVATION_MINUTES = 15
+
+# Hours a response is replayed to retries sent with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+
+# Seconds after which a key still marked in progress is taken over by a retry,
+# longer than the slowest idempotent request (payment gateway calls included)
+IDEMPOTENCY_KEY_LEASE_SECONDS = 60
+
+# Attempts at allocating the logs of a paid order before it is refunded, the
+# delay before a retry starts at FULFILLMENT_RETRY_SECONDS and doubles
+FULFILLMENT_MAX_ATTEMPTS = 5
+FULFILLMENT_RETRY_SECONDS = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators